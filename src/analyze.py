@@ -10,6 +10,18 @@ import seaborn as sns
 
 from faker import Faker
 
+from src.article_store import load_articles
+
+ANALYSIS_COLUMNS = ["title", "category", "text"]
+
+
+def load_dataset(source, categories=None):
+    """
+    Загружает статьи для анализа: из parquet-хранилища читаются только
+    колонки title, category и text (и только нужные категории).
+    """
+    return load_articles(source, columns=ANALYSIS_COLUMNS, categories=categories)
+
 
 def generate_news_dataset(filename="news_dataset.json"):
     """
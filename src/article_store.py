@@ -0,0 +1,176 @@
+"""
+Columnar on-disk storage for scraped articles.
+
+A store is a directory of Parquet parts sharing one schema
+(article_id, title, category, tags, text). Appending writes a new part, reading supports
+column projection and pushes a `category` filter down to the row groups.
+
+Usage:
+    python -m src.article_store convert data/reuters_articles_*.json --store data/reuters_store
+    python -m src.article_store bench data/reuters_articles_*.json --store data/reuters_store
+"""
+import argparse
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src.json_stream import iter_json_records
+from src.logger import setup_logger
+
+ARTICLE_COLUMNS = ['article_id', 'title', 'category', 'tags', 'text']
+ARTICLE_SCHEMA = pa.schema([(column, pa.string()) for column in ARTICLE_COLUMNS])
+
+
+def normalize_record(record: Dict) -> Dict:
+    """Brings an article or link record of any scraper to the store schema."""
+    tags = record.get('tags')
+    if isinstance(tags, (list, tuple)):
+        tags = ','.join(str(tag) for tag in tags)
+    return {
+        'article_id': record.get('article_id') or record.get('url'),
+        'title': record.get('title'),
+        'category': record.get('category'),
+        'tags': tags,
+        'text': record.get('text'),
+    }
+
+
+class ArticleStore:
+    def __init__(self, path: Union[str, Path], row_group_size: int = 10_000):
+        self.path = Path(path)
+        self.row_group_size = row_group_size
+
+    def _parts(self) -> List[Path]:
+        return sorted(self.path.glob('part-*.parquet'))
+
+    def append(self, records: Iterable[Dict]) -> int:
+        """Writes the records as a new part. Rows are sorted by category so row-group statistics can skip them."""
+        rows = [normalize_record(record) for record in records]
+        if not rows:
+            return 0
+        table = pa.Table.from_pylist(rows, schema=ARTICLE_SCHEMA).sort_by('category')
+
+        os.makedirs(self.path, exist_ok=True)
+        parts = self._parts()
+        next_idx = int(parts[-1].stem.split('-')[1]) + 1 if parts else 0
+        tmp_path = self.path / f'.part-{next_idx:05d}.tmp'
+        pq.write_table(table, tmp_path, compression='zstd', row_group_size=self.row_group_size)
+        os.replace(tmp_path, self.path / f'part-{next_idx:05d}.parquet')
+        return len(rows)
+
+    def _dataset(self) -> ds.Dataset:
+        return ds.dataset([str(part) for part in self._parts()], schema=ARTICLE_SCHEMA, format='parquet')
+
+    @staticmethod
+    def _filter(categories: Optional[Iterable[str]]):
+        return ds.field('category').isin(list(categories)) if categories is not None else None
+
+    def read(self, columns: Optional[List[str]] = None,
+             categories: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """Loads only the requested columns of the articles whose category is in `categories`."""
+        table = self._dataset().to_table(columns=columns, filter=self._filter(categories))
+        return table.to_pandas()
+
+    def iter_batches(self, columns: Optional[List[str]] = None, categories: Optional[Iterable[str]] = None,
+                     batch_size: int = 10_000) -> Iterator[pd.DataFrame]:
+        scanner = self._dataset().scanner(columns=columns, filter=self._filter(categories), batch_size=batch_size)
+        for batch in scanner.to_batches():
+            if batch.num_rows:
+                yield batch.to_pandas()
+
+    def count(self) -> int:
+        return sum(pq.ParquetFile(part).metadata.num_rows for part in self._parts())
+
+    def size_bytes(self) -> int:
+        return sum(part.stat().st_size for part in self._parts())
+
+
+def convert_json(paths: Iterable[Union[str, Path]], store: ArticleStore, batch_size: int = 50_000) -> int:
+    """Streams JSON/JSONL dumps of the scrapers into the store, batch_size records per part."""
+    total = 0
+    for path in paths:
+        batch = []
+        for record in iter_json_records(path):
+            batch.append(record)
+            if len(batch) == batch_size:
+                total += store.append(batch)
+                batch = []
+        total += store.append(batch)
+        logging.info(f"Converted {path} -> {store.path} ({total} articles so far)")
+    return total
+
+
+def load_articles(source: Union[str, Path], columns: Optional[List[str]] = None,
+                  categories: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """
+    Loads articles from a store directory or, for backwards compatibility, from a JSON dump.
+    Dumps are streamed: records of other categories and unrequested fields never reach the DataFrame.
+    """
+    source = Path(source)
+    if source.is_dir():
+        return ArticleStore(source).read(columns=columns, categories=categories)
+
+    categories = set(categories) if categories is not None else None
+    records = (record if columns is None else {column: record.get(column) for column in columns}
+               for record in iter_json_records(source)
+               if categories is None or record.get('category') in categories)
+    return pd.DataFrame.from_records(records, columns=columns)
+
+
+def category_counts(source: Union[str, Path]) -> pd.Series:
+    """Articles per category, reading only the category column (or field) of the source."""
+    source = Path(source)
+    if source.is_dir():
+        return ArticleStore(source).read(columns=['category'])['category'].value_counts()
+    counts = pd.Series([record.get('category') for record in iter_json_records(source)], dtype=object)
+    return counts.value_counts()
+
+
+def _bench(args) -> None:
+    store = ArticleStore(args.store)
+    json_size = sum(os.path.getsize(path) for path in args.paths)
+    logging.info(f"Size: JSON {json_size / 1024 ** 2:.1f} MB, store {store.size_bytes() / 1024 ** 2:.1f} MB")
+
+    start = time.perf_counter()
+    for path in args.paths:
+        pd.read_json(path, lines=path.endswith('.jsonl'))
+    logging.info(f"pd.read_json, all columns:  {time.perf_counter() - start:.3f}s")
+
+    start = time.perf_counter()
+    store.read()
+    logging.info(f"Store, all columns:         {time.perf_counter() - start:.3f}s")
+
+    start = time.perf_counter()
+    df = store.read(columns=['title', 'category'])
+    logging.info(f"Store, title+category:      {time.perf_counter() - start:.3f}s")
+
+    category = df['category'].mode().iloc[0]
+    start = time.perf_counter()
+    store.read(columns=['text', 'category'], categories=[category])
+    logging.info(f"Store, text where category={category!r}: {time.perf_counter() - start:.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['convert', 'bench'])
+    parser.add_argument('paths', nargs='+', help='JSON/JSONL article dumps')
+    parser.add_argument('--store', required=True, help='store directory')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        total = convert_json(args.paths, ArticleStore(args.store))
+        logging.info(f"Done: {total} articles in {args.store}")
+    else:
+        _bench(args)
+
+
+if __name__ == '__main__':
+    setup_logger(logging.INFO, stdout_log=True, file_log=False)
+    main()
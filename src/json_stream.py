@@ -0,0 +1,51 @@
+import json
+from pathlib import Path
+from typing import Iterator, Union
+
+_SEPARATORS = frozenset(' \t\r\n,[]')
+
+
+def iter_json_records(path: Union[str, Path], block_size: int = 1 << 20) -> Iterator[dict]:
+    """
+        Streams the objects of an article dump without loading the whole file.
+
+        Understands the formats the scrapers produce: a pretty-printed JSON array,
+        several arrays appended one after another, and JSON Lines.
+        Only `block_size` characters plus the record being decoded are held in memory.
+
+        Args:
+            path (Union[str, Path]): JSON or JSONL file with one object per article.
+            block_size (int): Number of characters read from disk at a time.
+
+        Yields:
+            dict: The next record of the file.
+
+        Example:
+            >> for article in iter_json_records("data/reuters_articles_world.json"):
+            >>     print(article["title"])
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buf, pos = '', 0
+        while True:
+            while pos < len(buf) and buf[pos] in _SEPARATORS:
+                pos += 1
+
+            if pos == len(buf):
+                buf, pos = f.read(block_size), 0
+                if not buf:
+                    return
+                continue
+
+            try:
+                record, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # The record is cut by the block boundary: keep its head and read further
+                chunk = f.read(block_size)
+                if not chunk:
+                    raise
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+
+            yield record
+            pos = end
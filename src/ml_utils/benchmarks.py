@@ -0,0 +1,524 @@
+"""
+Benchmarks for the preprocessing and training utilities.
+
+Run from the repository root, e.g.:
+    python -m src.ml_utils.benchmarks lemmatization --data data/reuters_articles_world.json --rows 500
+    python -m src.ml_utils.benchmarks near-duplicates --data data/reuters_articles_*.json --sample 500
+    python -m src.ml_utils.benchmarks selection --rows 100000 1000000
+    python -m src.ml_utils.benchmarks artifact --data data/reuters_articles_world.json --rows 200
+    python -m src.ml_utils.benchmarks scheduler --rows 1000 --cores 1 4
+    python -m src.ml_utils.benchmarks tuning --estimator ridge --trials 40
+    python -m src.ml_utils.benchmarks fold-cv --rows 500
+"""
+import argparse
+import glob
+import itertools
+import logging
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+from joblib.externals.loky import get_reusable_executor
+import pandas as pd
+from scipy import sparse
+from sklearn.compose import ColumnTransformer
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import RidgeClassifier, SGDClassifier
+from sklearn.experimental import enable_halving_search_cv  # noqa
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import HalvingRandomSearchCV, train_test_split
+from sklearn.naive_bayes import ComplementNB
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import LabelEncoder
+
+from src.logger import setup_logger
+from src.json_stream import iter_json_records
+from src.ml_utils.config import DedupParams, PreprocessParams, SelectionParams, TrainingParams, Classifier
+from src.ml_utils.feature_store import FeatureStore, iter_estimators
+from src.ml_utils.dedup import minhash_signatures, near_duplicate_clusters, shingles
+from src.ml_utils.scheduler import run_experiments
+from src.ml_utils.selection import select_articles
+from src.ml_utils.tuning import best_score_curve, optuna_search
+from src.ml_utils.transformers import SpacyModelMixin, TextCleaner, SpacyTokenizer, TokenProcessor
+from src.ml_utils.utils import get_feature_pipeline, make_cv_frame, partial_train_step, tuning_params_step
+
+
+def _load_frame(path: str, rows: int) -> pd.DataFrame:
+    df = pd.read_json(path).head(rows).reset_index(drop=True)
+    # Reuters dumps store tags as lists, the feature pipeline expects one string per article
+    df['tags'] = df['tags'].apply(lambda tags: ','.join(tags) if isinstance(tags, list) else str(tags))
+    return df
+
+
+def _load_texts(path: str, rows: int) -> pd.Series:
+    return _load_frame(path, rows)['text'].astype(str)
+
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_isolated(func, *args):
+    """Runs func in a fresh process so that its peak RSS is not polluted by earlier runs."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(func, *args).result()
+
+
+def _per_token_lemmas(processor: TokenProcessor, tokenized: pd.Series) -> pd.Series:
+    """Reference implementation: one full pipeline call per surviving token."""
+    def _process_row(row):
+        filtered = []
+        for token in row:
+            if len(token) < processor.params.min_token_length:
+                continue
+            if processor.params.remove_stopwords and token.lower() in processor.stopwords:
+                continue
+            filtered.append(processor.nlp(token)[0].lemma_)
+        return ' '.join(filtered)
+    return tokenized.apply(_process_row)
+
+
+def bench_lemmatization(args) -> None:
+    params = PreprocessParams(spacy_model=args.model, batch_size=args.batch_size, n_process=args.n_process)
+    texts = _load_texts(args.data, args.rows)
+    tokenized = SpacyTokenizer(params).transform(TextCleaner(params).transform(texts))
+    processor = TokenProcessor(params)
+
+    start = time.perf_counter()
+    before = _per_token_lemmas(processor, tokenized)
+    before_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    after = processor.transform(tokenized)
+    after_time = time.perf_counter() - start
+
+    logging.info(f"Per-token lemmatization: {len(texts) / before_time:.1f} docs/sec ({before_time:.2f}s)")
+    logging.info(f"Batched lemmatization:   {len(texts) / after_time:.1f} docs/sec ({after_time:.2f}s)")
+    logging.info(f"Speedup: x{before_time / after_time:.1f}, identical output: {before.equals(after)}")
+
+
+def _feature_matrix_memory(path: str, rows: int, model: str, dense: bool):
+    df = _load_frame(path, rows)
+    pipe = get_feature_pipeline(PreprocessParams(spacy_model=model))
+    if dense:
+        pipe.set_params(column_processor__tags_preprocess__sparse_output=False)
+    baseline_mb = _peak_rss_mb()
+
+    X = pipe.fit_transform(df.drop(columns=['category']))
+    if dense:
+        X = X.toarray()
+    X_train, X_test, _, _ = train_test_split(X, df['category'], test_size=0.2, random_state=42)
+
+    matrix_mb = (X.data.nbytes + X.indices.nbytes + X.indptr.nbytes if sparse.issparse(X) else X.nbytes) / 1024 ** 2
+    return X.shape, matrix_mb, _peak_rss_mb() - baseline_mb
+
+
+def bench_feature_memory(args) -> None:
+    for label, dense in (('dense (.toarray)', True), ('sparse CSR', False)):
+        shape, matrix_mb, peak_mb = _run_isolated(_feature_matrix_memory, args.data, args.rows, args.model, dense)
+        logging.info(f"{label:>16}: X{shape} takes {matrix_mb:.1f} MB, peak RSS growth {peak_mb:.1f} MB")
+
+
+def _feature_fit_time(path: str, rows: int, model: str, cores: int):
+    df = _load_frame(path, rows).drop(columns=['category'])
+    # The three column branches first, the cores left over go to the spaCy shards of each branch
+    params = PreprocessParams(spacy_model=model, n_shards=max(1, cores // min(cores, 3)))
+    column_processor = get_feature_pipeline(params, n_jobs=min(cores, 3)).named_steps['column_processor']
+    start = time.perf_counter()
+    column_processor.fit_transform(df)
+    fit_time = time.perf_counter() - start
+    # Idle loky workers would keep this isolated process from exiting
+    get_reusable_executor().shutdown(wait=True)
+    n_shards = column_processor.transformers[0][1].named_steps['processor'].params.n_shards
+    return fit_time, column_processor.n_jobs, n_shards
+
+
+def bench_feature_scaling(args) -> None:
+    base_time = None
+    for cores in args.cores:
+        fit_time, column_jobs, n_shards = _run_isolated(_feature_fit_time, args.data, args.rows, args.model, cores)
+        base_time = base_time or fit_time
+        # What ran: the shards are capped by the cores of this machine, not by the requested number
+        logging.info(f"{cores} cores requested ({column_jobs} column jobs x {n_shards} spaCy shards, "
+                     f"{os.cpu_count()} available): fit_transform {fit_time:.2f}s, "
+                     f"{args.rows / fit_time:.1f} docs/sec, speedup x{base_time / fit_time:.2f}")
+
+
+def _load_corpus(paths, rows_per_file: int) -> pd.DataFrame:
+    return pd.concat([_load_frame(path, rows_per_file) for path in paths], ignore_index=True)
+
+
+def bench_time_to_accuracy(args) -> None:
+    df = _load_corpus(args.data, args.rows)
+    X = get_feature_pipeline(PreprocessParams(spacy_model=args.model)).fit_transform(df.drop(columns=['category']))
+    X_train, X_test, y_train, y_test = train_test_split(X, df['category'], test_size=0.2, random_state=42)
+    train_params = TrainingParams(chunk_size=args.chunk_size, epochs=1)
+
+    start = time.perf_counter()
+    full = SGDClassifier(random_state=42).fit(X_train, y_train)
+    full_time = time.perf_counter() - start
+    logging.info(f"Full refit: {full_time:.2f}s, accuracy {accuracy_score(y_test, full.predict(X_test)):.3f}")
+
+    clf = Classifier(name='SGDClassifier', estim=SGDClassifier(random_state=42))
+    elapsed = 0.0
+    for epoch in range(args.epochs):
+        train_params.random_state = 42 + epoch
+        start = time.perf_counter()
+        partial_train_step(X_train, y_train, clf, train_params)
+        elapsed += time.perf_counter() - start
+        accuracy = accuracy_score(y_test, clf.estim.predict(X_test))
+        logging.info(f"partial_fit epoch {epoch + 1}: {elapsed:.2f}s, accuracy {accuracy:.3f}")
+
+
+def _cluster_pairs(labels: np.ndarray) -> set:
+    groups = {}
+    for i, label in enumerate(labels):
+        groups.setdefault(label, []).append(i)
+    return {pair for members in groups.values() for pair in itertools.combinations(members, 2)}
+
+
+def _exact_pairs(texts, params: DedupParams) -> set:
+    """Reference: exact Jaccard similarity of the shingle sets of every pair of texts."""
+    sets = [shingles(text, params.shingle_size) for text in texts]
+    pairs = set()
+    for i, j in itertools.combinations(range(len(sets)), 2):
+        if not len(sets[i]) or not len(sets[j]):
+            continue
+        common = len(np.intersect1d(sets[i], sets[j], assume_unique=True))
+        if common / (len(sets[i]) + len(sets[j]) - common) >= params.threshold:
+            pairs.add((i, j))
+    return pairs
+
+
+def bench_near_duplicates(args) -> None:
+    paths = sorted(path for pattern in args.data for path in glob.glob(pattern))
+    texts = [str(record.get('text') or '') for path in paths for record in iter_json_records(path)]
+    params = DedupParams(threshold=args.threshold, num_perm=args.num_perm, shingle_size=args.shingle_size)
+
+    start = time.perf_counter()
+    signatures = minhash_signatures(texts, params)
+    signature_time = time.perf_counter() - start
+    start = time.perf_counter()
+    labels = near_duplicate_clusters(signatures, params)
+    lsh_time = time.perf_counter() - start
+    logging.info(f"MinHash+LSH on {len(texts)} articles: signatures {signature_time:.2f}s, LSH {lsh_time:.2f}s, "
+                 f"{int((labels != np.arange(len(labels))).sum())} near-duplicates")
+
+    sample = texts[:args.sample]
+    start = time.perf_counter()
+    exact = _exact_pairs(sample, params)
+    exact_time = time.perf_counter() - start
+    found = _cluster_pairs(near_duplicate_clusters(minhash_signatures(sample, params), params))
+    recall = len(found & exact) / len(exact) if exact else 1.0
+    precision = len(found & exact) / len(found) if found else 1.0
+    logging.info(f"Exact pairwise Jaccard on {len(sample)} articles: {exact_time:.2f}s "
+                 f"(~{exact_time * (len(texts) / max(len(sample), 1)) ** 2:.0f}s for all), {len(exact)} pairs; "
+                 f"LSH recall {recall:.3f}, precision {precision:.3f}")
+
+
+def _apply_top_n(df: pd.DataFrame, n: int) -> pd.DataFrame:
+    """Reference implementation: per-row membership test through Series.apply."""
+    top_n_categories = df['category'].value_counts().head(n).index.tolist()
+    return df[df['category'].apply(lambda x: x in top_n_categories)]
+
+
+def _synthetic_articles(rows: int, categories: int, seed: int = 42) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    # Zipf-like class sizes, as in the scraped corpora
+    weights = 1 / np.arange(1, categories + 1)
+    codes = rng.choice(categories, size=rows, p=weights / weights.sum())
+    return pd.DataFrame({
+        'article_id': [f'https://example.com/{i}' for i in range(rows)],
+        'category': np.array([f'category_{i}' for i in range(categories)], dtype=object)[codes],
+        'title': 'title',
+    })
+
+
+def _timed(func, *args) -> tuple:
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_selection(args) -> None:
+    for rows in args.rows:
+        df = _synthetic_articles(rows, args.categories)
+        before, before_time = _timed(_apply_top_n, df, args.top_n)
+        after, after_time = _timed(select_articles, df, SelectionParams(top_n=args.top_n))
+        logging.info(f"{rows} rows, top {args.top_n} of {args.categories} categories: apply {before_time:.3f}s, "
+                     f"masks {after_time:.3f}s (x{before_time / after_time:.1f}), "
+                     f"identical: {before.index.equals(after.index)}")
+        capped, capped_time = _timed(select_articles, df, SelectionParams(top_n=args.top_n, max_per_class=args.cap))
+        sampled, sampled_time = _timed(select_articles, df, SelectionParams(sample_frac=0.1))
+        logging.info(f"{rows} rows: cap {args.cap}/class {capped_time:.3f}s ({len(capped)} rows), "
+                     f"10% sample {sampled_time:.3f}s ({len(sampled)} rows)")
+
+
+def _tokenizer_pipeline(params: PreprocessParams) -> Pipeline:
+    """title/text branches built from the separate SpacyTokenizer and TokenProcessor stages."""
+    def _branch():
+        return Pipeline([('cleaner', TextCleaner(params)), ('tokenizer', SpacyTokenizer(params)),
+                         ('processor', TokenProcessor(params)), ('vectorizer', TfidfVectorizer())])
+    return Pipeline([('column_processor', ColumnTransformer([
+        ('text_pipeline', _branch(), 'text'),
+        ('title_pipeline', _branch(), 'title'),
+    ]))])
+
+
+def _cold_load(path: str, sample: pd.DataFrame) -> tuple:
+    start = time.perf_counter()
+    pipe = joblib.load(path)
+    loaded = time.perf_counter() - start
+    pipe.transform(sample)  # a lazy model is loaded here
+    return loaded, time.perf_counter() - start
+
+
+def bench_artifact(args) -> None:
+    df = _load_frame(args.data, args.rows)
+    pipe = _tokenizer_pipeline(PreprocessParams(spacy_model=args.model))
+    pipe.fit(df)
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, embed_model in (('spaCy model pickled', True), ('model name only', False)):
+            path = os.path.join(tmp, f'x_pipe_{embed_model}.pkl')
+            for _, estimator in iter_estimators(pipe):
+                if isinstance(estimator, SpacyModelMixin):
+                    if embed_model:
+                        # What the transformers used to keep on the instance
+                        estimator.__dict__['nlp'] = estimator.nlp
+                    else:
+                        estimator.__dict__.pop('nlp', None)
+            joblib.dump(pipe, path)
+            loaded, first_transform = _run_isolated(_cold_load, path, df.head(1))
+            logging.info(f"{label:>19}: x_pipe.pkl {os.path.getsize(path) / 1024 ** 2:.1f} MB, "
+                         f"cold load {loaded:.2f}s, load + first transform {first_transform:.2f}s")
+
+
+def _model_zoo():
+    return [
+        Classifier(name='RandomForestClassifier', estim=RandomForestClassifier(n_estimators=200, random_state=42)),
+        Classifier(name='KNeighborsClassifier', estim=KNeighborsClassifier(),
+                   param_grid={'n_neighbors': [3, 5, 7, 9], 'weights': ['uniform', 'distance']}, tuning_params=True),
+        Classifier(name='RidgeClassifier', estim=RidgeClassifier(random_state=42)),
+        Classifier(name='SGDClassifier', estim=SGDClassifier(random_state=42)),
+        Classifier(name='ComplementNB', estim=ComplementNB()),
+    ]
+
+
+def bench_scheduler(args) -> None:
+    df = _load_corpus(args.data, args.rows)
+    params = PreprocessParams(spacy_model=args.model)
+    pipe = get_feature_pipeline(params)
+    label_encoder = LabelEncoder()
+    y = label_encoder.fit_transform(df['category'].astype(str))
+    X = pipe.fit_transform(df.drop(columns=['category']))
+    train_params = TrainingParams(verbose=False)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = FeatureStore(os.path.join(tmp, 'store'))
+        store.save('bench', X, y, params, pipe=pipe, label_encoder=label_encoder)
+        for cores in args.cores:
+            start = time.perf_counter()
+            results = run_experiments(_model_zoo(), store.root, 'bench', params, train_params, max_cores=cores,
+                                      save_root=os.path.join(tmp, f'pretrained_{cores}'))
+            wall = time.perf_counter() - start
+            fit_sum = sum(result.get('fit_seconds', 0.0) for result in results)
+            logging.info(f"{cores} cores: model zoo in {wall:.2f}s wall time, sum of fit times {fit_sum:.2f}s")
+
+
+# The grids of main.ipynb
+_TUNING_GRIDS = {
+    'ridge': (RidgeClassifier(random_state=42), {
+        'alpha': [0.01, 0.1, 0.5, 1.0, 10.0, 100.0],
+        'fit_intercept': [True, False],
+        'class_weight': [None, 'balanced'],
+    }),
+    'rf': (RandomForestClassifier(random_state=42), {
+        'n_estimators': [50, 100, 200, 300],
+        'criterion': ['gini', 'entropy'],
+        'max_depth': [None, 10, 20, 30, 40],
+        'min_samples_split': [2, 5, 10],
+        'min_samples_leaf': [1, 2, 4],
+        'max_features': ['auto', 'sqrt', 'log2'],
+        'bootstrap': [True, False],
+        'class_weight': [None, 'balanced', 'balanced_subsample'],
+        'oob_score': [True, False]
+    }),
+}
+
+
+def bench_tuning(args) -> None:
+    df = _load_corpus(args.data, args.rows)
+    X = get_feature_pipeline(PreprocessParams(spacy_model=args.model)).fit_transform(df.drop(columns=['category']))
+    X_train, X_test, y_train, y_test = train_test_split(X, df['category'].astype(str).to_numpy(),
+                                                        test_size=0.2, random_state=42)
+    estimator, grid = _TUNING_GRIDS[args.estimator]
+
+    # The search tuning_params_step runs; its per-iteration time is estimated from cv_results_
+    halving = HalvingRandomSearchCV(estimator, grid, n_candidates='exhaust', factor=2, resource='n_samples',
+                                    min_resources='smallest', cv=3, scoring='accuracy', random_state=42,
+                                    error_score=np.nan)
+    start = time.perf_counter()
+    halving.fit(X_train, y_train)
+    halving_time = time.perf_counter() - start
+    results = pd.DataFrame(halving.cv_results_)
+    results['cost'] = (results['mean_fit_time'] + results['mean_score_time']) * 3
+    elapsed = 0.0
+    for iteration, group in results.groupby('iter'):
+        elapsed += group['cost'].sum()
+        logging.info(f"halving iteration {iteration}: ~{elapsed:.1f}s, {len(group)} candidates on "
+                     f"{group['n_resources'].iloc[0]} samples, best CV score {group['mean_test_score'].max():.4f}")
+    halving_accuracy = accuracy_score(y_test, halving.best_estimator_.predict(X_test))
+    logging.info(f"halving: {halving_time:.1f}s wall time, test accuracy {halving_accuracy:.4f}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        clf = Classifier(name=args.estimator, estim=estimator, param_grid=grid, tuning_params=True)
+        train_params = TrainingParams(tuning_engine='optuna', n_trials=args.trials, n_jobs=args.jobs,
+                                      tuning_storage=os.path.join(tmp, 'tuning.db'), verbose=False)
+        start = time.perf_counter()
+        best_estimator, _, study = optuna_search(clf, train_params, X_train, y_train)
+        optuna_time = time.perf_counter() - start
+        for row in best_score_curve(study).itertuples():
+            logging.info(f"optuna trial {row.trial}: {row.seconds:.1f}s, best CV score {row.best_score:.4f}")
+        optuna_accuracy = accuracy_score(y_test, best_estimator.fit(X_train, y_train).predict(X_test))
+        logging.info(f"optuna: {optuna_time:.1f}s wall time, test accuracy {optuna_accuracy:.4f}")
+
+
+def _timed_search(clf: Classifier, X, y, cv_frame=None) -> tuple:
+    start = time.perf_counter()
+    _, best_params = tuning_params_step(clf, TrainingParams(verbose=False), X, y, cv_frame=cv_frame)
+    return time.perf_counter() - start, best_params
+
+
+def bench_fold_cv(args) -> None:
+    df = _load_corpus(args.data, args.rows)
+    X, y = df.drop(columns=['category']), df['category'].astype(str).to_numpy()
+    estimator, grid = _TUNING_GRIDS['ridge']
+    clf = Classifier(name='RidgeClassifier', estim=estimator, param_grid=grid, tuning_params=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Today: one pipeline fitted on all rows, the folds share its vocabulary
+        params = PreprocessParams(spacy_model=args.model)
+        start = time.perf_counter()
+        X_leaky = get_feature_pipeline(params).fit_transform(X)
+        vectorize_time = time.perf_counter() - start
+        search_time, _ = _timed_search(clf, X_leaky, y)
+        logging.info(f"leaky: {vectorize_time + search_time:.1f}s (vectorize {vectorize_time:.1f}s, search {search_time:.1f}s)")
+
+        if not args.skip_naive:
+            # Correct CV the straightforward way: the whole feature pipeline, spaCy included, refit per fold
+            naive = Classifier(name='RidgeClassifier', estim=Pipeline([('features', get_feature_pipeline(params)),
+                                                                       ('clf', estimator)]),
+                               param_grid={f'clf__{name}': values for name, values in grid.items()}, tuning_params=True)
+            search_time, _ = _timed_search(naive, X, y)
+            logging.info(f"per-fold full pipeline: {search_time:.1f}s")
+
+        # Fold-aware: spaCy once (through the preprocessing cache), vectorizers refit per fold and memoized
+        params = PreprocessParams(spacy_model=args.model, fold_aware=True, cache_dir=os.path.join(tmp, 'cache'))
+        pipe = get_feature_pipeline(params)
+        for run in ('cold', 'warm'):
+            start = time.perf_counter()
+            cv_frame = make_cv_frame(pipe, pipe.named_steps['preprocess'].transform(X), params)
+            preprocess_time = time.perf_counter() - start
+            search_time, _ = _timed_search(clf, None, y, cv_frame=cv_frame)
+            logging.info(f"fold-aware, {run} caches: {preprocess_time + search_time:.1f}s "
+                         f"(preprocess {preprocess_time:.1f}s, search {search_time:.1f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    lemma_parser = subparsers.add_parser('lemmatization', help='TokenProcessor docs/sec, per-token vs batched')
+    lemma_parser.add_argument('--data', default='data/reuters_articles_world.json')
+    lemma_parser.add_argument('--rows', type=int, default=500)
+    lemma_parser.add_argument('--model', default='en_core_web_sm')
+    lemma_parser.add_argument('--batch-size', type=int, default=1000)
+    lemma_parser.add_argument('--n-process', type=int, default=1)
+    lemma_parser.set_defaults(func=bench_lemmatization)
+
+    memory_parser = subparsers.add_parser('feature-memory', help='Peak RSS of the dense vs sparse feature path')
+    memory_parser.add_argument('--data', default='data/reuters_articles_world.json')
+    memory_parser.add_argument('--rows', type=int, default=1000)
+    memory_parser.add_argument('--model', default='en_core_web_sm')
+    memory_parser.set_defaults(func=bench_feature_memory)
+
+    scaling_parser = subparsers.add_parser('feature-scaling', help='Feature pipeline fit time vs number of cores')
+    scaling_parser.add_argument('--data', default='data/reuters_articles_world.json')
+    scaling_parser.add_argument('--rows', type=int, default=1000)
+    scaling_parser.add_argument('--model', default='en_core_web_sm')
+    scaling_parser.add_argument('--cores', type=int, nargs='+', default=[1, 2, 4, 8])
+    scaling_parser.set_defaults(func=bench_feature_scaling)
+
+    incremental_parser = subparsers.add_parser('time-to-accuracy', help='partial_fit epochs vs full refit')
+    incremental_parser.add_argument('--data', nargs='+', default=[
+        'data/reuters_articles_world.json', 'data/reuters_articles_business.json', 'data/reuters_articles_tech.json'
+    ])
+    incremental_parser.add_argument('--rows', type=int, default=1000, help='rows per file')
+    incremental_parser.add_argument('--model', default='en_core_web_sm')
+    incremental_parser.add_argument('--chunk-size', type=int, default=256)
+    incremental_parser.add_argument('--epochs', type=int, default=5)
+    incremental_parser.set_defaults(func=bench_time_to_accuracy)
+
+    dedup_parser = subparsers.add_parser('near-duplicates', help='MinHash+LSH vs exact pairwise Jaccard')
+    dedup_parser.add_argument('--data', nargs='+', default=['data/reuters_articles_*.json'])
+    dedup_parser.add_argument('--sample', type=int, default=500, help='articles for the exact quadratic reference')
+    dedup_parser.add_argument('--threshold', type=float, default=0.8)
+    dedup_parser.add_argument('--num-perm', type=int, default=128)
+    dedup_parser.add_argument('--shingle-size', type=int, default=5)
+    dedup_parser.set_defaults(func=bench_near_duplicates)
+
+    selection_parser = subparsers.add_parser('selection', help='top-N filter, per-class cap and sampling speed')
+    selection_parser.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000])
+    selection_parser.add_argument('--categories', type=int, default=40)
+    selection_parser.add_argument('--top-n', type=int, default=5)
+    selection_parser.add_argument('--cap', type=int, default=5000, help='max articles per class')
+    selection_parser.set_defaults(func=bench_selection)
+
+    artifact_parser = subparsers.add_parser('artifact', help='x_pipe.pkl size and cold-load time')
+    artifact_parser.add_argument('--data', default='data/reuters_articles_world.json')
+    artifact_parser.add_argument('--rows', type=int, default=200)
+    artifact_parser.add_argument('--model', default='en_core_web_sm')
+    artifact_parser.set_defaults(func=bench_artifact)
+
+    scheduler_parser = subparsers.add_parser('scheduler', help='Model zoo wall time vs the core budget')
+    scheduler_parser.add_argument('--data', nargs='+', default=[
+        'data/reuters_articles_world.json', 'data/reuters_articles_business.json', 'data/reuters_articles_tech.json'
+    ])
+    scheduler_parser.add_argument('--rows', type=int, default=1000, help='rows per file')
+    scheduler_parser.add_argument('--model', default='en_core_web_sm')
+    scheduler_parser.add_argument('--cores', type=int, nargs='+', default=[1, 4])
+    scheduler_parser.set_defaults(func=bench_scheduler)
+
+    tuning_parser = subparsers.add_parser('tuning', help='Best score vs wall time, halving search vs optuna')
+    tuning_parser.add_argument('--data', nargs='+', default=[
+        'data/reuters_articles_world.json', 'data/reuters_articles_business.json', 'data/reuters_articles_tech.json'
+    ])
+    tuning_parser.add_argument('--rows', type=int, default=1000, help='rows per file')
+    tuning_parser.add_argument('--model', default='en_core_web_sm')
+    tuning_parser.add_argument('--estimator', choices=sorted(_TUNING_GRIDS), default='ridge')
+    tuning_parser.add_argument('--trials', type=int, default=40)
+    tuning_parser.add_argument('--jobs', type=int, default=1, help='optuna worker processes')
+    tuning_parser.set_defaults(func=bench_tuning)
+
+    fold_parser = subparsers.add_parser('fold-cv', help='Leaky vs per-fold vs fold-aware cached CV cost')
+    fold_parser.add_argument('--data', nargs='+', default=[
+        'data/reuters_articles_world.json', 'data/reuters_articles_business.json', 'data/reuters_articles_tech.json'
+    ])
+    fold_parser.add_argument('--rows', type=int, default=500, help='rows per file')
+    fold_parser.add_argument('--model', default='en_core_web_sm')
+    fold_parser.add_argument('--skip-naive', action='store_true', help='skip the full pipeline per fold reference')
+    fold_parser.set_defaults(func=bench_fold_cv)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    setup_logger(logging.INFO, stdout_log=True, file_log=False)
+    main()
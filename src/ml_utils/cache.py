@@ -0,0 +1,101 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+
+def content_key(text: str, fingerprint: Dict) -> str:
+    """Content address of a text processed with the settings described by fingerprint."""
+    digest = hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(text.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class TextCache:
+    """
+    Persistent key -> text store backed by a single SQLite file.
+
+    Entries are evicted in least-recently-used order once the stored values exceed `max_size_mb`.
+    The connection is opened lazily, so the cache can be pickled together with a pipeline
+    and shared by several worker processes.
+    """
+    _QUERY_CHUNK = 500
+
+    def __init__(self, cache_dir: str, max_size_mb: int = 1024, name: str = 'text_cache'):
+        self.path = Path(cache_dir) / f'{name}.sqlite'
+        self.max_bytes = max_size_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        return state
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.path.parent, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=60)
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+            self._conn.commit()
+        return self._conn
+
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        for i in range(0, len(unique_keys), self._QUERY_CHUNK):
+            chunk = unique_keys[i:i + self._QUERY_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(f'SELECT key, value FROM entries WHERE key IN ({placeholders})', chunk)
+            found.update(rows.fetchall())
+
+        if found:
+            now = time.time()
+            self.conn.executemany('UPDATE entries SET accessed = ? WHERE key = ?', [(now, key) for key in found])
+            self.conn.commit()
+
+        self.hits += len(found)
+        self.misses += len(unique_keys) - len(found)
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, str]]) -> None:
+        now = time.time()
+        rows = [(key, value, len(value.encode('utf-8')), now) for key, value in items]
+        self.conn.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', rows)
+        self.conn.commit()
+        self._evict()
+
+    def size_bytes(self) -> int:
+        return self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def _evict(self) -> None:
+        excess = self.size_bytes() - self.max_bytes
+        if excess <= 0:
+            return
+
+        stale, freed = [], 0
+        for key, size in self.conn.execute('SELECT key, size FROM entries ORDER BY accessed ASC'):
+            stale.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self.conn.executemany('DELETE FROM entries WHERE key = ?', stale)
+        self.conn.commit()
+        logging.info(f'{self.path.name}: evicted {len(stale)} entries ({freed / 1024 ** 2:.1f} MB)')
+
+    def log_stats(self) -> None:
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        logging.info(f'{self.path.name}: {self.hits} hits, {self.misses} misses ({hit_rate:.1%} hit rate), '
+                     f'{self.size_bytes() / 1024 ** 2:.1f}/{self.max_bytes / 1024 ** 2:.0f} MB used')
@@ -1,5 +1,5 @@
 from dataclasses import dataclass, field
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 from sklearn.base import BaseEstimator
 
 @dataclass
@@ -12,14 +12,48 @@ class PreprocessParams:
     stem: bool = False
     lowercase: bool = True
     min_token_length: int = 2
+    batch_size: int = 1000
+    n_process: int = 1
+    n_shards: int = 1  # row shards per spaCy stage, each in its own process; capped by the cores left
+    cache_dir: Optional[str] = None
+    cache_max_size_mb: int = 1024
+    vectorizer: str = "tfidf"  # "tfidf" or "hashing" (streaming, bounded memory)
+    n_features: int = 2 ** 20
+    n_tag_features: int = 2 ** 12
+    fold_aware: bool = False  # spaCy/cleaning run once before the split, CV folds refit only the vectorizers
     verbose: bool = False
 
+@dataclass
+class SelectionParams:
+    top_n: Optional[int] = None  # keep the n most frequent categories
+    categories: Optional[List[str]] = None  # or an explicit list
+    max_per_class: Optional[int] = None  # stratified down-sampling cap
+    sample_frac: Optional[float] = None  # deterministic subsample of what is left
+    id_column: Optional[str] = "article_id"  # hashed for stable sampling, None for a seeded shuffle
+    random_state: int = 42
+
+@dataclass
+class DedupParams:
+    column: str = "text"
+    threshold: float = 0.8  # estimated Jaccard similarity of shingle sets
+    num_perm: int = 128
+    shingle_size: int = 5  # words per shingle
+    seed: int = 42
+
 @dataclass
 class TrainingParams:
     test_size: float = 0.2
     random_state: int = 42
     shuffle_split: bool = True
     n_jobs: int = 1
+    max_dense_memory_mb: int = 4096
+    chunk_size: int = 1000
+    epochs: int = 1
+    checkpoint_every: int = 10
+    tuning_engine: str = "halving"  # "halving" (HalvingRandomSearchCV) or "optuna" (pruned, resumable trial DB)
+    n_trials: int = 100  # optuna: trials of the whole study, the ones of earlier runs count too
+    tuning_timeout: Optional[float] = None  # optuna: seconds per run
+    tuning_storage: Optional[str] = None  # optuna: SQLite trial DB, ROOT_DIR/tuning.db by default
     verbose: bool = True
 
 @dataclass
@@ -28,4 +62,5 @@ class Classifier:
     estim: BaseEstimator
     param_grid: Optional[Dict] = field(default=None)
     tuning_params: bool = field(default=False)
-    cv: int = field(default=3)
\ No newline at end of file
+    cv: int = field(default=3)
+    dense_input: bool = field(default=False)
@@ -0,0 +1,137 @@
+import logging
+import re
+import zlib
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+from src.ml_utils.config import DedupParams
+
+_WORD_RE = re.compile(r'\w+')
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_SHINGLE_BASE = np.uint64(1_000_003)
+
+
+def shingles(text: str, size: int) -> np.ndarray:
+    """32-bit hashes of the word `size`-grams of a text (the whole text for shorter ones)."""
+    words = _WORD_RE.findall(str(text).lower())
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    word_hashes = np.fromiter((zlib.crc32(word.encode('utf-8')) for word in words), dtype=np.uint64, count=len(words))
+    size = min(size, len(words))
+    # Polynomial hash of every window, computed column by column instead of per shingle
+    hashes = np.zeros(len(words) - size + 1, dtype=np.uint64)
+    for offset in range(size):
+        hashes = hashes * _SHINGLE_BASE + word_hashes[offset:offset + len(hashes)]
+    return np.unique((hashes >> np.uint64(32)) ^ (hashes & _MAX_HASH))
+
+
+def _permutations(params: DedupParams):
+    rng = np.random.default_rng(params.seed)
+    a = rng.integers(1, int(_MERSENNE_PRIME), size=params.num_perm, dtype=np.uint64)
+    b = rng.integers(0, int(_MERSENNE_PRIME), size=params.num_perm, dtype=np.uint64)
+    return a[:, None], b[:, None]
+
+
+def minhash_signatures(texts: Iterable[str], params: DedupParams) -> np.ndarray:
+    """
+    MinHash signature of every text, shape (n_texts, num_perm).
+    Texts without words get an all-max signature and are never matched.
+    """
+    a, b = _permutations(params)
+    signatures = []
+    for text in texts:
+        hashes = shingles(text, params.shingle_size)
+        if not len(hashes):
+            signatures.append(np.full(params.num_perm, _MAX_HASH, dtype=np.uint64))
+            continue
+        # (a * x + b) mod p wraps around in uint64 like the reference implementation, good enough as a hash family
+        signatures.append((((a * hashes[None, :] + b) % _MERSENNE_PRIME) & _MAX_HASH).min(axis=1))
+    if not signatures:
+        return np.empty((0, params.num_perm), dtype=np.uint32)
+    return np.vstack(signatures).astype(np.uint32)
+
+
+def choose_bands(num_perm: int, threshold: float) -> int:
+    """
+    Number of LSH bands: the one whose candidate threshold (1/b)^(1/r) is closest to `threshold`
+    from below, so that pairs above the threshold are almost always candidates.
+    """
+    for bands in range(1, num_perm + 1):
+        if num_perm % bands == 0 and (1 / bands) ** (bands / num_perm) <= threshold:
+            return bands
+    return num_perm
+
+
+class _UnionFind:
+    def __init__(self, n: int):
+        self.parent = np.arange(n)
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int) -> None:
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            # The smallest index stays the root, so it labels the cluster
+            self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+
+def near_duplicate_clusters(signatures: np.ndarray, params: DedupParams) -> np.ndarray:
+    """
+    Groups texts whose estimated Jaccard similarity reaches params.threshold.
+
+    Every band of rows is hashed into buckets, and only texts sharing a bucket are compared,
+    each against the first one in the bucket. The cost grows with the number of texts, not pairs.
+
+    Returns:
+        np.ndarray: For every text, the index of the first text of its cluster.
+    """
+    n, num_perm = signatures.shape
+    bands = choose_bands(num_perm, params.threshold)
+    rows = num_perm // bands
+    empty = (signatures == np.uint32(_MAX_HASH)).all(axis=1)
+    multipliers = np.random.default_rng(params.seed).integers(1, 1 << 63, size=rows, dtype=np.uint64)
+    clusters = _UnionFind(n)
+
+    for band in range(bands):
+        block = signatures[:, band * rows:(band + 1) * rows].astype(np.uint64)
+        keys = (block * multipliers).sum(axis=1)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        lengths = np.diff(np.r_[starts, n])
+        for start, length in zip(starts[lengths > 1], lengths[lengths > 1]):
+            members = order[start:start + length]
+            members = members[~empty[members]]
+            if len(members) < 2:
+                continue
+            similarity = (signatures[members[1:]] == signatures[members[0]]).mean(axis=1)
+            for member in members[1:][similarity >= params.threshold]:
+                clusters.union(int(members[0]), int(member))
+
+    return np.array([clusters.find(i) for i in range(n)])
+
+
+def near_duplicate_step(df: pd.DataFrame, params: DedupParams, collapse: bool = True) -> pd.DataFrame:
+    """
+    Pipeline stage before get_feature_pipeline.
+
+    collapse=True keeps only the first article of every near-duplicate cluster, so copies of one story
+    can no longer land on both sides of train_test_split. collapse=False keeps all rows and adds a
+    `dup_cluster` column instead, e.g. for GroupShuffleSplit(groups=df['dup_cluster']).
+    """
+    signatures = minhash_signatures(df[params.column].fillna('').astype(str), params)
+    labels = near_duplicate_clusters(signatures, params)
+    is_first = labels == np.arange(len(labels))
+    logging.info(f'Near-duplicates: {int((~is_first).sum())} of {len(df)} articles repeat '
+                 f'{len(np.unique(labels[~is_first]))} others (threshold {params.threshold})')
+    if collapse:
+        return df[is_first]
+    return df.assign(dup_cluster=df.index.to_numpy()[labels])
+
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from dataclasses import asdict
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Union
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.pipeline import Pipeline
+
+from src.ml_utils.config import PreprocessParams
+from src.ml_utils.transformers import text_fingerprint
+
+_CSR_PARTS = ('data', 'indices', 'indptr')
+# The fields that change the matrix after the text stages; n_process, batch_size, cache settings do not
+_VECTORIZER_FIELDS = ('vectorizer', 'n_features', 'n_tag_features', 'fold_aware')
+
+
+class FeatureSet(NamedTuple):
+    X: sparse.csr_matrix
+    y: np.ndarray
+    pipe: Optional[Pipeline]
+    label_encoder: Optional[object]
+    manifest: Dict
+
+
+def frame_fingerprint(df: pd.DataFrame) -> str:
+    """Content hash of the input rows; list-valued cells (Reuters tags) are hashed through their str()."""
+    digest = hashlib.sha256(json.dumps(list(map(str, df.columns))).encode('utf-8'))
+    for column in df.columns:
+        values = df[column]
+        if values.dtype == object:
+            values = values.map(lambda value: value if isinstance(value, str) or value is None else str(value))
+        digest.update(pd.util.hash_pandas_object(values, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def vocabulary_hash(pipe: Pipeline) -> str:
+    """Hash of everything a fitted feature pipeline learned about its columns (vocabularies, categories)."""
+    learned = []
+    for name, estimator in iter_estimators(pipe):
+        if hasattr(estimator, 'vocabulary_'):
+            learned.append([name, sorted((str(term), int(index)) for term, index in estimator.vocabulary_.items())])
+        elif hasattr(estimator, 'categories_'):
+            learned.append([name, [list(map(str, categories)) for categories in estimator.categories_]])
+        elif hasattr(estimator, 'n_features'):
+            learned.append([name, estimator.n_features])
+    return hashlib.sha256(json.dumps(learned).encode('utf-8')).hexdigest()
+
+
+def iter_estimators(estimator, prefix: str = ''):
+    if isinstance(estimator, Pipeline):
+        for name, step in estimator.steps:
+            yield from iter_estimators(step, f'{prefix}{name}/')
+    elif hasattr(estimator, 'transformers_'):
+        for name, transformer, _ in estimator.transformers_:
+            if not isinstance(transformer, str):
+                yield from iter_estimators(transformer, f'{prefix}{name}/')
+    else:
+        yield prefix.rstrip('/'), estimator
+
+
+class FeatureStore:
+    """
+    Versioned on-disk store of vectorized datasets.
+
+    A version is addressed by the preprocessing params and the input rows, so rerunning the notebook
+    with the same data and settings finds the matrix instead of refitting the spaCy pipeline.
+    Each version directory holds the CSR components and labels as .npy files, the fitted feature
+    pipeline and label encoder, and a manifest with the params and the vocabulary hash.
+    Loading memory-maps the arrays, so parallel experiments share one copy through the page cache.
+    """
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+
+    def version(self, params: PreprocessParams, X: pd.DataFrame, split: Optional[Dict] = None) -> str:
+        """`split`: the train_test_split settings, for fold_aware matrices whose vectorizers saw only the training rows."""
+        fingerprint = {
+            'text': text_fingerprint(params),
+            'params': {k: getattr(params, k) for k in _VECTORIZER_FIELDS},
+            'data': frame_fingerprint(X),
+        }
+        if split is not None:
+            fingerprint['split'] = split
+        return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    def path(self, version: str) -> Path:
+        return self.root / version
+
+    def __contains__(self, version: str) -> bool:
+        return (self.path(version) / 'manifest.json').exists()
+
+    def save(self, version: str, X, y, params: PreprocessParams, pipe: Optional[Pipeline] = None,
+             label_encoder=None) -> Path:
+        X = sparse.csr_matrix(X)
+        target = self.path(version)
+        tmp = target.with_name(target.name + '.tmp')
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        for part in _CSR_PARTS:
+            np.save(tmp / f'X_{part}.npy', getattr(X, part))
+        np.save(tmp / 'y.npy', np.asarray(y))
+        if pipe is not None:
+            joblib.dump(pipe, tmp / 'x_pipe.pkl')
+        if label_encoder is not None:
+            joblib.dump(label_encoder, tmp / 'y_estim.pkl')
+
+        manifest = {
+            'version': version,
+            'created': time.time(),
+            'shape': list(X.shape),
+            'nnz': int(X.nnz),
+            'dtype': str(X.dtype),
+            'preprocess_params': asdict(params),
+            'vocabulary_hash': vocabulary_hash(pipe) if pipe is not None else None,
+        }
+        with open(tmp / 'manifest.json', 'w') as f:
+            json.dump(manifest, f, indent=4)
+
+        # The version appears only once it is complete
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(tmp, target)
+        logging.info(f'Features {X.shape} ({X.nnz} non-zeros) saved as version {version} at {target}')
+        return target
+
+    def load(self, version: str, mmap: bool = True, with_pipeline: bool = True) -> FeatureSet:
+        """Reloads a version; with mmap=True the arrays are read-only views of the files, no copy is made."""
+        path = self.path(version)
+        with open(path / 'manifest.json') as f:
+            manifest = json.load(f)
+        mmap_mode = 'r' if mmap else None
+        data, indices, indptr = (np.load(path / f'X_{part}.npy', mmap_mode=mmap_mode) for part in _CSR_PARTS)
+        X = sparse.csr_matrix((data, indices, indptr), shape=tuple(manifest['shape']), copy=False)
+        y = np.load(path / 'y.npy', mmap_mode=mmap_mode, allow_pickle=False)
+
+        pipe = label_encoder = None
+        if with_pipeline and (path / 'x_pipe.pkl').exists():
+            pipe = joblib.load(path / 'x_pipe.pkl')
+        if with_pipeline and (path / 'y_estim.pkl').exists():
+            label_encoder = joblib.load(path / 'y_estim.pkl')
+        logging.info(f'Features {X.shape} loaded from version {version}' + (' (memory-mapped)' if mmap else ''))
+        return FeatureSet(X, y, pipe, label_encoder, manifest)
+
+    def versions(self) -> List[Dict]:
+        manifests = []
+        for manifest_path in sorted(self.root.glob('*/manifest.json')):
+            with open(manifest_path) as f:
+                manifests.append(json.load(f))
+        return sorted(manifests, key=lambda manifest: manifest['created'])
@@ -0,0 +1,321 @@
+"""
+Inference over the artifacts written by save_step (pretrained/<classifier>/model.pkl, x_pipe.pkl, y_estim.pkl).
+
+The artifact is loaded once and warmed up (spaCy, vectorizers), then requests are classified in
+micro-batches: concurrent requests arriving within a few milliseconds go through the
+column_processor pipeline together, which is much cheaper than one pipeline call per article.
+
+Usage:
+    python -m src.ml_utils.inference predict pretrained/RidgeClassifier --input data/new_articles.jsonl --output preds.jsonl
+    python -m src.ml_utils.inference serve pretrained/RidgeClassifier --port 8000
+    python -m src.ml_utils.inference loadgen --url http://127.0.0.1:8000 --data data/reuters_articles_world.json
+"""
+import argparse
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+import urllib.request
+import warnings
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.preprocessing import OneHotEncoder
+
+from src.json_stream import iter_json_records
+from src.logger import setup_logger
+from src.ml_utils.feature_store import iter_estimators
+
+FEATURE_COLUMNS = ['title', 'text', 'tags']
+
+
+def articles_frame(records: List[Dict]) -> pd.DataFrame:
+    """Feature columns of raw article records; list tags (Reuters) are joined like in the article store."""
+    rows = []
+    for record in records:
+        tags = record.get('tags')
+        if isinstance(tags, (list, tuple)):
+            tags = ','.join(str(tag) for tag in tags)
+        rows.append({'title': record.get('title') or '', 'text': record.get('text') or '', 'tags': tags or ''})
+    return pd.DataFrame.from_records(rows, columns=FEATURE_COLUMNS)
+
+
+def validate_records(payload) -> Optional[str]:
+    """Why a /predict payload cannot be classified, None if it is an article or a list of articles."""
+    records = payload if isinstance(payload, list) else [payload]
+    for i, record in enumerate(records):
+        if not isinstance(record, dict):
+            return f'article {i}: expected an object, got {type(record).__name__}'
+        for field in ('title', 'text'):
+            if not isinstance(record.get(field) or '', str):
+                return f'article {i}: {field} must be a string'
+        tags = record.get('tags') or ''
+        if not isinstance(tags, (str, list)):
+            return f'article {i}: tags must be a string or a list'
+    return None
+
+
+class ArticleClassifier:
+    def __init__(self, model, x_pipe, y_estim, dense_input: bool = False, name: str = 'model'):
+        self.model = model
+        self.x_pipe = x_pipe
+        self.y_estim = y_estim
+        self.dense_input = dense_input
+        self.name = name
+
+    @classmethod
+    def from_pretrained(cls, path: Union[str, Path], dense_input: bool = False) -> 'ArticleClassifier':
+        path = Path(path)
+        start = time.perf_counter()
+        classifier = cls(joblib.load(path / 'model.pkl'), joblib.load(path / 'x_pipe.pkl'),
+                         joblib.load(path / 'y_estim.pkl'), dense_input=dense_input, name=path.name)
+        for name, estimator in iter_estimators(classifier.x_pipe):
+            # Fresh articles bring tag combinations the encoder has never seen
+            if isinstance(estimator, OneHotEncoder) and estimator.handle_unknown == 'error':
+                estimator.handle_unknown = 'ignore'
+                logging.info(f'{name}: unknown tags are encoded as zeros')
+        warnings.filterwarnings('ignore', message='Found unknown categories', category=UserWarning)
+        classifier.warm_up()
+        logging.info(f'{path.name} loaded and warmed up in {time.perf_counter() - start:.2f}s')
+        return classifier
+
+    def warm_up(self) -> None:
+        """Runs one dummy article through the pipeline so that lazy models are loaded before the first request."""
+        self.predict([{'title': 'warm up', 'text': 'warm up', 'tags': ''}])
+
+    def predict(self, records: List[Dict]) -> List[str]:
+        if not records:
+            return []
+        X = self.x_pipe.transform(articles_frame(records))
+        if self.dense_input and sparse.issparse(X):
+            X = X.toarray()
+        labels = np.asarray(self.model.predict(X)).ravel().astype(int)
+        return [str(label) for label in self.y_estim.inverse_transform(labels)]
+
+
+class MicroBatcher:
+    """
+    Collects concurrent requests into one pipeline call: the first request waits at most
+    max_wait_ms for others, a batch is cut once it holds max_batch articles.
+    """
+    def __init__(self, classifier: ArticleClassifier, max_batch: int = 64, max_wait_ms: float = 5.0):
+        self.classifier = classifier
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.articles = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, records: List[Dict]) -> Future:
+        future = Future()
+        self._queue.put((records, future))
+        return future
+
+    def predict(self, records: List[Dict]) -> List[str]:
+        return self.submit(records).result()
+
+    def _next_batch(self) -> Optional[List]:
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch, size = [first], len(first[0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # stop after this batch
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self) -> None:
+        while (batch := self._next_batch()) is not None:
+            records = [record for request, _ in batch for record in request]
+            try:
+                categories = self.classifier.predict(records)
+            except Exception:
+                # One bad request must not fail the others it was batched with
+                self._run_one_by_one(batch)
+                continue
+            self.batches += 1
+            self.articles += len(records)
+            offset = 0
+            for request, future in batch:
+                future.set_result(categories[offset:offset + len(request)])
+                offset += len(request)
+
+    def _run_one_by_one(self, batch: List) -> None:
+        for request, future in batch:
+            try:
+                future.set_result(self.classifier.predict(request))
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            self.batches += 1
+            self.articles += len(request)
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+
+class _Server(ThreadingHTTPServer):
+    # The default backlog of 5 makes bursts of concurrent clients wait for SYN retries
+    request_queue_size = 256
+    daemon_threads = True
+
+
+def make_server(batcher: MicroBatcher, host: str = '127.0.0.1', port: int = 8000) -> ThreadingHTTPServer:
+    """POST /predict with an article or a list of articles -> {"categories": [...]}; GET /health -> stats."""
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, payload: Dict) -> None:
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != '/health':
+                return self._reply(404, {'error': 'not found'})
+            mean_batch = batcher.articles / batcher.batches if batcher.batches else 0.0
+            self._reply(200, {'model': batcher.classifier.name, 'batches': batcher.batches,
+                              'articles': batcher.articles, 'mean_batch': round(mean_batch, 2)})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                return self._reply(404, {'error': 'not found'})
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except ValueError:
+                return self._reply(400, {'error': 'body must be JSON'})
+            if (error := validate_records(payload)) is not None:
+                return self._reply(400, {'error': error})
+            records = payload if isinstance(payload, list) else [payload]
+            try:
+                self._reply(200, {'categories': batcher.predict(records)})
+            except Exception as e:
+                logging.error(e, exc_info=True)
+                self._reply(500, {'error': str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return _Server((host, port), Handler)
+
+
+def predict_file(classifier: ArticleClassifier, input_file, output_file, batch_size: int = 256) -> int:
+    """Classifies a JSON/JSONL dump in batches and writes the records with a predicted_category field as JSONL."""
+    total = 0
+    records = iter_json_records(input_file)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        while batch := list(itertools.islice(records, batch_size)):
+            for record, category in zip(batch, classifier.predict(batch)):
+                record['predicted_category'] = category
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            total += len(batch)
+    return total
+
+
+def _post(url: str, records: List[Dict]) -> float:
+    body = json.dumps(records, ensure_ascii=False).encode('utf-8')
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def load_generator(url: str, articles: List[Dict], requests: int, concurrency: int,
+                   batch: int = 1) -> Dict[str, float]:
+    """Sends `requests` POST /predict calls from `concurrency` threads and reports latency percentiles."""
+    payloads = [[articles[(i * batch + j) % len(articles)] for j in range(batch)] for i in range(requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = np.array(list(executor.map(lambda records: _post(f'{url}/predict', records), payloads)))
+    elapsed = time.perf_counter() - start
+    return {
+        'requests': requests,
+        'articles_per_sec': requests * batch / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p95_ms': float(np.percentile(latencies, 95) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    predict_parser = subparsers.add_parser('predict', help='classify a JSON/JSONL file of articles')
+    predict_parser.add_argument('artifact', help='pretrained/<classifier> directory')
+    predict_parser.add_argument('--input', required=True)
+    predict_parser.add_argument('--output', required=True)
+    predict_parser.add_argument('--batch-size', type=int, default=256)
+    predict_parser.add_argument('--dense', action='store_true', help='the model needs dense input')
+
+    serve_parser = subparsers.add_parser('serve', help='local HTTP server with micro-batching')
+    serve_parser.add_argument('artifact')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8000)
+    serve_parser.add_argument('--max-batch', type=int, default=64)
+    serve_parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    serve_parser.add_argument('--dense', action='store_true')
+
+    loadgen_parser = subparsers.add_parser('loadgen', help='latency percentiles and articles/sec of a running server')
+    loadgen_parser.add_argument('--url', default='http://127.0.0.1:8000')
+    loadgen_parser.add_argument('--data', default='data/reuters_articles_world.json')
+    loadgen_parser.add_argument('--requests', type=int, default=1000)
+    loadgen_parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    loadgen_parser.add_argument('--batch', type=int, default=1, help='articles per request')
+
+    args = parser.parse_args()
+    if args.command == 'predict':
+        classifier = ArticleClassifier.from_pretrained(args.artifact, dense_input=args.dense)
+        start = time.perf_counter()
+        total = predict_file(classifier, args.input, args.output, args.batch_size)
+        elapsed = time.perf_counter() - start
+        logging.info(f'{total} articles classified in {elapsed:.2f}s ({total / elapsed:.1f} articles/sec) -> {args.output}')
+    elif args.command == 'serve':
+        classifier = ArticleClassifier.from_pretrained(args.artifact, dense_input=args.dense)
+        batcher = MicroBatcher(classifier, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+        server = make_server(batcher, args.host, args.port)
+        logging.info(f'Serving {classifier.name} at http://{args.host}:{args.port}/predict')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            batcher.close()
+    else:
+        articles = list(itertools.islice(iter_json_records(args.data), args.requests * args.batch))
+        for concurrency in args.concurrency:
+            report = load_generator(args.url, articles, args.requests, concurrency, args.batch)
+            logging.info(f"concurrency {concurrency}: {report['articles_per_sec']:.1f} articles/sec, "
+                         f"p50 {report['p50_ms']:.1f} ms, p95 {report['p95_ms']:.1f} ms, p99 {report['p99_ms']:.1f} ms")
+        with urllib.request.urlopen(f'{args.url}/health') as response:
+            logging.info(f'Server: {json.loads(response.read())}')
+
+
+if __name__ == '__main__':
+    setup_logger(logging.INFO, stdout_log=True, file_log=False)
+    main()
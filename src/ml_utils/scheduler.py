@@ -0,0 +1,179 @@
+"""
+Runs several Classifier experiments at once in worker processes.
+
+Every worker memory-maps the same feature store version (see feature_store.FeatureStore), so the
+matrix exists once in the page cache however many models train on it. Jobs are started
+longest-expected-first and only while the core and RAM budgets allow, and every finished model
+goes through the same save_step as the notebook.
+"""
+import logging
+import math
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import joblib
+import psutil
+from sklearn.metrics import accuracy_score, classification_report
+from sklearn.model_selection import train_test_split
+from threadpoolctl import threadpool_limits
+
+from src.ml_utils.config import Classifier, PreprocessParams, TrainingParams
+from src.ml_utils.feature_store import FeatureStore
+from src.ml_utils.utils import CVFrame, prepare_input, save_step, train_step
+
+# Rough fit cost per estimator family relative to a linear model on the same matrix
+_RELATIVE_COST = {
+    'RidgeClassifier': 1, 'LogisticRegression': 2, 'SGDClassifier': 1, 'PassiveAggressiveClassifier': 1,
+    'MultinomialNB': 0.2, 'ComplementNB': 0.2, 'KNeighborsClassifier': 2, 'LinearSVC': 2,
+    'RandomForestClassifier': 20, 'ExtraTreesClassifier': 15, 'MLPClassifier': 30,
+    'GradientBoostingClassifier': 60, 'XGBClassifier': 15, 'CatBoostClassifier': 20,
+}
+
+
+@dataclass
+class ExperimentJob:
+    classifier: Classifier
+    cost: float
+    memory_mb: float
+    cores: int
+
+
+def _grid_size(param_grid: Optional[Dict]) -> int:
+    if not param_grid:
+        return 1
+    return math.prod(len(values) if isinstance(values, (list, tuple)) else 1 for values in param_grid.values())
+
+
+def plan_job(clf: Classifier, shape, nnz: int, cores: int = 1) -> ExperimentJob:
+    """
+    Expected cost and peak memory of one experiment.
+    The shared matrix is not counted, only the per-job copies: the train/test row split and,
+    for dense-only models, the densified matrix.
+    """
+    rows, features = shape
+    memory_mb = nnz * 12 / 1024 ** 2  # CSR rows copied by train_test_split: float64 data + int32 indices
+    if clf.dense_input:
+        memory_mb += rows * features * 8 / 1024 ** 2
+    cost = _RELATIVE_COST.get(type(clf.estim).__name__, 5) * rows
+    if clf.tuning_params:
+        # Successive halving spends roughly log2(candidates) full-data rounds
+        cost *= max(1.0, math.log2(_grid_size(clf.param_grid))) * clf.cv
+    return ExperimentJob(clf, cost, memory_mb * 1.5, cores)
+
+
+def _run_job(clf: Classifier, store_root: str, version: str, preprocess_params: PreprocessParams,
+             train_params: TrainingParams, cores: int, save_root: Optional[str],
+             cv_frame_path: Optional[str] = None) -> Dict:
+    features = FeatureStore(store_root).load(version)
+    cv_frame = joblib.load(cv_frame_path) if cv_frame_path is not None else None
+    # Estimators with their own thread pools (n_jobs=-1 forests, CatBoost) get exactly the job's cores
+    estim_params = clf.estim.get_params()
+    for threads_param in ('n_jobs', 'thread_count'):
+        if threads_param in estim_params:
+            clf.estim.set_params(**{threads_param: cores})
+    train_params = replace(train_params, n_jobs=cores)
+    X_train, X_test, y_train, y_test = train_test_split(
+        features.X, features.y,
+        test_size=train_params.test_size,
+        random_state=train_params.random_state,
+        shuffle=train_params.shuffle_split
+    )
+    start = time.perf_counter()
+    # BLAS and OpenMP pools of a job must not spread over the cores given to the other jobs
+    with threadpool_limits(limits=cores):
+        clf = train_step(X_train, y_train, clf=clf, train_params=train_params, cv_frame=cv_frame)
+        y_pred = clf.estim.predict(prepare_input(X_test, clf, train_params))
+    fit_time = time.perf_counter() - start
+
+    metrics = classification_report(y_true=y_test, y_pred=y_pred, zero_division=0, output_dict=True)
+    save_dir = Path(save_root) / clf.name if save_root is not None else None
+    save_step(clf, preprocess_params, train_params, features.pipe, features.label_encoder, metrics, save_dir)
+    return {'name': clf.name, 'accuracy': accuracy_score(y_test, y_pred), 'fit_seconds': fit_time,
+            'peak_rss_mb': psutil.Process().memory_info().rss / 1024 ** 2}
+
+
+def run_experiments(classifiers: List[Classifier], store_root: Union[str, Path], version: str,
+                    preprocess_params: PreprocessParams, train_params: TrainingParams,
+                    max_cores: Optional[int] = None, memory_budget_mb: Optional[float] = None,
+                    cores_per_job: int = 1, save_root: Optional[Union[str, Path]] = None,
+                    cv_frame: Optional[CVFrame] = None) -> List[Dict]:
+    """
+    Trains, evaluates and saves every classifier on feature store `version`, several at a time.
+
+    Args:
+        max_cores: Cores shared by all jobs, all of them by default.
+        memory_budget_mb: RAM for the per-job copies, 80% of the available memory by default.
+        cores_per_job: Threads given to each job's BLAS/OpenMP pools.
+        save_root: Where pretrained/<name> goes, ROOT_DIR/pretrained by default.
+        cv_frame: The CVFrame split_data_step returns for fold_aware features; tuned models
+            then refit the vectorizers on every CV fold like in the notebook cells.
+
+    Returns:
+        One dict per classifier (name, accuracy, fit_seconds, peak_rss_mb, or error), in completion order.
+    """
+    max_cores = max_cores or os.cpu_count()
+    memory_budget_mb = memory_budget_mb or psutil.virtual_memory().available / 1024 ** 2 * 0.8
+    manifest = FeatureStore(store_root).load(version, with_pipeline=False).manifest
+    if cv_frame is None and preprocess_params.fold_aware and any(clf.tuning_params for clf in classifiers):
+        logging.warning('fold_aware features without a cv_frame: tuning runs on the training matrix, '
+                        'whose vocabulary is shared by all CV folds')
+
+    pending = sorted((plan_job(clf, manifest['shape'], manifest['nnz'], cores_per_job) for clf in classifiers),
+                     key=lambda job: job.cost, reverse=True)
+    running: Dict[Future, ExperimentJob] = {}
+    results = []
+    start = time.perf_counter()
+
+    tmp = tempfile.TemporaryDirectory()
+    cv_frame_path = None
+    if cv_frame is not None:
+        # Written once and loaded by every job instead of being pickled into each submission
+        cv_frame_path = os.path.join(tmp.name, 'cv_frame.joblib')
+        joblib.dump(cv_frame, cv_frame_path)
+
+    # spawn: workers must not inherit the notebook's memory, and forked BLAS pools can deadlock
+    with tmp, ProcessPoolExecutor(max_workers=max(1, max_cores // cores_per_job),
+                                  mp_context=multiprocessing.get_context('spawn')) as executor:
+        while pending or running:
+            used_cores = sum(job.cores for job in running.values())
+            used_memory = sum(job.memory_mb for job in running.values())
+            for job in list(pending):
+                fits = used_cores + job.cores <= max_cores and used_memory + job.memory_mb <= memory_budget_mb
+                if not fits and running:
+                    continue
+                if not fits:
+                    logging.warning(f'{job.classifier.name} needs ~{job.memory_mb:.0f} MB, '
+                                    f'over the {memory_budget_mb:.0f} MB budget: running it alone')
+                pending.remove(job)
+                future = executor.submit(_run_job, job.classifier, str(store_root), version, preprocess_params,
+                                         train_params, job.cores, str(save_root) if save_root is not None else None,
+                                         cv_frame_path)
+                running[future] = job
+                used_cores += job.cores
+                used_memory += job.memory_mb
+                logging.info(f'Started {job.classifier.name} (expected cost {job.cost:.3g}, ~{job.memory_mb:.0f} MB)')
+                if not fits:
+                    break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                try:
+                    result = future.result()
+                    logging.info(f"Finished {result['name']}: accuracy {result['accuracy']:.3f}, "
+                                 f"fit {result['fit_seconds']:.1f}s, worker RSS {result['peak_rss_mb']:.0f} MB")
+                except Exception as e:
+                    logging.error(f'{job.classifier.name} failed: {e}', exc_info=True)
+                    result = {'name': job.classifier.name, 'error': repr(e)}
+                results.append(result)
+
+    wall = time.perf_counter() - start
+    serial = sum(result.get('fit_seconds', 0.0) for result in results)
+    logging.info(f'{len(results)} experiments in {wall:.1f}s wall time (sum of fit times {serial:.1f}s)')
+    return results
@@ -0,0 +1,88 @@
+import logging
+from dataclasses import replace
+from pathlib import Path
+from typing import List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from src.article_store import category_counts, load_articles
+from src.ml_utils.config import SelectionParams
+
+_UINT64_MAX = np.iinfo(np.uint64).max
+
+
+def _sample_keys(df: pd.DataFrame, params: SelectionParams) -> np.ndarray:
+    """
+    One uniform uint64 per row that decides which rows survive sampling.
+    Hashing the article id keeps the same articles in the sample when the corpus grows.
+    """
+    if params.id_column is not None and params.id_column in df.columns:
+        hash_key = f'{params.random_state:016d}'[-16:]
+        return pd.util.hash_pandas_object(df[params.id_column].astype(str), index=False,
+                                          hash_key=hash_key).to_numpy()
+    rng = np.random.default_rng(params.random_state)
+    return rng.integers(_UINT64_MAX, size=len(df), dtype=np.uint64)
+
+
+def _cap_per_class(codes: np.ndarray, keys: np.ndarray, cap: int) -> np.ndarray:
+    """Positions of the `cap` rows with the smallest keys in every class."""
+    order = np.lexsort((keys, codes))
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    return order[rank < cap]
+
+
+def select_articles(df: pd.DataFrame, params: SelectionParams) -> pd.DataFrame:
+    """
+    Category selection, per-class cap and subsampling of an article frame with boolean masks.
+    Rows keep their original order and index.
+    """
+    category = df['category'].astype('category')
+    mask = np.ones(len(df), dtype=bool)
+    if params.categories is not None:
+        mask &= category.isin(params.categories).to_numpy()
+    if params.top_n is not None:
+        top = category[mask].value_counts().index[:params.top_n]
+        mask &= category.isin(top).to_numpy()
+
+    if params.max_per_class is None and params.sample_frac is None:
+        return df[mask]
+
+    keys = _sample_keys(df, params)
+    if params.max_per_class is not None:
+        rows = np.flatnonzero(mask)
+        kept = rows[_cap_per_class(category.cat.codes.to_numpy()[rows], keys[rows], params.max_per_class)]
+        mask = np.zeros(len(df), dtype=bool)
+        mask[kept] = True
+    if params.sample_frac is not None and params.sample_frac < 1:
+        mask &= keys < np.uint64(params.sample_frac * 2.0 ** 64)
+    return df[mask]
+
+
+def resolve_categories(source: Union[str, Path], params: SelectionParams) -> Optional[List[str]]:
+    """The categories to load; top_n needs one pass over the category column only."""
+    if params.top_n is None:
+        return params.categories
+    counts = category_counts(source)
+    if params.categories is not None:
+        counts = counts[counts.index.isin(params.categories)]
+    return counts.index[:params.top_n].tolist()
+
+
+def load_selection(source: Union[str, Path], params: SelectionParams,
+                   columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    load_articles with the selection pushed down: articles of unselected categories are skipped
+    by the loader (row-group statistics for a store, a record filter for a JSON dump), and only
+    the cap and subsampling run on the loaded frame.
+    """
+    categories = resolve_categories(source, params)
+    extra = [] if columns is None else [column for column in ('category', params.id_column)
+                                        if column is not None and column not in columns]
+    df = load_articles(source, columns=columns + extra if columns is not None else None, categories=categories)
+    df = select_articles(df, replace(params, top_n=None, categories=None))
+    logging.info(f'Selected {len(df)} articles from {source}: '
+                 f'{df["category"].value_counts().to_dict()}')
+    return df.drop(columns=[column for column in extra if column in df.columns])
@@ -1,10 +1,75 @@
-from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.base import BaseEstimator, TransformerMixin, clone
 from src.ml_utils.config import PreprocessParams
+from src.ml_utils.cache import TextCache, content_key
+from collections import OrderedDict
+from pathlib import Path
+import hashlib
+import os
+import pickle
+import numpy as np
 import pandas as pd
+from scipy import sparse
+from sklearn.preprocessing import normalize
+from typing import Dict, List, Optional, Sequence, Tuple
+import joblib
+from joblib import Parallel, delayed, parallel_config
 import spacy
+from spacy.language import Language
 from spacy.lang.en.stop_words import STOP_WORDS
 from nltk.stem import PorterStemmer
 
+_SPACY_MODELS: Dict[str, Language] = {}
+# Fitted fold stages and their outputs, shared by all the candidates of a CV search in this process
+_FOLD_RESULTS: 'OrderedDict[str, Tuple[object, int]]' = OrderedDict()
+# A fold matrix of a large corpus takes hundreds of MB: least recently used entries go beyond this size
+_FOLD_RESULTS_MAX_BYTES = 2 * 1024 ** 3
+
+def load_spacy_model(name: str) -> Language:
+    """Returns the process-wide instance of a spaCy model, loading it on first use."""
+    if name not in _SPACY_MODELS:
+        _SPACY_MODELS[name] = spacy.load(name, disable=["parser", "ner"])
+    return _SPACY_MODELS[name]
+
+# The PreprocessParams fields the processed strings depend on; vectorizer and runtime settings are not among them
+TEXT_OUTPUT_FIELDS = ('spacy_model', 'remove_punct', 'custom_punct', 'remove_stopwords', 'lemmatize', 'stem',
+                      'lowercase', 'min_token_length')
+
+def text_fingerprint(params: PreprocessParams) -> Dict:
+    """Everything the output of the cleaning and spaCy stages depends on, including the spaCy and model versions."""
+    meta = load_spacy_model(params.spacy_model).meta
+    return {
+        'params': {k: getattr(params, k) for k in TEXT_OUTPUT_FIELDS},
+        'spacy_version': spacy.__version__,
+        'model': f"{meta.get('lang')}_{meta.get('name')}",
+        'model_version': meta.get('version'),
+    }
+
+def shard_budget(n_shards: int, outer_jobs: int = 1) -> int:
+    """Shards per spaCy stage such that outer_jobs stages running at once use at most all the cores."""
+    return max(1, min(n_shards, (os.cpu_count() or 1) // max(1, outer_jobs)))
+
+def split_tags(tags) -> List[str]:
+    """Analyzer for the tags column: Reuters stores a list, the other scrapers a comma-separated string."""
+    if isinstance(tags, (list, tuple, np.ndarray)):
+        return [str(tag).strip() for tag in tags if str(tag).strip()]
+    if tags is None or (isinstance(tags, float) and np.isnan(tags)):
+        return []
+    return [tag.strip() for tag in str(tags).split(',') if tag.strip()]
+
+class SpacyModelMixin:
+    """
+    The spaCy model is looked up by params.spacy_model in the process-wide registry on first use
+    and never stored on the instance, so a pickled pipeline carries only the model name.
+    """
+    @property
+    def nlp(self) -> Language:
+        return load_spacy_model(self.params.spacy_model)
+
+    def __setstate__(self, state):
+        # Artifacts pickled before the model was made lazy still hold a full spaCy pipeline
+        state.pop('nlp', None)
+        super().__setstate__(state)
+
 class TextCleaner(BaseEstimator, TransformerMixin):
     def __init__(self, params: PreprocessParams):
         self.params = params
@@ -22,10 +87,9 @@ class TextCleaner(BaseEstimator, TransformerMixin):
         X = X.str.replace(r'\s+', ' ', regex=True).str.strip()
         return X
 
-class SpacyTokenizer(BaseEstimator, TransformerMixin):
+class SpacyTokenizer(SpacyModelMixin, BaseEstimator, TransformerMixin):
     def __init__(self, params: PreprocessParams):
         self.params = params
-        self.nlp = spacy.load(params.spacy_model, disable=["parser", "ner"])
 
     def fit(self, X: pd.Series, y=None):
         return self
@@ -34,30 +98,244 @@ class SpacyTokenizer(BaseEstimator, TransformerMixin):
         tokenized = X.apply(lambda text: [token.text for token in self.nlp(str(text))])
         return tokenized
 
-class TokenProcessor(BaseEstimator, TransformerMixin):
+class TokenProcessor(SpacyModelMixin, BaseEstimator, TransformerMixin):
     def __init__(self, params: PreprocessParams):
         self.params = params
         self.stopwords = set(STOP_WORDS)
-        self.nlp = spacy.load(params.spacy_model, disable=["parser", "ner"])
         self.stemmer = PorterStemmer() if params.stem else None
 
     def fit(self, X: pd.Series, y=None):
         return self
 
+    def _lemmatize_vocab(self, tokens) -> Dict[str, str]:
+        # Each unique token goes through the model once, in batches, exactly as nlp(token) would see it
+        unique_tokens = list(dict.fromkeys(tokens))
+        docs = self.nlp.pipe(unique_tokens, batch_size=self.params.batch_size, n_process=self.params.n_process)
+        return {token: doc[0].lemma_ for token, doc in zip(unique_tokens, docs)}
+
     def transform(self, X: pd.Series) -> pd.Series:
-        def _process_row(row):
+        def _filter_row(row):
             filtered = []
             for token in row:
                 if len(token) < self.params.min_token_length:
                     continue
                 if self.params.remove_stopwords and token.lower() in self.stopwords:
                     continue
-                if self.params.lemmatize:
-                    token = self.nlp(token)[0].lemma_
-                elif self.params.stem:
-                    token = self.stemmer.stem(token)
                 filtered.append(token)
-            return ' '.join(filtered)
+            return filtered
+
+        filtered = X.apply(_filter_row)
+
+        if self.params.lemmatize:
+            lemmas = self._lemmatize_vocab(token for row in filtered for token in row)
+            filtered = filtered.apply(lambda row: [lemmas[token] for token in row])
+        elif self.params.stem:
+            filtered = filtered.apply(lambda row: [self.stemmer.stem(token) for token in row])
+
+        processed = filtered.apply(' '.join)
+        return processed
+
+class SpacyProcessor(SpacyModelMixin, BaseEstimator, TransformerMixin):
+    """Fused SpacyTokenizer + TokenProcessor: parses every document once and filters the Doc tokens."""
+    def __init__(self, params: PreprocessParams):
+        self.params = params
+        self.stopwords = set(STOP_WORDS)
+        self.stemmer = PorterStemmer() if params.stem else None
+
+    def fit(self, X: pd.Series, y=None):
+        return self
+
+    def _process_doc(self, doc) -> str:
+        filtered = []
+        for token in doc:
+            text = token.text
+            if len(text) < self.params.min_token_length:
+                continue
+            if self.params.remove_stopwords and text.lower() in self.stopwords:
+                continue
+            if self.params.lemmatize:
+                text = token.lemma_
+            elif self.params.stem:
+                text = self.stemmer.stem(text)
+            filtered.append(text)
+        return ' '.join(filtered)
+
+    def _process_texts(self, texts: List[str]) -> List[str]:
+        # A shard is one process: the parallelism comes from the shards, never from nlp.pipe
+        docs = self.nlp.pipe(texts, batch_size=self.params.batch_size, n_process=1)
+        return [self._process_doc(doc) for doc in docs]
+
+    def transform(self, X: pd.Series) -> pd.Series:
+        texts = X.astype(str).tolist()
+        n_shards = shard_budget(self.params.n_shards)
+        if n_shards > 1 and len(texts) > n_shards:
+            shard_size = -(-len(texts) // n_shards)
+            # Inside a ColumnTransformer worker (n_jobs > 1) joblib would fall back to threads,
+            # which the GIL serializes: the shards must get their own processes
+            with parallel_config(backend='loky', inner_max_num_threads=1):
+                shards = Parallel(n_jobs=n_shards)(
+                    delayed(self._process_texts)(texts[i:i + shard_size])
+                    for i in range(0, len(texts), shard_size)
+                )
+            processed = [text for shard in shards for text in shard]
+        else:
+            processed = self._process_texts(texts)
+        return pd.Series(processed, index=X.index, dtype=object)
+
+class CachedTextProcessor(BaseEstimator, TransformerMixin):
+    """TextCleaner + SpacyProcessor behind a content-addressed on-disk cache of the processed strings."""
+
+    def __init__(self, params: PreprocessParams):
+        self.params = params
+        self.cleaner = TextCleaner(params)
+        self.processor = SpacyProcessor(params)
+        self.cache = TextCache(params.cache_dir, params.cache_max_size_mb, name='preprocess')
+
+    def fit(self, X: pd.Series, y=None):
+        return self
+
+    def _fingerprint(self) -> Dict:
+        return text_fingerprint(self.params)
+
+    def transform(self, X: pd.Series) -> pd.Series:
+        X = X.astype(str)
+        fingerprint = self._fingerprint()
+        keys = [content_key(text, fingerprint) for text in X]
+        processed = self.cache.get_many(keys)
+
+        missing = [i for i, key in enumerate(keys) if key not in processed]
+        if missing:
+            computed = self.processor.transform(self.cleaner.transform(X.iloc[missing]))
+            fresh = dict(zip((keys[i] for i in missing), computed))
+            self.cache.put_many(fresh.items())
+            processed.update(fresh)
+
+        self.cache.log_stats()
+        return pd.Series([processed[key] for key in keys], index=X.index, dtype=object)
+
+def text_preprocess_steps(params: PreprocessParams) -> List[Tuple[str, TransformerMixin]]:
+    """The stateless text stages (cleaning, spaCy): they learn nothing, so they can run once before any split."""
+    if params.cache_dir is not None:
+        return [('processor', CachedTextProcessor(params))]
+    return [
+        ('cleaner', TextCleaner(params)),
+        ('processor', SpacyProcessor(params)),
+    ]
+
+class TextPreprocessor(BaseEstimator, TransformerMixin):
+    """
+    Runs the stateless text stages over whole text columns of a frame, other columns pass through.
+    Placed before the column processor when params.fold_aware is set, so CV folds refit only the vectorizers.
+    """
+    def __init__(self, params: PreprocessParams, columns: Sequence[str] = ('text', 'title')):
+        self.params = params
+        self.columns = columns
+
+    def fit(self, X: pd.DataFrame, y=None):
+        return self
+
+    def transform(self, X: pd.DataFrame) -> pd.DataFrame:
+        X = X.copy()
+        for column in self.columns:
+            for _, step in text_preprocess_steps(self.params):
+                X[column] = step.transform(X[column])
+        return X
+
+def _nbytes(value) -> int:
+    if sparse.issparse(value):
+        value = value.tocsr()
+        return value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    # Fitted stages: the pickle size follows the vocabularies, and it is taken once per fit
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+def _remember(key: str, value=None):
+    if value is None:
+        entry = _FOLD_RESULTS.get(key)
+        if entry is None:
+            return None
+        _FOLD_RESULTS.move_to_end(key)
+        return entry[0]
+    size = _nbytes(value)
+    if size > _FOLD_RESULTS_MAX_BYTES:
+        return value
+    _FOLD_RESULTS.pop(key, None)
+    _FOLD_RESULTS[key] = (value, size)
+    total = sum(entry_size for _, entry_size in _FOLD_RESULTS.values())
+    while total > _FOLD_RESULTS_MAX_BYTES:
+        total -= _FOLD_RESULTS.popitem(last=False)[1][1]
+    return value
+
+class FoldCachedFeatures(BaseEstimator, TransformerMixin):
+    """
+    Stateful feature stages (vectorizers, tag encoder) memoized by the content of the rows they see.
+
+    A CV search refits the stages on the same fold for every candidate: here only the first one pays,
+    the others get the fitted stages and the transformed folds from memory. Fitted stages are also
+    saved to cache_dir, so rerunning the search skips the fits as well.
+
+    With frame_key (a fingerprint of the frame the folds are cut from) rows are identified by their
+    unique index labels instead of hashing the texts on every call.
+    """
+    def __init__(self, features, cache_dir: Optional[str] = None, frame_key: Optional[str] = None):
+        self.features = features
+        self.cache_dir = cache_dir
+        self.frame_key = frame_key
+
+    def _rows_key(self, X: pd.DataFrame, *prefix: str) -> str:
+        digest = hashlib.sha256(''.join(prefix).encode('utf-8'))
+        if self.frame_key is not None:
+            digest.update(self.frame_key.encode('utf-8'))
+            digest.update(pd.util.hash_pandas_object(X.index).to_numpy().tobytes())
+        else:
+            digest.update(pd.util.hash_pandas_object(X, index=True).to_numpy().tobytes())
+        return digest.hexdigest()
+
+    def fit(self, X: pd.DataFrame, y=None):
+        self.fit_key_ = self._rows_key(X, joblib.hash(self.features))
+        fitted = _remember(self.fit_key_)
+        path = Path(self.cache_dir) / f'{self.fit_key_}.pkl' if self.cache_dir is not None else None
+        if fitted is None and path is not None and path.exists():
+            fitted = joblib.load(path)
+        if fitted is None:
+            fitted = clone(self.features).fit(X)
+            if path is not None:
+                os.makedirs(path.parent, exist_ok=True)
+                joblib.dump(fitted, path)
+        self.features_ = _remember(self.fit_key_, fitted)
+        return self
+
+    def transform(self, X: pd.DataFrame):
+        key = self._rows_key(X, self.fit_key_)
+        transformed = _remember(key)
+        if transformed is None:
+            transformed = _remember(key, self.features_.transform(X))
+        return transformed
+
+class IncrementalIdfTransformer(BaseEstimator, TransformerMixin):
+    """
+    TF-IDF weighting for hashed term counts whose document frequencies can be updated chunk by chunk.
+    Uses the same smoothed idf and l2 normalization as TfidfVectorizer defaults.
+    """
+    def fit(self, X, y=None):
+        self.__dict__.pop('df_', None)
+        self.__dict__.pop('n_docs_', None)
+        return self.partial_fit(X)
+
+    def partial_fit(self, X, y=None):
+        X = sparse.csr_matrix(X)
+        if not hasattr(self, 'df_'):
+            self.df_ = np.zeros(X.shape[1], dtype=np.int64)
+            self.n_docs_ = 0
+        X.sum_duplicates()
+        X.eliminate_zeros()
+        self.df_ += np.bincount(X.indices, minlength=X.shape[1])
+        self.n_docs_ += X.shape[0]
+        return self
 
-        processed = X.apply(_process_row)
-        return processed
\ No newline at end of file
+    def transform(self, X):
+        idf = np.log((1 + self.n_docs_) / (1 + self.df_)) + 1
+        X = sparse.csr_matrix(X, dtype=np.float64, copy=True)
+        X.data *= idf[X.indices]
+        return normalize(X, norm='l2', copy=False)
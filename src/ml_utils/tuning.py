@@ -0,0 +1,225 @@
+"""
+Hyperparameter search with Optuna as an alternative to HalvingRandomSearchCV.
+
+Trials live in a SQLite file, so a search survives a dead kernel and can be extended by rerunning it
+with a larger n_trials. Every trial is scored on growing stratified subsamples like the halving search
+(same `factor`, same smallest resource), and a successive halving pruner stops the bad ones early.
+Parallel trials run in worker processes sharing the study through the database.
+"""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import joblib
+import numpy as np
+import optuna
+import pandas as pd
+from optuna.storages import RDBStorage, RetryFailedTrialCallback
+from optuna.study import MaxTrialsCallback
+from optuna.trial import TrialState
+from sklearn.base import clone
+from sklearn.metrics import make_scorer
+from sklearn.model_selection import StratifiedKFold, cross_val_score
+from sklearn.utils import _safe_indexing
+
+from src.logger import ROOT_DIR
+from src.ml_utils.config import Classifier, TrainingParams
+from src.ml_utils.feature_store import frame_fingerprint
+
+# Trials that used up the budget; failed ones too, so a grid with invalid combinations still ends
+_FINISHED = (TrialState.COMPLETE, TrialState.PRUNED, TrialState.FAIL)
+# Params the scheduler and the notebook change without changing the model
+_RUNTIME_PARAMS = {'n_jobs', 'thread_count', 'verbose'}
+# Heartbeats and stale trial retries are marked experimental but are what makes a dead kernel resumable
+warnings.filterwarnings('ignore', category=optuna.exceptions.ExperimentalWarning)
+
+
+def search_space(param_grid: Dict) -> Dict[str, Tuple[List, Optional[Dict]]]:
+    """
+    Optuna choices for every param_grid list. Optuna stores only None/bool/int/float/str,
+    other values (hidden_layer_sizes tuples) are stored as their repr and mapped back.
+    """
+    space = {}
+    for name, values in param_grid.items():
+        if not isinstance(values, (list, tuple)):
+            raise ValueError(f'{name}: the optuna engine takes lists of values, got {type(values).__name__}')
+        if all(value is None or isinstance(value, (bool, int, float, str)) for value in values):
+            space[name] = (list(values), None)
+        else:
+            space[name] = ([repr(value) for value in values], {repr(value): value for value in values})
+    return space
+
+
+def decode_params(params: Dict, space: Dict) -> Dict:
+    return {name: space[name][1][value] if space[name][1] is not None else value for name, value in params.items()}
+
+
+def resource_schedule(n_samples: int, n_classes: int, cv: int, factor: int = 2) -> List[int]:
+    """
+    Subsample sizes a trial is scored on: min_resources * factor^i below n_samples, then n_samples.
+    The smallest size is HalvingRandomSearchCV's min_resources='smallest' for classification.
+    """
+    schedule = [min(2 * cv * n_classes, n_samples)]
+    while schedule[-1] * factor < n_samples:
+        schedule.append(schedule[-1] * factor)
+    if schedule[-1] != n_samples:
+        schedule.append(n_samples)
+    return schedule
+
+
+def stratified_order(y: np.ndarray, random_state: int) -> np.ndarray:
+    """A row order whose every prefix has about the class proportions of y."""
+    rng = np.random.default_rng(random_state)
+    keys = np.empty(len(y))
+    for label in np.unique(y):
+        rows = rng.permutation(np.flatnonzero(y == label))
+        keys[rows] = (np.arange(len(rows)) + rng.random()) / len(rows)
+    return np.argsort(keys, kind='stable')
+
+
+def study_name(classifier: Classifier, X, y, scoring_metric: str, random_state: int) -> str:
+    """Same model, grid, CV and data -> same study, so a rerun resumes it instead of starting a new one."""
+    params = {name: value for name, value in classifier.estim.get_params(deep=False).items()
+              if name not in _RUNTIME_PARAMS}
+    fingerprint = {
+        'estimator': type(classifier.estim).__name__,
+        'params': repr(sorted(params.items())),
+        'grid': repr(sorted(classifier.param_grid.items())),
+        'cv': classifier.cv,
+        'random_state': random_state,  # the subsample order and the CV folds
+        'scoring': getattr(scoring_metric, '__name__', str(scoring_metric)),
+        'shape': list(X.shape),
+        'nnz': int(getattr(X, 'nnz', 0)),
+        # Fold-aware CV searches over the preprocessed text frame instead of a matrix
+        'frame': frame_fingerprint(X) if isinstance(X, pd.DataFrame) else None,
+        'y': hashlib.sha256(np.ascontiguousarray(y).tobytes()).hexdigest(),
+    }
+    digest = hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode('utf-8')).hexdigest()
+    return f'{classifier.name}-{digest[:12]}'
+
+
+def _storage(path: Path) -> RDBStorage:
+    return RDBStorage(
+        url=f'sqlite:///{path}',
+        engine_kwargs={'connect_args': {'timeout': 60}},  # workers wait for the write lock instead of failing
+        # A trial left RUNNING by a dead kernel is marked failed and retried once
+        heartbeat_interval=30,
+        grace_period=120,
+        failed_trial_callback=RetryFailedTrialCallback(max_retry=1),
+    )
+
+
+def _optimize(name: str, storage_path: str, estimator, space: Dict, X, y, cv: int, random_state: int, scoring,
+              schedule: List[int], order: np.ndarray, factor: int, n_trials: int,
+              timeout: Optional[float], sampler_seed: int, verbose: bool) -> None:
+    optuna.logging.set_verbosity(optuna.logging.INFO if verbose else optuna.logging.WARNING)
+    if isinstance(X, str):
+        X, y = joblib.load(X, mmap_mode='r')
+    study = optuna.load_study(
+        study_name=name,
+        storage=_storage(Path(storage_path)),
+        sampler=optuna.samplers.TPESampler(seed=sampler_seed),
+        pruner=optuna.pruners.SuccessiveHalvingPruner(min_resource=schedule[0], reduction_factor=factor),
+    )
+    if len(study.get_trials(deepcopy=False, states=_FINISHED)) >= n_trials:
+        return
+    # The same folds in every worker and every run, so all the scores of the study are comparable
+    folds = StratifiedKFold(n_splits=cv, shuffle=True, random_state=random_state)
+
+    def objective(trial: optuna.Trial) -> float:
+        params = decode_params({param: trial.suggest_categorical(param, choices)
+                                for param, (choices, _) in space.items()}, space)
+        # A small grid is exhausted long before n_trials, a repeated combination is not evaluated again
+        for previous in trial.study.get_trials(deepcopy=False, states=(TrialState.COMPLETE, TrialState.PRUNED)):
+            if previous.params == trial.params:
+                if previous.state == TrialState.PRUNED:
+                    raise optuna.TrialPruned()
+                return previous.value
+        model = clone(estimator).set_params(**params)
+        for size in schedule:
+            rows = order[:size]
+            score = cross_val_score(model, _safe_indexing(X, rows), y[rows], cv=folds, scoring=scoring,
+                                    error_score='raise').mean()
+            trial.report(score, step=size)
+            if size < schedule[-1] and trial.should_prune():
+                raise optuna.TrialPruned()
+        return score
+
+    study.optimize(objective, timeout=timeout, catch=(ValueError,),
+                   callbacks=[MaxTrialsCallback(n_trials, states=_FINISHED)])
+
+
+def optuna_search(classifier: Classifier, train_params: TrainingParams, X_train, y_train,
+                  scoring_metric='accuracy', factor: int = 2) -> Tuple:
+    """
+    Resumable pruned search over classifier.param_grid.
+
+    Runs until the study holds train_params.n_trials finished trials (or tuning_timeout runs out),
+    with train_params.n_jobs worker processes.
+
+    Returns:
+        best_estimator (unfitted), best_params, study
+    """
+    storage_path = Path(train_params.tuning_storage or ROOT_DIR / 'tuning.db')
+    os.makedirs(storage_path.parent, exist_ok=True)
+    y_train = np.asarray(y_train)
+    space = search_space(classifier.param_grid)
+    schedule = resource_schedule(len(y_train), len(np.unique(y_train)), classifier.cv, factor)
+    order = stratified_order(y_train, train_params.random_state)
+    name = study_name(classifier, X_train, y_train, scoring_metric, train_params.random_state)
+    study = optuna.create_study(study_name=name, storage=_storage(storage_path), direction='maximize',
+                                load_if_exists=True)
+    done = len(study.get_trials(deepcopy=False, states=_FINISHED))
+    logging.info(f'Optuna study {name} at {storage_path}: {done} trials done, running up to '
+                 f'{train_params.n_trials} with {train_params.n_jobs} worker(s), subsamples {schedule}')
+
+    args = (name, str(storage_path), classifier.estim, space)
+    scoring = scoring_metric if isinstance(scoring_metric, str) else make_scorer(scoring_metric)
+    search = (classifier.cv, train_params.random_state, scoring, schedule, order, factor, train_params.n_trials,
+              train_params.tuning_timeout)
+    if train_params.n_jobs <= 1:
+        _optimize(*args, X_train, y_train, *search, train_params.random_state, train_params.verbose)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            # Workers memory-map one copy of the training data instead of receiving a pickle each
+            data_path = os.path.join(tmp, 'train.joblib')
+            joblib.dump((X_train, y_train), data_path)
+            with ProcessPoolExecutor(max_workers=train_params.n_jobs,
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                # Only the samplers differ between workers, otherwise they would propose the same trials
+                futures = [executor.submit(_optimize, *args, data_path, None, *search,
+                                           train_params.random_state + worker, train_params.verbose)
+                           for worker in range(train_params.n_jobs)]
+                for future in futures:
+                    future.result()
+
+    counts = {state.name.lower(): len(study.get_trials(deepcopy=False, states=(state,))) for state in _FINISHED}
+    if not study.get_trials(deepcopy=False, states=(TrialState.COMPLETE,)):
+        # Every trial failed or was pruned, or the timeout came first
+        logging.warning(f'Optuna study {name}: {counts}, no completed trial. Using base estimator.')
+        return clone(classifier.estim), {}, study
+    logging.info(f'Optuna study {name}: {counts}, best CV score {study.best_value:.4f}')
+    best_params = decode_params(study.best_params, space)
+    return clone(classifier.estim).set_params(**best_params), best_params, study
+
+
+def best_score_curve(study: optuna.Study) -> pd.DataFrame:
+    """Best full-data CV score so far after every completed trial, against seconds since the study started."""
+    trials = study.get_trials(deepcopy=False, states=(TrialState.COMPLETE,))
+    if not trials:
+        return pd.DataFrame(columns=['trial', 'seconds', 'score', 'best_score'])
+    start = min(trial.datetime_start for trial in study.get_trials(deepcopy=False))
+    curve = pd.DataFrame({
+        'trial': [trial.number for trial in trials],
+        'seconds': [(trial.datetime_complete - start).total_seconds() for trial in trials],
+        'score': [trial.value for trial in trials],
+    }).sort_values('seconds', ignore_index=True)
+    curve['best_score'] = curve['score'].cummax()
+    return curve
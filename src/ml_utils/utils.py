@@ -1,62 +1,248 @@
 import pandas as pd
-from src.ml_utils.transformers import TextCleaner, SpacyTokenizer, TokenProcessor
+from src.json_stream import iter_json_records
+from src.ml_utils.transformers import (
+    FoldCachedFeatures,
+    IncrementalIdfTransformer,
+    TextPreprocessor,
+    shard_budget,
+    split_tags,
+    text_preprocess_steps
+)
 from src.ml_utils.config import PreprocessParams, TrainingParams, Classifier
+from src.ml_utils.feature_store import frame_fingerprint
+from src.ml_utils.tuning import optuna_search
+from src.logger import ROOT_DIR
+from sklearn.base import clone
 from sklearn.pipeline import Pipeline
 from sklearn.compose import ColumnTransformer
-from sklearn.preprocessing import OneHotEncoder
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import FunctionTransformer, OneHotEncoder
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer
 from sklearn.metrics import make_scorer, accuracy_score
 from sklearn.experimental import enable_halving_search_cv  # noqa
-from sklearn.model_selection import HalvingRandomSearchCV
+from sklearn.model_selection import HalvingRandomSearchCV, train_test_split
+from scipy import sparse
+import numpy as np
+import psutil
 import logging
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from dataclasses import asdict, replace
+from pathlib import Path
+import joblib
+import json
+import os
 
 def filter_n_most_common_categories(df: pd.DataFrame, n: int):
     if 'category' not in df.columns:
         raise ValueError("The DataFrame must contain a 'category' column.")
-    top_n_categories = df['category'].value_counts().head(n).index.tolist()
-    filtered_df = df[df['category'].apply(lambda x: x in top_n_categories)]
-    return filtered_df
+    top_n_categories = df['category'].value_counts().head(n).index
+    return df[df['category'].isin(top_n_categories).to_numpy()]
 
-def create_text_pipeline(params: PreprocessParams):
+def create_text_pipeline(params: PreprocessParams, preprocess: bool = True):
+    # Without preprocess the pipeline expects text already cleaned and processed by TextPreprocessor
+    preprocess_steps = text_preprocess_steps(params) if preprocess else []
+    if params.vectorizer == 'hashing':
+        vectorizer_steps = [
+            ('vectorizer', HashingVectorizer(n_features=params.n_features, alternate_sign=False, norm=None)),
+            ('idf', IncrementalIdfTransformer()),
+        ]
+    else:
+        vectorizer_steps = [('vectorizer', TfidfVectorizer())]
     return Pipeline([
-        ('cleaner', TextCleaner(params)),
-        ('tokenizer', SpacyTokenizer(params)),
-        ('processor', TokenProcessor(params)),
-        ('vectorizer', TfidfVectorizer())
+        *preprocess_steps,
+        *vectorizer_steps
     ], verbose=params.verbose)
 
-def get_feature_pipeline(params: PreprocessParams):
+def get_feature_pipeline(params: PreprocessParams, n_jobs: int = 1):
     text_columns = ['text', 'title']
+    # Column jobs times spaCy shards stays within the cores: the branches run at once, each with its shards
+    column_jobs = min(joblib.effective_n_jobs(n_jobs), len(text_columns) + 1, os.cpu_count() or 1)
+    text_params = replace(params, n_shards=shard_budget(params.n_shards, column_jobs))
     text_transformers = [
-        (f'{col}_pipeline', create_text_pipeline(params), col)
+        (f'{col}_pipeline', create_text_pipeline(text_params, preprocess=not params.fold_aware), col)
         for col in text_columns
     ]
 
+    if params.vectorizer == 'hashing':
+        # Stateless tag encoding: tags unseen in the first chunk still get their own column
+        tags_transformer = ('tags_preprocess', HashingVectorizer(
+            analyzer=split_tags, n_features=params.n_tag_features, alternate_sign=False, norm=None, binary=True
+        ), 'tags')
+    else:
+        tags_transformer = ('tags_preprocess', OneHotEncoder(sparse_output=True, drop='first', handle_unknown='ignore'), ['tags'])
+
     transformer = ColumnTransformer(
         transformers=[
             *text_transformers,
-            ('tags_preprocess', OneHotEncoder(sparse_output=False, drop='first'), ['tags']),
+            tags_transformer,
         ],
         remainder='drop',
+        n_jobs=column_jobs,
         verbose=params.verbose,
-        sparse_threshold=1,
+        sparse_threshold=1,  # every branch is sparse, so the stacked output stays CSR
     )
 
-    pipe = Pipeline(steps=[('column_processor', transformer)], verbose=params.verbose)
+    steps = [('column_processor', transformer)]
+    if params.fold_aware:
+        steps.insert(0, ('preprocess', TextPreprocessor(params, columns=text_columns)))
+    pipe = Pipeline(steps=steps, verbose=params.verbose)
     
     return pipe
 
+class CVFrame(NamedTuple):
+    """Training rows after the stateless text stage, plus the stateful stages to refit on every CV fold."""
+    X: pd.DataFrame
+    features: Pipeline
+    cache_dir: Path
+    key: str  # content fingerprint of X, folds are keyed by their index labels within it
+
+def fit_fold_aware_features(pipe: Pipeline, X: pd.DataFrame, params: PreprocessParams,
+                            train_params: TrainingParams) -> Tuple[sparse.csr_matrix, CVFrame]:
+    """
+    Fits a fold_aware feature pipeline without leaking the test rows.
+
+    spaCy and cleaning run once over all rows (they learn nothing), the vectorizers and the tag encoder
+    are fitted on the training rows of the same split train_test_split makes in the notebook.
+
+    Returns:
+        The matrix of all rows and the CVFrame of the training rows for tuning_params_step.
+    """
+    X_preprocessed = pipe.named_steps['preprocess'].transform(X)
+    train_rows, _ = train_test_split(
+        np.arange(len(X)),
+        test_size=train_params.test_size,
+        random_state=train_params.random_state,
+        shuffle=train_params.shuffle_split
+    )
+    cv_frame = make_cv_frame(pipe, X_preprocessed.iloc[train_rows], params)
+    pipe[1:].fit(cv_frame.X)
+    return sparse.csr_matrix(pipe[1:].transform(X_preprocessed)), cv_frame
+
+def make_cv_frame(pipe: Pipeline, X_preprocessed: pd.DataFrame, params: PreprocessParams) -> CVFrame:
+    """The fitted stages of the per-fold pipelines are memoized under <cache_dir>/folds."""
+    cache_dir = Path(params.cache_dir) if params.cache_dir is not None else ROOT_DIR / 'cache'
+    if not X_preprocessed.index.is_unique:
+        X_preprocessed = X_preprocessed.reset_index(drop=True)
+    return CVFrame(X_preprocessed, clone(pipe[1:]), cache_dir / 'folds', frame_fingerprint(X_preprocessed))
+
+def iter_article_chunks(paths: Iterable[str], chunksize: int = 1000,
+                        columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """Reads JSON/JSONL article dumps record by record and yields DataFrames of at most chunksize rows."""
+    records = []
+    for path in paths:
+        for record in iter_json_records(path):
+            records.append(record if columns is None else {col: record.get(col) for col in columns})
+            if len(records) == chunksize:
+                yield pd.DataFrame.from_records(records, columns=columns)
+                records = []
+    if records:
+        yield pd.DataFrame.from_records(records, columns=columns)
+
+def partial_fit_features(pipe: Pipeline, X: pd.DataFrame, update_idf: bool = True):
+    """
+    Updates the IDF statistics of a hashing feature pipeline with one chunk and returns the chunk's features.
+    The first call fits the pipeline, every branch runs the spaCy stage only once per chunk.
+    With update_idf=False the chunk is only transformed: later epochs must not count the same documents again.
+    """
+    column_processor = pipe.named_steps['column_processor']
+    if not hasattr(column_processor, 'transformers_'):
+        return sparse.csr_matrix(pipe.fit_transform(X))
+    if not update_idf:
+        return sparse.csr_matrix(pipe.transform(X))
+    if 'preprocess' in pipe.named_steps:
+        # fold_aware pipelines clean and lemmatize before the column processor
+        X = pipe.named_steps['preprocess'].transform(X)
+
+    blocks = []
+    for _, transformer, columns in column_processor.transformers_:
+        if isinstance(transformer, str):  # 'drop' remainder
+            continue
+        if isinstance(transformer, Pipeline) and hasattr(transformer[-1], 'partial_fit'):
+            counts = transformer[:-1].transform(X[columns])
+            blocks.append(transformer[-1].partial_fit(counts).transform(counts))
+        else:
+            blocks.append(transformer.transform(X[columns]))
+    return sparse.hstack(blocks).tocsr()
+
+def iter_article_batches(chunks: Iterable[pd.DataFrame],
+                         label_column: str = 'category') -> Iterator[Tuple[pd.DataFrame, pd.Series]]:
+    """Splits a stream of article chunks into (articles, labels) for partial_train_stream_step with feature_pipe."""
+    for chunk in chunks:
+        y = chunk.pop(label_column)
+        yield chunk, y
+
+def iter_feature_batches(pipe: Pipeline, chunks: Iterable[pd.DataFrame], label_column: str = 'category',
+                         update_idf: bool = True) -> Iterator[Tuple[sparse.csr_matrix, pd.Series]]:
+    """
+    Turns a stream of article chunks into (features, labels) batches for partial_fit-capable classifiers.
+    Pass update_idf=False after the first epoch; checkpointed runs should give the pipeline to
+    partial_train_stream_step instead, so that it is saved together with the classifier.
+    """
+    for chunk, y in iter_article_batches(chunks, label_column):
+        yield partial_fit_features(pipe, chunk, update_idf), y
+
+def densify(X, max_memory_mb: int):
+    """Converts a sparse matrix to a dense array, refusing if it does not fit the memory budget."""
+    if not sparse.issparse(X):
+        return X
+    required_mb = X.shape[0] * X.shape[1] * X.dtype.itemsize / 1024 ** 2
+    available_mb = psutil.virtual_memory().available / 1024 ** 2
+    if required_mb > min(max_memory_mb, available_mb):
+        raise MemoryError(f"Dense matrix {X.shape} needs {required_mb:.0f} MB, "
+                          f"budget is {max_memory_mb} MB, available {available_mb:.0f} MB")
+    logging.info(f"Densifying {X.shape} matrix ({required_mb:.0f} MB)")
+    return X.toarray()
+
+def prepare_input(X, clf: Classifier, train_params: TrainingParams):
+    """Keeps X sparse unless the classifier is marked as dense-only."""
+    if clf.dense_input:
+        return densify(X, train_params.max_dense_memory_mb)
+    if sparse.issparse(X):
+        return sparse.csr_matrix(X)
+    return np.asarray(X)
+
+def _fold_aware_classifier(classifier: Classifier, cv_frame: CVFrame, train_params: TrainingParams) -> Classifier:
+    """
+    The classifier behind the stateful feature stages, so every CV fold refits them on its own training rows.
+    The stages are memoized per fold: candidates sharing a fold reuse them, reruns find them on disk.
+    """
+    steps = [('features', FoldCachedFeatures(clone(cv_frame.features), cache_dir=str(cv_frame.cache_dir),
+                                             frame_key=cv_frame.key))]
+    if classifier.dense_input:
+        steps.append(('densify', FunctionTransformer(densify, kw_args={'max_memory_mb': train_params.max_dense_memory_mb},
+                                                     accept_sparse=True)))
+    steps.append(('clf', classifier.estim))
+    param_grid = {f'clf__{name}': values for name, values in classifier.param_grid.items()}
+    estimator = Pipeline(steps)
+    return replace(classifier, estim=estimator, param_grid=param_grid, dense_input=False)
+
 def tuning_params_step(classifier: Classifier,
                        train_params: TrainingParams,
                        X_train, y_train, 
                        scoring_metric='accuracy', 
                        factor=2, 
                        min_resources='smallest', 
-                       max_resources='auto'):
+                       max_resources='auto',
+                       cv_frame: Optional[CVFrame] = None):
+    if cv_frame is not None and classifier.param_grid is not None and classifier.tuning_params:
+        # CV on the preprocessed text instead of the matrix vectorized with the vocabulary of all rows
+        best_estimator, best_params = tuning_params_step(
+            _fold_aware_classifier(classifier, cv_frame, train_params), train_params, cv_frame.X, y_train,
+            scoring_metric=scoring_metric, factor=factor, min_resources=min_resources, max_resources=max_resources
+        )
+        best_params = {name.split('__', 1)[1]: value for name, value in best_params.items()}
+        return clone(classifier.estim).set_params(**best_params), best_params
+
     estimator = classifier.estim
     param_grid = classifier.param_grid
 
-    if param_grid is not None and classifier.tuning_params:
+    if param_grid is not None and classifier.tuning_params and train_params.tuning_engine == 'optuna':
+        logging.info(f'Tuning params step (optuna) has started for {classifier.name}')
+        best_estimator, best_params, _ = optuna_search(
+            classifier, train_params, X_train, y_train, scoring_metric=scoring_metric, factor=factor
+        )
+        logging.info(f"Best Parameters for {classifier.name}: {best_params}")
+
+    elif param_grid is not None and classifier.tuning_params:
         if scoring_metric == 'accuracy':
             scorer = make_scorer(accuracy_score)
         else:
@@ -93,7 +279,8 @@ def tuning_params_step(classifier: Classifier,
 
     return best_estimator, best_params
 
-def train_step(_X_train, _y_train, clf: Classifier, train_params: TrainingParams):
+def train_step(_X_train, _y_train, clf: Classifier, train_params: TrainingParams, cv_frame: Optional[CVFrame] = None):
+    _X_train = prepare_input(_X_train, clf, train_params)
     if clf.tuning_params:
         best_estimator, best_params = tuning_params_step(
             classifier=clf,
@@ -103,10 +290,116 @@ def train_step(_X_train, _y_train, clf: Classifier, train_params: TrainingParams
             scoring_metric='accuracy',
             factor=2,
             min_resources='smallest',
-            max_resources='auto'
+            max_resources='auto',
+            cv_frame=cv_frame
         )
         clf.estim = best_estimator.set_params(**best_params)
     logging.info(f'Fit step has started for {clf.name}')
     clf.estim.fit(_X_train, _y_train)
     logging.info('Fit step finished successfully!')
     return clf
+
+def iter_row_chunks(X, y, chunk_size: int, random_state: Optional[int] = None) -> Iterator[Tuple]:
+    """Splits an in-memory training set into fixed-size chunks, optionally in shuffled order."""
+    y = np.asarray(y)
+    order = np.arange(X.shape[0])
+    if random_state is not None:
+        np.random.default_rng(random_state).shuffle(order)
+    for start in range(0, len(order), chunk_size):
+        rows = order[start:start + chunk_size]
+        yield X[rows], y[rows]
+
+def _save_checkpoint(path: Path, estim, features: Optional[Pipeline], epoch: int, chunk: int) -> None:
+    tmp_path = path.with_suffix('.tmp')
+    joblib.dump({'estim': estim, 'features': features, 'epoch': epoch, 'chunk': chunk}, tmp_path)
+    os.replace(tmp_path, path)  # never leave a half-written checkpoint behind
+
+def partial_train_stream_step(make_batches: Callable[[int], Iterable[Tuple]], clf: Classifier,
+                              train_params: TrainingParams, classes=None,
+                              checkpoint_dir: Optional[Path] = None,
+                              feature_pipe: Optional[Pipeline] = None) -> Classifier:
+    """
+    Streaming counterpart of train_step for estimators with partial_fit (SGD, PassiveAggressive, MultinomialNB, MLP).
+
+    make_batches(epoch) must return a fresh iterable of (X, y) chunks for every epoch.
+    Training continues from clf.estim as is, so an already fitted model can fold in new articles,
+    and from checkpoint_dir/checkpoint.pkl if an interrupted run left one there.
+
+    With feature_pipe (a hashing feature pipeline) the chunks are raw articles (see iter_article_batches):
+    they are featurized here, the IDF statistics are updated during the first epoch only, and the
+    pipeline is checkpointed with the classifier and restored into feature_pipe on resume.
+    """
+    if not hasattr(clf.estim, 'partial_fit'):
+        raise ValueError(f"{clf.name} does not support partial_fit, use train_step instead.")
+
+    start_epoch, start_chunk, checkpoint_path = 0, 0, None
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        checkpoint_path = Path(checkpoint_dir) / 'checkpoint.pkl'
+        if checkpoint_path.exists():
+            checkpoint = joblib.load(checkpoint_path)
+            clf.estim, start_epoch, start_chunk = checkpoint['estim'], checkpoint['epoch'], checkpoint['chunk']
+            if feature_pipe is not None:
+                if checkpoint.get('features') is None:
+                    raise ValueError(f'{checkpoint_path} holds no feature pipeline, remove it to start over')
+                # The caller's pipeline gets the IDF state the checkpointed classifier was trained with
+                feature_pipe.steps = checkpoint['features'].steps
+            logging.info(f'Resuming {clf.name} from epoch {start_epoch + 1}, chunk {start_chunk}')
+
+    logging.info(f'Partial fit step has started for {clf.name}')
+    for epoch in range(start_epoch, train_params.epochs):
+        n_chunks = 0
+        for chunk_idx, (X_chunk, y_chunk) in enumerate(make_batches(epoch)):
+            if epoch == start_epoch and chunk_idx < start_chunk:
+                continue
+            if feature_pipe is not None:
+                X_chunk = partial_fit_features(feature_pipe, X_chunk, update_idf=epoch == 0)
+            X_chunk = prepare_input(X_chunk, clf, train_params)
+            if hasattr(clf.estim, 'classes_'):
+                clf.estim.partial_fit(X_chunk, y_chunk)
+            else:
+                clf.estim.partial_fit(X_chunk, y_chunk, classes=classes)
+            n_chunks += 1
+
+            if checkpoint_path is not None and (chunk_idx + 1) % train_params.checkpoint_every == 0:
+                _save_checkpoint(checkpoint_path, clf.estim, feature_pipe, epoch, chunk_idx + 1)
+        start_chunk = 0
+        logging.info(f'Epoch {epoch + 1}/{train_params.epochs} finished for {clf.name} ({n_chunks} chunks)')
+
+    if checkpoint_path is not None and checkpoint_path.exists():
+        checkpoint_path.unlink()
+    logging.info('Partial fit step finished successfully!')
+    return clf
+
+def partial_train_step(_X_train, _y_train, clf: Classifier, train_params: TrainingParams,
+                       classes=None, checkpoint_dir: Optional[Path] = None) -> Classifier:
+    """Runs partial_train_stream_step over fixed-size chunks of an already materialized training set."""
+    if classes is None:
+        classes = np.unique(_y_train)
+    return partial_train_stream_step(
+        lambda epoch: iter_row_chunks(_X_train, _y_train, train_params.chunk_size,
+                                      random_state=train_params.random_state + epoch),
+        clf=clf,
+        train_params=train_params,
+        classes=classes,
+        checkpoint_dir=checkpoint_dir
+    )
+
+def save_step(clf: Classifier, preprocess_params: PreprocessParams, train_params: TrainingParams,
+              x_pipeline: Pipeline, y_estim, m_dict: Dict, save_dir: Optional[Path] = None) -> Path:
+    """Saves the model, feature pipeline, label encoder, params and metrics to pretrained/<clf.name>."""
+    logging.info('Save step has been started')
+    save_dir = Path(save_dir) if save_dir is not None else ROOT_DIR / 'pretrained' / clf.name
+    os.makedirs(save_dir, exist_ok=True)
+    joblib.dump(clf.estim, save_dir / 'model.pkl')
+    joblib.dump(x_pipeline, save_dir / 'x_pipe.pkl')
+    joblib.dump(y_estim, save_dir / 'y_estim.pkl')
+
+    for name, payload in (('preprocess_params', asdict(preprocess_params)),
+                          ('train_params', asdict(train_params)),
+                          ('metrics_eval', m_dict)):
+        with open(save_dir / f'{name}.json', 'w') as json_file:
+            json.dump(payload, json_file, indent=4)
+
+    logging.info(f'Save checkpoint was created successully at: {save_dir}')
+    return save_dir
@@ -1,12 +1,13 @@
-import json
+import argparse
 import logging
-import random
-import time
 from pathlib import Path
 
-import requests
 from bs4 import BeautifulSoup
-from requests.adapters import HTTPAdapter, Retry
+
+from src.parser.crawl_engine import AimdPolicy, Site, crawl_site
+from src.parser.crawl_state import CrawlState, ListingWalk
+from src.parser.jsonl_writer import JsonlArticleWriter, compact
+from src.parser.response_archive import ResponseArchive, replay_path, reset_replay_log
 
 BASE_URL = "https://www.belta.by/"
 CATEGORIES = [
@@ -26,7 +27,11 @@ CATEGORIES = [
 MAX_PAGES = 100
 TARGET_COUNT = 1000
 OUTPUT_FILE = Path("data/belta_articles.json")
+LOG_FILE = Path("data/belta_articles.jsonl")
+ARCHIVE_FILE = Path("data/belta_responses.warc.gz")
+STATE_FILE = Path("data/belta_state.sqlite")
 SAVE_BATCH = 100
+MAX_RATE = 5.0  # запросов в секунду, не больше
 
 HEADERS = {
     "Accept": "*/*",
@@ -45,47 +50,11 @@ logging.basicConfig(
 
 # ==================== Функции ====================
 
-def create_session() -> requests.Session:
-    """
-    Создает сессию requests с настройками повторных попыток (retry).
-    """
-    session = requests.Session()
-    retries = Retry(
-        total=3,                # Общее число повторов
-        backoff_factor=1,       # Задержка между повторными попытками: 1, 2, 4 сек.
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["HEAD", "GET", "OPTIONS"]
-    )
-    adapter = HTTPAdapter(max_retries=retries)
-    session.mount("https://", adapter)
-    session.mount("http://", adapter)
-    return session
-
-
-def fetch_page(session: requests.Session, url: str) -> str:
-    """
-    Получает HTML-страницу по URL с обработкой ошибок.
-    """
-    try:
-        logging.debug(f"Запрос: {url}")
-        response = session.get(url, headers=HEADERS, timeout=10)
-        response.raise_for_status()
-        return response.text
-    except requests.RequestException as e:
-        logging.error(f"Ошибка при запросе {url}: {e}")
-        return ""
-
-
-def parse_article(session: requests.Session, article_path: str) -> tuple[str, str]:
+def extract_article(html: bytes) -> tuple[str, str]:
     """
     Парсит страницу отдельной статьи.
     Возвращает кортеж (текст статьи, теги).
     """
-    article_url = BASE_URL + article_path.lstrip("/")
-    html = fetch_page(session, article_url)
-    if not html:
-        return "None", "None"
-
     soup = BeautifulSoup(html, "lxml")
 
     # Извлечение основного текста статьи
@@ -101,111 +70,128 @@ def parse_article(session: requests.Session, article_path: str) -> tuple[str, st
             if title:
                 tags.append(title)
     tags_str = ",".join(tags) if tags else "None"
-
-    logging.debug(f"Статья: {article_url} | Теги: {tags_str[:50]}...")
     return article_text, tags_str
 
 
-def save_data(catalog: list, output_file: Path):
+def extract_news_links(html: bytes) -> list[tuple[str, str]]:
     """
-    Сохраняет данные в JSON-файл.
-    Итоговая структура файла — массив объектов.
+    Извлекает пары (ссылка, заголовок) со страницы раздела.
+    Пустой список означает, что новостей на странице нет.
     """
-    output_file.parent.mkdir(parents=True, exist_ok=True)
-    with output_file.open("w", encoding="utf-8") as f:
-        json.dump(catalog, f, ensure_ascii=False, indent=4)
-    logging.info(f"Данные сохранены в {output_file} (всего статей: {len(catalog)})")
-
-
-def parse_category(session: requests.Session, category: str, catalog: list) -> int:
-    """
-    Парсит статьи для заданной категории и добавляет их в общий список catalog.
-    Процесс останавливается, как только накопится TARGET_COUNT статей для этой категории.
-    
-    Возвращает количество статей, спарсенных для категории.
-    """
-    cat_count = 0
-    for page in range(MAX_PAGES):
-        # Если уже достигнуто целевое количество, прекращаем парсинг этой категории.
-        if cat_count >= TARGET_COUNT:
-            logging.info(f"Достигнуто {cat_count} статей для категории '{category.rstrip('/')}' (цель: {TARGET_COUNT}).")
-            break
-
-        # Формирование URL: первая страница без "page/", далее с указанием номера страницы.
-        page_url = BASE_URL + category if page == 0 else BASE_URL + category + "page/" + str(page)
-        logging.info(f"Парсинг категории '{category}', страница {page}: {page_url}")
-
-        html = fetch_page(session, page_url)
-        if not html:
-            logging.warning(f"Пустой ответ для {page_url}. Пропускаем страницу.")
-            continue
-
-        soup = BeautifulSoup(html, "lxml")
-        news_items = soup.find_all(class_="news_item")
-        if not news_items:
-            logging.info(f"Нет новостей на странице {page_url}. Возможно, достигнут конец раздела.")
-            break  # Если новостей нет, прекращаем обработку страниц
-
-        links, titles = [], []
-        # Извлечение ссылок и заголовков
-        for item in news_items:
-            for tag in item.find_all("a", href=True, title=True):
-                links.append(tag.get("href"))
-                titles.append(tag.get("title"))
-
-        if not links:
-            logging.info(f"Не найдены ссылки на новости на странице {page_url}")
-            continue
-
-        # Обработка каждой найденной статьи
-        for link, title in zip(links, titles):
-            # Если уже достигнуто целевое количество, прерываем обработку
+    soup = BeautifulSoup(html, "lxml")
+    links = []
+    for item in soup.find_all(class_="news_item"):
+        for tag in item.find_all("a", href=True, title=True):
+            links.append((tag.get("href"), tag.get("title")))
+    return links
+
+
+class BeltaSite(Site):
+    name = "belta"
+    headers = HEADERS
+
+    async def discover_category(self, engine, category: str, writer):
+        """
+        Обходит страницы раздела и отдает статьи, которых еще нет в логе.
+        Процесс останавливается, как только наберется TARGET_COUNT статей для этой категории
+        (с учётом статей, сохранённых в прошлых запусках).
+        Повторный обход раздела листает страницы только до статей, найденных в прошлый раз.
+        """
+        cat_name = category.rstrip("/")
+        cat_count = writer.key_counts[cat_name] if writer is not None else 0
+        walk = ListingWalk(engine.state, self.name, cat_name, known=lambda link: writer is not None and link in writer)
+        # Раздел пройден до конца, только если кончились страницы и ни одна не была пропущена
+        exhausted, skipped = False, False
+        for page in range(MAX_PAGES):
+            # Если уже достигнуто целевое количество, прекращаем парсинг этой категории.
             if cat_count >= TARGET_COUNT:
+                logging.info(f"Достигнуто {cat_count} статей для категории '{cat_name}' (цель: {TARGET_COUNT}).")
+                break
+            # Дошли до статей, известных по прошлому обходу
+            if walk.done:
+                logging.info(f"Новых статей в категории '{cat_name}' больше нет.")
                 break
 
-            article_text, article_tags = parse_article(session, link)
-            article_data = {
-                "article_id": link,
-                "title": title,
-                "category": category.rstrip("/"),
-                "tags": article_tags,
-                "text": article_text
-            }
-            catalog.append(article_data)
-            cat_count += 1
-            logging.debug(f"Добавлена статья: {title} ({cat_count} из {TARGET_COUNT})")
-
-            # Сохранение данных каждые SAVE_BATCH статей
-            if len(catalog) % SAVE_BATCH == 0:
-                save_data(catalog, OUTPUT_FILE)
-
-            # Небольшая случайная задержка, чтобы не нагружать сервер
-            time.sleep(random.uniform(0.5, 1.5))
-
-        logging.info(f"Страница {page} категории '{category.rstrip('/')}' обработана, спарсено {cat_count} из {TARGET_COUNT} статей.")
-        # Если на странице новостей меньше ожидаемого — возможно, достигнут конец раздела.
-        # В этом случае завершаем парсинг категории, даже если целевое количество не достигнуто.
-    logging.info(f"Для категории '{category.rstrip('/')}' спарсено {cat_count} из {TARGET_COUNT} статей.")
-    return cat_count
-
-
-def main():
+            # Формирование URL: первая страница без "page/", далее с указанием номера страницы.
+            page_url = BASE_URL + category if page == 0 else BASE_URL + category + "page/" + str(page)
+            logging.info(f"Парсинг категории '{category}', страница {page}: {page_url}")
+
+            response = await engine.fetch(page_url, revalidate=walk.incremental)
+            if response and response.status == 304:
+                walk.not_modified()
+                continue
+            if not response or not response.ok:
+                logging.warning(f"Пустой ответ для {page_url}. Пропускаем страницу.")
+                skipped = True
+                continue
+
+            links = extract_news_links(response.body)
+            if not links:
+                logging.info(f"Нет новостей на странице {page_url}. Возможно, достигнут конец раздела.")
+                exhausted = True
+                break  # Если новостей нет, прекращаем обработку страниц
+            new_links = set(walk.page([link for link, _ in links]))
+
+            for link, title in links:
+                if link not in new_links:
+                    continue
+                if cat_count >= TARGET_COUNT:
+                    break
+                # Статья уже сохранена в одном из прошлых запусков
+                if writer is not None and link in writer:
+                    continue
+                cat_count += 1
+                yield BASE_URL + link.lstrip("/"), {"article_id": link, "title": title, "category": cat_name}
+
+        walk.finish(exhausted and not skipped, capped=cat_count >= TARGET_COUNT)
+        logging.info(f"Для категории '{cat_name}' найдено {cat_count} из {TARGET_COUNT} статей.")
+
+    async def discover(self, engine, writer):
+        for category in CATEGORIES:
+            logging.info(f"Обработка категории: {category.rstrip('/')}")
+            async for item in self.discover_category(engine, category, writer):
+                yield item
+
+    def extract(self, url, html, meta):
+        article_text, article_tags = extract_article(html)
+        logging.debug(f"Статья: {url} | Теги: {article_tags[:50]}...")
+        return {
+            "article_id": meta["article_id"],
+            "title": meta["title"],
+            "category": meta["category"],
+            "tags": article_tags,
+            "text": article_text
+        }
+
+
+def main(replay=False):
     logging.info("Начало парсинга.")
-    session = create_session()
-    catalog = []  # Итоговый список объектов-статей
-    category_counts = {}  # Подсчет статей по категориям
+    log_file, output_file = LOG_FILE, OUTPUT_FILE
+    if replay:
+        # Повторное извлечение из архива ответов: без сети, результат рядом с исходным датасетом
+        log_file, output_file = reset_replay_log(log_file), replay_path(output_file)
+    writer = JsonlArticleWriter(log_file, fsync_every=SAVE_BATCH)  # Лог статей, переживает перезапуски
+    if not replay and not len(writer) and output_file.exists():
+        writer.import_records(output_file)
+    archive = ResponseArchive(ARCHIVE_FILE)
+    # ETag/Last-Modified страниц разделов и граница прошлого обхода; при повторе из архива не нужны
+    state = CrawlState(STATE_FILE) if not replay else None
 
     try:
-        for category in CATEGORIES:
-            logging.info(f"Обработка категории: {category.rstrip('/')}")
-            cat_count = parse_category(session, category, catalog)
-            category_counts[category.rstrip("/")] = cat_count
+        # Статьи скачиваются параллельно; темп (от 1 запроса/сек, растёт, пока сайт отвечает быстро)
+        # и повторы держит общий движок, все ответы сохраняются в архив
+        crawl_site(BeltaSite(), writer, workers=4, per_host_concurrency=4, per_host_rate=1.0,
+                   adaptive=AimdPolicy(max_rate=MAX_RATE), archive=archive, replay=replay, state=state)
     except KeyboardInterrupt:
         logging.info("Парсинг прерван пользователем (Ctrl+C).")
     finally:
-        # Сохраняем накопленные данные
-        save_data(catalog, OUTPUT_FILE)
-        total_articles = len(catalog)
+        # Закрываем лог и собираем итоговый JSON без дубликатов
+        writer.close()
+        archive.close()
+        if state is not None:
+            state.close()
+        total_articles = compact(log_file, output_file)
+        category_counts = {category.rstrip("/"): writer.key_counts[category.rstrip("/")] for category in CATEGORIES}
         logging.info("Парсинг завершён.")
         logging.info(f"Общее количество статей: {total_articles}")
 
@@ -220,4 +206,6 @@ def main():
             logging.info("Требования по количеству статей выполнены.")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--replay', action='store_true', help='извлечь статьи заново из архива ответов, без сети')
+    main(replay=parser.parse_args().replay)
@@ -0,0 +1,352 @@
+"""
+Benchmarks for the scrapers.
+
+throughput: fetch loop pages/sec against a local stub HTTP server. The stub answers every GET
+with a small article page after a fixed latency, so the numbers show only what the loop itself
+can do within the same politeness budget (requests/sec per host).
+
+adaptive: the same stub, now rate limited with 429 + Retry-After, crawled at a fixed worst-case
+rate vs with AIMD pacing (AimdPolicy) starting from that rate.
+
+shards: peak RSS of split_json + merge_json on synthetic dumps of growing size.
+
+extraction: HTML parsing docs/sec on saved article pages (*.html in --fixtures), per parser
+backend and for a site's extract_article in-process vs in a process pool.
+
+dedup: clean_parsed diff of a synthetic links file against a synthetic article dump, with
+tracking params and www/trailing-slash variants, vs the old pandas drop_duplicates + isin.
+
+Run from the repository root, e.g.:
+    python -m src.parser.benchmarks throughput --pages 200 --rate 10 --latency 0.2
+    python -m src.parser.benchmarks adaptive --pages 300 --server-limit 20 --rate 1
+    python -m src.parser.benchmarks shards --records 10000 40000 160000
+    python -m src.parser.benchmarks extraction --fixtures data/fixtures/habr --site habr
+    python -m src.parser.benchmarks dedup --links 1000000 --articles 500000
+"""
+import argparse
+import asyncio
+import collections
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+
+import lxml.html
+import requests
+from bs4 import BeautifulSoup
+
+from src.logger import setup_logger
+from src.parser.clean_parsed import UrlIndex, diff_links
+from src.parser.crawl_engine import AimdPolicy, CrawlEngine, RetryPolicy, Site, crawl
+from src.parser.habr_pack_unpack import merge_json, split_json
+
+_PAGE = ("<html><head><title>Stub</title></head><body><h1>Article {n}</h1>"
+         + "<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>" * 50 + "</body></html>")
+
+
+def _start_stub_server(latency: float, limit: Optional[float] = None) -> ThreadingHTTPServer:
+    """Stub site; with `limit` it answers 429 + Retry-After to requests above `limit` per second."""
+    recent = collections.deque()
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if limit is not None:
+                with lock:
+                    now = time.monotonic()
+                    while recent and now - recent[0] > 1.0:
+                        recent.popleft()
+                    throttled = len(recent) >= limit
+                    if not throttled:
+                        recent.append(now)
+                if throttled:
+                    server.throttled += 1
+                    self.send_response(429)
+                    self.send_header('Retry-After', '1')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+            time.sleep(latency)
+            body = _PAGE.format(n=self.path.rsplit('/', 1)[-1]).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.throttled = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class _StubSite(Site):
+    name = 'stub'
+
+    def __init__(self, base_url: str, pages: int):
+        self.base_url = base_url
+        self.pages = pages
+
+    async def discover(self, engine, writer):
+        for n in range(self.pages):
+            yield f'{self.base_url}/article/{n}', {}
+
+    def extract(self, url, html, meta):
+        return {'article_id': url}
+
+
+def _sequential(base_url: str, pages: int, rate: float) -> float:
+    """The old scraper loop: one blocking request at a time with a sleep that keeps it under `rate`."""
+    session = requests.Session()
+    start = time.perf_counter()
+    for n in range(pages):
+        time.sleep(1 / rate)
+        session.get(f'{base_url}/article/{n}').raise_for_status()
+    return pages / (time.perf_counter() - start)
+
+
+def _engine(base_url: str, pages: int, rate: float, concurrency: int,
+            adaptive: Optional[AimdPolicy] = None, retry: Optional[RetryPolicy] = None):
+    async def _run():
+        async with CrawlEngine(per_host_concurrency=concurrency, per_host_rate=rate, burst=1,
+                               retry=retry or RetryPolicy(max_retries=0), adaptive=adaptive) as engine:
+            start = time.perf_counter()
+            saved = await crawl(_StubSite(base_url, pages), engine, workers=concurrency)
+            return saved / (time.perf_counter() - start), engine.metrics()
+    return asyncio.run(_run())
+
+
+def bench_throughput(args) -> None:
+    server = _start_stub_server(args.latency)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    try:
+        logging.info(f"Budget {args.rate} req/sec per host, server latency {args.latency * 1000:.0f} ms, "
+                     f"{args.pages} pages")
+        sequential = _sequential(base_url, args.pages, args.rate)
+        logging.info(f"Sequential requests loop: {sequential:.2f} pages/sec")
+        for concurrency in args.concurrency:
+            throughput, _ = _engine(base_url, args.pages, args.rate, concurrency)
+            logging.info(f"CrawlEngine, {concurrency:>2} per host: {throughput:.2f} pages/sec "
+                         f"(x{throughput / sequential:.1f})")
+    finally:
+        server.shutdown()
+
+
+def bench_adaptive(args) -> None:
+    server = _start_stub_server(args.latency, limit=args.server_limit)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    retry = RetryPolicy(max_retries=10, backoff_factor=0.1, retry_statuses=(429,))
+    try:
+        logging.info(f"Server allows {args.server_limit} req/sec, {args.pages} pages, "
+                     f"fixed pacing at {args.rate} req/sec vs AIMD up to {args.max_rate} req/sec")
+        for label, adaptive in (('fixed', None), ('AIMD', AimdPolicy(max_rate=args.max_rate))):
+            server.throttled = 0
+            throughput, metrics = _engine(base_url, args.pages, args.rate, args.concurrency, adaptive, retry)
+            logging.info(f"{label:>6}: {throughput:.2f} pages/sec, {server.throttled} answered with 429, "
+                         f"final {metrics}")
+    finally:
+        server.shutdown()
+
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_isolated(func, *args):
+    """Runs func in a fresh process so that its peak RSS is not polluted by earlier runs."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(func, *args).result()
+
+
+def _write_synthetic_dump(path: str, records: int) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for i in range(records):
+            record = {'article_id': f'https://example.com/{i}', 'title': f'Article {i}',
+                      'category': f'category_{i % 10}', 'tags': 'a, b, c', 'text': 'lorem ipsum ' * 150}
+            f.write((',\n' if i else '\n') + json.dumps(record, ensure_ascii=False, indent=4))
+        f.write('\n]\n')
+
+
+def _split_merge_peak(records: int, max_size_mb: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        dump = f'{tmp}/dump.json'
+        _write_synthetic_dump(dump, records)
+        baseline_mb = _peak_rss_mb()
+        start = time.perf_counter()
+        split_json(dump, f'{tmp}/dump', max_size_mb)
+        merge_json(f'{tmp}/merged.json', f'{tmp}/dump')
+        return os.path.getsize(dump) / 1024 ** 2, time.perf_counter() - start, _peak_rss_mb() - baseline_mb
+
+
+def bench_shards(args) -> None:
+    for records in args.records:
+        dump_mb, elapsed, peak_mb = _run_isolated(_split_merge_peak, records, args.max_size_mb)
+        logging.info(f"{records:>7} records ({dump_mb:.0f} MB): split+merge {elapsed:.1f}s, "
+                     f"peak RSS growth {peak_mb:.1f} MB")
+
+
+def _paragraphs_bs4(html: bytes, features: str) -> str:
+    return ' '.join(p.get_text(strip=True) for p in BeautifulSoup(html, features).find_all('p'))
+
+
+def _paragraphs_lxml(html: bytes) -> str:
+    return ' '.join(p.text_content().strip() for p in lxml.html.fromstring(html).iter('p'))
+
+
+def _paragraphs_selectolax(html: bytes) -> str:
+    from selectolax.parser import HTMLParser
+    return ' '.join(p.text(strip=True) for p in HTMLParser(html).css('p'))
+
+
+_BACKENDS = {
+    'bs4 + html.parser': lambda html: _paragraphs_bs4(html, 'html.parser'),
+    'bs4 + lxml': lambda html: _paragraphs_bs4(html, 'lxml'),
+    'lxml.html': _paragraphs_lxml,
+    'selectolax': _paragraphs_selectolax,
+}
+
+
+def _extract_fixture(site: str, html: bytes):
+    """Runs the site's real extraction on a saved page. Module level, so it can be sent to a process pool."""
+    if site == 'habr':
+        return importlib.import_module('src.parser.habr_parser').extract_article(html, 'fixture', 'fixture')
+    if site == 'ria':
+        return importlib.import_module('src.parser.ria_parser').extract_article(html, 'fixture', 'fixture')
+    if site == 'belta':
+        return importlib.import_module('src.parser.belta_parser').extract_article(html)
+    info = {'url': 'fixture', 'category': 'fixture', 'title': '', 'tags': []}
+    return importlib.import_module('src.parser.parser_2').extract_article(html, info)
+
+
+def bench_extraction(args) -> None:
+    pages = [path.read_bytes() for path in sorted(Path(args.fixtures).glob('*.html'))]
+    if not pages:
+        raise SystemExit(f"No *.html fixtures in {args.fixtures}")
+    pages = (pages * (args.docs // len(pages) + 1))[:args.docs]
+    logging.info(f"{len(pages)} documents, {sum(map(len, pages)) / len(pages) / 1024:.0f} KB on average")
+
+    for name, parse in _BACKENDS.items():
+        try:
+            start = time.perf_counter()
+            for html in pages:
+                parse(html)
+        except ImportError as e:
+            logging.info(f"{name:>18}: skipped ({e})")
+            continue
+        logging.info(f"{name:>18}: {len(pages) / (time.perf_counter() - start):.1f} docs/sec")
+
+    start = time.perf_counter()
+    for html in pages:
+        _extract_fixture(args.site, html)
+    inline = len(pages) / (time.perf_counter() - start)
+    logging.info(f"{args.site} extract_article, in-process: {inline:.1f} docs/sec")
+    for workers in args.workers:
+        with ProcessPoolExecutor(workers) as pool:
+            # Warm up the workers so imports are not timed
+            list(pool.map(_extract_fixture, [args.site] * workers, pages[:workers]))
+            start = time.perf_counter()
+            list(pool.map(_extract_fixture, [args.site] * len(pages), pages, chunksize=8))
+            throughput = len(pages) / (time.perf_counter() - start)
+        logging.info(f"{args.site} extract_article, {workers:>2} processes: {throughput:.1f} docs/sec "
+                     f"(x{throughput / inline:.1f})")
+
+
+def _write_synthetic_links(links_path: str, articles_path: str, links: int, articles: int) -> None:
+    with open(links_path, 'w', encoding='utf-8') as f:
+        for i in range(links):
+            # Every fifth link repeats an earlier story as a www/case/utm/trailing-slash variant
+            n = i if i % 5 else i // 2
+            url = f'https://www.example.com/world/story-{n}/' if i % 2 else f'http://EXAMPLE.com/world/story-{n}?utm_source=rss'
+            f.write(json.dumps({'url': url, 'category': 'world', 'title': f'Story {n}'}) + '\n')
+    with open(articles_path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for i in range(articles):
+            f.write((',\n' if i else '\n') + json.dumps({'article_id': f'https://www.example.com/world/story-{i * 2}/',
+                                                         'title': f'Story {i * 2}', 'category': 'world'}))
+        f.write('\n]\n')
+
+
+def bench_dedup(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        links, articles = f'{tmp}/links.jsonl', f'{tmp}/articles.json'
+        _write_synthetic_links(links, articles, args.links, args.articles)
+
+        start = time.perf_counter()
+        index = UrlIndex.build([articles])
+        index.save(f'{tmp}/index')
+        built = time.perf_counter() - start
+        start = time.perf_counter()
+        total, written = diff_links(links, UrlIndex.load(f'{tmp}/index'), f'{tmp}/out.jsonl')
+        diffed = time.perf_counter() - start
+        logging.info(f"index of {args.articles} articles: {built:.2f}s; diff of {total} links: {diffed:.2f}s "
+                     f"({total / diffed:,.0f} links/sec), {written} left")
+
+        if args.pandas:
+            import pandas as pd
+            start = time.perf_counter()
+            links_df = pd.read_json(links, lines=True).drop_duplicates(subset='url')
+            parsed = set(pd.read_json(articles)['article_id'])
+            left = links_df[~links_df['url'].isin(parsed)]
+            logging.info(f"pandas (exact strings, no canonicalization): {time.perf_counter() - start:.2f}s, "
+                         f"{len(left)} left")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    throughput_parser = subparsers.add_parser('throughput', help='pages/sec of the sequential loop vs the engine')
+    throughput_parser.add_argument('--pages', type=int, default=200)
+    throughput_parser.add_argument('--rate', type=float, default=10.0, help='politeness budget, requests/sec')
+    throughput_parser.add_argument('--latency', type=float, default=0.2, help='stub server response time, sec')
+    throughput_parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8])
+    throughput_parser.set_defaults(func=bench_throughput)
+
+    adaptive_parser = subparsers.add_parser('adaptive', help='fixed pacing vs AIMD against a rate-limited stub')
+    adaptive_parser.add_argument('--pages', type=int, default=300)
+    adaptive_parser.add_argument('--rate', type=float, default=1.0, help='fixed rate and AIMD starting rate')
+    adaptive_parser.add_argument('--max-rate', type=float, default=50.0)
+    adaptive_parser.add_argument('--server-limit', type=float, default=20.0, help='requests/sec the stub tolerates')
+    adaptive_parser.add_argument('--latency', type=float, default=0.05)
+    adaptive_parser.add_argument('--concurrency', type=int, default=8)
+    adaptive_parser.set_defaults(func=bench_adaptive)
+
+    shards_parser = subparsers.add_parser('shards', help='peak memory of split/merge vs dump size')
+    shards_parser.add_argument('--records', type=int, nargs='+', default=[10_000, 40_000, 160_000])
+    shards_parser.add_argument('--max-size-mb', type=int, default=30)
+    shards_parser.set_defaults(func=bench_shards)
+
+    extraction_parser = subparsers.add_parser('extraction', help='HTML parsing docs/sec per backend and per process')
+    extraction_parser.add_argument('--fixtures', required=True, help='directory with saved *.html article pages')
+    extraction_parser.add_argument('--site', choices=['habr', 'ria', 'belta', 'reuters'], default='habr')
+    extraction_parser.add_argument('--docs', type=int, default=500, help='fixtures are repeated up to this count')
+    extraction_parser.add_argument('--workers', type=int, nargs='+', default=[2, 4])
+    extraction_parser.set_defaults(func=bench_extraction)
+
+    dedup_parser = subparsers.add_parser('dedup', help='links/sec of the hashed URL index diff')
+    dedup_parser.add_argument('--links', type=int, default=1_000_000)
+    dedup_parser.add_argument('--articles', type=int, default=500_000)
+    dedup_parser.add_argument('--pandas', action='store_true', help='also time the old pandas approach')
+    dedup_parser.set_defaults(func=bench_dedup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    setup_logger(logging.INFO, stdout_log=True, file_log=False)
+    main()
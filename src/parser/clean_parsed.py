@@ -1,22 +1,300 @@
-import pandas as pd
+"""
+Дедупликация ссылок и сравнение источников по каноническим URL.
+
+URL приводятся к каноническому виду (https, хост без www, без фрагмента, utm-меток и
+завершающего слэша, параметры запроса отсортированы) и хешируются в 64 бита. Множество
+уже собранных статей хранится как отсортированный массив хешей на диске (index/hashes.npy),
+поэтому проверка миллионов ссылок - это np.searchsorted, а не сравнение строк в pandas.
+
+Источник - файл ссылок (JSONL/JSON с полем url) или статей (JSON/JSONL или каталог
+ArticleStore с полем article_id). Для источников с относительными id (Belta) нужен --base-url.
+
+Usage:
+    # ссылки, которые еще не спарсены (по умолчанию - старое поведение для Reuters)
+    python -m src.parser.clean_parsed diff --links data/reuters_links.jsonl --against data/reuters_articles.json
+    # постоянный индекс собранных статей и сравнение с ним
+    python -m src.parser.clean_parsed index data/url_index data/reuters_articles_*.json data/belta_store
+    python -m src.parser.clean_parsed diff --links ria_links.json --index data/url_index --output ria_todo.jsonl
+    # дубликаты внутри и между источниками
+    python -m src.parser.clean_parsed dups data/reuters_articles_*.json data/habr_articles.json
+"""
+import argparse
+import hashlib
 import json
+import logging
+import os
+import re
+import time
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+from urllib.parse import urljoin
+
+import numpy as np
+
+from src.json_stream import iter_json_records
+from src.logger import setup_logger
+
+# utm_* - семейство параметров, остальные сравниваются целиком: fromDate=, reference=, rss_id= значимы
+_TRACKING_PREFIXES = ('utm_',)
+_TRACKING_PARAMS = frozenset(('fbclid', 'gclid', 'yclid', 'ysclid', 'from', 'rss', 'ref'))
+# urlsplit + parse_qsl втрое медленнее одного регулярного выражения, а URL - миллионы
+_URL_FIELD_RE = re.compile(r'"(?:url|article_id)":\s*"([^"\\]*)"')
+_URL_RE = re.compile(r'^(?:([A-Za-z][A-Za-z0-9+.-]*):)?//(?:[^@/?#]*@)?([^/?#]*)([^?#]*)(?:\?([^#]*))?')
+
+
+def _is_tracking(param: str) -> bool:
+    name = param.split('=', 1)[0].lower()
+    return name in _TRACKING_PARAMS or name.startswith(_TRACKING_PREFIXES)
+
+
+def canonicalize_url(url: str, base_url: Optional[str] = None) -> str:
+    url = url.strip()
+    if base_url and '://' not in url:
+        url = urljoin(base_url, url)
+    match = _URL_RE.match(url)
+    if match is None:
+        # Относительный id без --base-url: сравнивается как есть
+        return url.split('#', 1)[0].rstrip('/') or '/'
+    scheme, host, path, query = match.groups()
+    scheme = 'https' if scheme is None or scheme.lower() in ('http', 'https') else scheme.lower()
+    host = host.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    if host.endswith((':80', ':443')):
+        host = host.rsplit(':', 1)[0]
+
+    path = path.rstrip('/') or '/'
+    if query:
+        query = '&'.join(sorted(param for param in query.split('&') if param and not _is_tracking(param)))
+    return f'{scheme}://{host}{path}?{query}' if query else f'{scheme}://{host}{path}'
+
+
+def url_hash(url: str, base_url: Optional[str] = None) -> int:
+    """64-битный хеш канонического URL. Вероятность коллизии на миллионах URL ~1e-7."""
+    digest = hashlib.blake2b(canonicalize_url(url, base_url).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def _record_url(record) -> Optional[str]:
+    return record.get('url') or record.get('article_id')
+
+
+def iter_source_urls(source) -> Iterator[str]:
+    """URL всех записей источника: файла ссылок/статей или каталога ArticleStore."""
+    source = Path(source)
+    if source.is_dir():
+        from src.article_store import ArticleStore
+        for batch in ArticleStore(source).iter_batches(columns=['article_id']):
+            yield from batch['article_id'].dropna()
+        return
+    for record in iter_json_records(source):
+        url = _record_url(record)
+        if url:
+            yield url
+
+
+def _isin_sorted(sorted_hashes: np.ndarray, hashes: np.ndarray) -> np.ndarray:
+    if not len(sorted_hashes):
+        return np.zeros(len(hashes), dtype=bool)
+    positions = np.searchsorted(sorted_hashes, hashes)
+    positions[positions == len(sorted_hashes)] = 0
+    return sorted_hashes[positions] == hashes
+
+
+def hash_source(source, base_url: Optional[str] = None) -> np.ndarray:
+    return np.fromiter((url_hash(url, base_url) for url in iter_source_urls(source)), dtype=np.uint64)
+
+
+class UrlIndex:
+    """
+    Постоянный индекс: отсортированные хеши URL и номер источника каждого хеша.
+    Хранится в каталоге как .npy, открывается через mmap, так что не читается в память целиком.
+    """
+    def __init__(self, hashes: np.ndarray, source_ids: np.ndarray, sources: List[str]):
+        self.hashes = hashes
+        self.source_ids = source_ids
+        self.sources = sources
+
+    @classmethod
+    def build(cls, sources: List[str], base_url: Optional[str] = None) -> 'UrlIndex':
+        hashes = [hash_source(source, base_url) for source in sources]
+        source_ids = [np.full(len(h), i, dtype=np.uint16) for i, h in enumerate(hashes)]
+        return cls.from_arrays(np.concatenate(hashes) if hashes else np.empty(0, np.uint64),
+                               np.concatenate(source_ids) if source_ids else np.empty(0, np.uint16),
+                               [str(source) for source in sources])
+
+    @classmethod
+    def from_arrays(cls, hashes: np.ndarray, source_ids: np.ndarray, sources: List[str]) -> 'UrlIndex':
+        order = np.lexsort((source_ids, hashes))
+        hashes, source_ids = hashes[order], source_ids[order]
+        # Одна запись на пару (хеш, источник): дубликаты внутри источника не нужны для поиска
+        keep = np.ones(len(hashes), dtype=bool)
+        keep[1:] = (hashes[1:] != hashes[:-1]) | (source_ids[1:] != source_ids[:-1])
+        return cls(hashes[keep], source_ids[keep], sources)
+
+    def add(self, source, base_url: Optional[str] = None) -> 'UrlIndex':
+        hashes = hash_source(source, base_url)
+        source_ids = np.full(len(hashes), len(self.sources), dtype=np.uint16)
+        return UrlIndex.from_arrays(np.concatenate([np.asarray(self.hashes), hashes]),
+                                    np.concatenate([np.asarray(self.source_ids), source_ids]),
+                                    self.sources + [str(source)])
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        return _isin_sorted(self.hashes, hashes)
+
+    def save(self, path) -> None:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / 'hashes.npy', self.hashes)
+        np.save(path / 'source_ids.npy', self.source_ids)
+        with open(path / 'sources.json', 'w', encoding='utf-8') as f:
+            json.dump(self.sources, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, path) -> 'UrlIndex':
+        path = Path(path)
+        with open(path / 'sources.json', 'r', encoding='utf-8') as f:
+            sources = json.load(f)
+        return cls(np.load(path / 'hashes.npy', mmap_mode='r'), np.load(path / 'source_ids.npy', mmap_mode='r'),
+                   sources)
+
+
+def _iter_link_lines(path) -> Iterator[Tuple[Optional[str], str]]:
+    """
+    URL записей файла ссылок вместе со строкой для вывода. Строки JSONL копируются как есть,
+    а URL без экранированных символов достается регулярным выражением, без json.loads всей строки.
+    """
+    if str(path).endswith('.jsonl'):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                match = _URL_FIELD_RE.search(line)
+                yield match[1] if match else _record_url(json.loads(line)), line.rstrip('\n') + '\n'
+    else:
+        for record in iter_json_records(path):
+            yield _record_url(record), json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def _new_lines(lines: List[str], hashes: np.ndarray, index: UrlIndex, seen: np.ndarray) -> Tuple[List[str], np.ndarray]:
+    """Строки пачки с первым вхождением URL, которого нет ни в индексе, ни в прошлых пачках."""
+    keep = np.zeros(len(hashes), dtype=bool)
+    keep[np.unique(hashes, return_index=True)[1]] = True
+    keep &= ~index.contains(hashes) & ~_isin_sorted(seen, hashes)
+    return [line for line, kept in zip(lines, keep) if kept], np.union1d(seen, hashes[keep])
+
+
+def diff_links(links_file, index: UrlIndex, output_file, base_url: Optional[str] = None,
+               chunk_size: int = 100_000) -> Tuple[int, int]:
+    """
+    Пишет в output_file ссылки, которых нет в индексе, по одной на канонический URL: JSONL, если
+    output_file оканчивается на .jsonl, иначе JSON-массив, как у исходных файлов ссылок.
+    Файл читается один раз пачками по chunk_size; возвращает (сколько ссылок было, сколько записано).
+    """
+    output_file = Path(output_file)
+    tmp_file = output_file.with_name(output_file.name + '.tmp')
+    as_array = output_file.suffix != '.jsonl'
+    seen = np.empty(0, dtype=np.uint64)
+    total = written = 0
+    lines, hashes = [], []
+
+    def write(f, new: List[str]) -> None:
+        if not as_array:
+            f.writelines(new)
+        elif new:
+            # Строки уже готовые JSON-объекты: массив собирается без повторного json.dumps
+            f.write((',\n' if written else '') + ',\n'.join(line.rstrip('\n') for line in new))
+
+    with open(tmp_file, 'w', encoding='utf-8', buffering=1 << 20) as f:
+        if as_array:
+            f.write('[\n')
+        for url, line in _iter_link_lines(links_file):
+            if not url:
+                continue
+            lines.append(line)
+            hashes.append(url_hash(url, base_url))
+            if len(lines) >= chunk_size:
+                new, seen = _new_lines(lines, np.array(hashes, dtype=np.uint64), index, seen)
+                write(f, new)
+                total, written = total + len(lines), written + len(new)
+                lines, hashes = [], []
+        new, seen = _new_lines(lines, np.array(hashes, dtype=np.uint64), index, seen)
+        write(f, new)
+        total, written = total + len(lines), written + len(new)
+        if as_array:
+            f.write('\n]\n')
+    os.replace(tmp_file, output_file)
+    return total, written
+
+
+def duplicate_report(index: UrlIndex, sources_hashes: List[np.ndarray]) -> None:
+    """Логирует дубликаты внутри каждого источника и число общих URL для каждой пары источников."""
+    for source, hashes in zip(index.sources, sources_hashes):
+        logging.info(f"{source}: {len(hashes)} URL, дубликатов внутри источника: {len(hashes) - len(np.unique(hashes))}")
+
+    # В индексе одна запись на пару (хеш, источник): хеш, встречающийся больше одного раза, общий для источников
+    hashes, source_ids = np.asarray(index.hashes), np.asarray(index.source_ids)
+    shared = np.zeros(len(hashes), dtype=bool)
+    shared[1:] = hashes[1:] == hashes[:-1]
+    shared[:-1] |= shared[1:]
+    logging.info(f"URL, встречающихся в нескольких источниках: {len(np.unique(hashes[shared]))}")
+
+    n = len(index.sources)
+    pairs = np.zeros((n, n), dtype=np.int64)
+    for i in range(n):
+        in_i = np.isin(hashes, hashes[source_ids == i])
+        pairs[i] = np.bincount(source_ids[in_i], minlength=n)
+    for i in range(n):
+        for j in range(i + 1, n):
+            if pairs[i, j]:
+                logging.info(f"  {index.sources[i]} & {index.sources[j]}: {pairs[i, j]} общих URL")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', help='для относительных id, например https://www.belta.by/')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    diff_parser = subparsers.add_parser('diff', help='ссылки, которых еще нет среди собранных статей')
+    diff_parser.add_argument('--links', default='data/reuters_links.jsonl')
+    diff_parser.add_argument('--against', nargs='*', default=['data/reuters_articles.json'])
+    diff_parser.add_argument('--index', help='каталог индекса вместо --against')
+    diff_parser.add_argument('--output', help='по умолчанию перезаписывается --links; формат (JSON или JSONL) - по расширению файла')
+
+    index_parser = subparsers.add_parser('index', help='построить или дополнить индекс URL')
+    index_parser.add_argument('path')
+    index_parser.add_argument('sources', nargs='+')
+    index_parser.add_argument('--append', action='store_true', help='добавить источники к существующему индексу')
+
+    dups_parser = subparsers.add_parser('dups', help='дубликаты внутри и между источниками')
+    dups_parser.add_argument('sources', nargs='+')
 
-# Пути к файлам (замените на ваши реальные пути)
-articles_file = 'data/reuters_links.jsonl' 
-parsed_articles_file = 'data/reuters_articles.json'
-output_file = 'data/reuters_links.jsonl'
+    args = parser.parse_args()
+    start = time.perf_counter()
 
-articles_df = pd.read_json(articles_file, lines=True)
-parsed_df = pd.read_json(parsed_articles_file)
+    if args.command == 'diff':
+        index = UrlIndex.load(args.index) if args.index else UrlIndex.build(args.against, args.base_url)
+        output_file = args.output or args.links
+        total, written = diff_links(args.links, index, output_file, args.base_url)
+        logging.info(f"Очищенные данные сохранены в файле: {output_file} ({written} из {total} ссылок)")
+    elif args.command == 'index':
+        if args.append:
+            index = UrlIndex.load(args.path)
+            for source in args.sources:
+                index = index.add(source, args.base_url)
+        else:
+            index = UrlIndex.build(args.sources, args.base_url)
+        index.save(args.path)
+        logging.info(f"Индекс {args.path}: {len(index.hashes)} URL из {len(index.sources)} источников")
+    else:
+        sources_hashes = [hash_source(source, args.base_url) for source in args.sources]
+        source_ids = [np.full(len(h), i, dtype=np.uint16) for i, h in enumerate(sources_hashes)]
+        index = UrlIndex.from_arrays(np.concatenate(sources_hashes), np.concatenate(source_ids), args.sources)
+        duplicate_report(index, sources_hashes)
 
-articles_df = articles_df.drop_duplicates(subset='url', keep='first')
-parsed_urls = set(parsed_df['article_id'])
-articles_df = articles_df[~articles_df['url'].isin(parsed_urls)]
+    logging.info(f"Готово за {time.perf_counter() - start:.2f}s")
 
-with open(output_file, 'w', encoding='utf-8') as f:
-    for record in articles_df.to_dict(orient='records'):
-        json_line = json.dumps(record, ensure_ascii=False)
-        json_line = json_line.replace('\\/', '/')
-        f.write(json_line + "\n")
 
-print(f"Очищенные данные сохранены в файле: {output_file}")
+if __name__ == '__main__':
+    setup_logger(logging.INFO, stdout_log=True, file_log=False)
+    main()
@@ -0,0 +1,425 @@
+"""
+Asynchronous fetch engine shared by the news scrapers.
+
+The engine owns everything network related: one pooled aiohttp session, per-host concurrency
+limits, token-bucket pacing (optionally adaptive, see AimdPolicy) and retry/backoff. A site module only describes the site by
+subclassing Site: `discover` yields article URLs, `extract` turns a fetched page into a record.
+`extract` may run in a worker process, so it should depend only on its arguments.
+
+Given a ResponseArchive, the engine stores every response it receives. With replay=True it serves
+requests from the archive only, so extraction can be re-run offline at disk speed.
+Given a CrawlState, it remembers ETag/Last-Modified of the pages and can revalidate them.
+
+Example:
+    >> total = crawl_site(HabrSite(), writer, per_host_rate=1.3)
+"""
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import aiohttp
+
+from src.parser.crawl_state import CrawlState
+from src.parser.jsonl_writer import JsonlArticleWriter
+from src.parser.response_archive import ResponseArchive
+
+
+@dataclass
+class RetryPolicy:
+    max_retries: int = 3
+    backoff_factor: float = 1.5
+    max_backoff: float = 60.0
+    retry_statuses: Tuple[int, ...] = (403, 429, 500, 502, 503, 504)
+
+    def backoff(self, attempt: int) -> float:
+        return min(self.max_backoff, self.backoff_factor * 2 ** attempt) + random.uniform(0, 1)
+
+
+class TokenBucket:
+    """Lets through `rate` requests per second on average, with bursts of up to `burst` requests."""
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def set_rate(self, rate: float) -> None:
+        # Tokens earned so far are credited at the old rate
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.rate = rate
+
+
+@dataclass
+class AimdPolicy:
+    """
+    Additive-increase/multiplicative-decrease pacing of one host.
+
+    Every second of fast successful responses adds `increase` req/sec to the rate, up to max_rate.
+    A throttling status, a network error or a response slower than `latency_factor` times the usual
+    latency multiplies the rate by `decrease` (at most once per `cooldown` seconds), down to min_rate.
+    """
+    min_rate: float = 0.2
+    max_rate: float = 10.0
+    increase: float = 0.5
+    decrease: float = 0.5
+    latency_factor: float = 3.0
+    cooldown: float = 2.0
+    throttle_statuses: Tuple[int, ...] = (403, 429, 503)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header, which holds either seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HostLimiter:
+    """Concurrency cap, pacing and health metrics of one host."""
+    def __init__(self, concurrency: int, rate: float, burst: int, adaptive: Optional[AimdPolicy] = None):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(rate, burst)
+        self.adaptive = adaptive
+        self.in_flight = 0
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.blocked_until = 0.0
+        self._last_decrease = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self.bucket.rate
+
+    async def acquire(self) -> None:
+        # Retry-After pauses the whole host, not only the request that received it
+        while (delay := self.blocked_until - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+        await self.bucket.acquire()
+        self.in_flight += 1
+
+    def release(self, status: Optional[int], elapsed: float, retry_after: Optional[float] = None) -> None:
+        """Feeds the outcome of a request (status None for a network error) back into the pacing."""
+        self.in_flight -= 1
+        throttled = status is None or (self.adaptive is not None and status in self.adaptive.throttle_statuses)
+        self.error_rate += 0.05 * (float(throttled or status >= 500) - self.error_rate)
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+        if self.adaptive is None:
+            return
+
+        spike = self.latency is not None and elapsed > self.adaptive.latency_factor * self.latency
+        if status is not None and not throttled:
+            self.latency = elapsed if self.latency is None else self.latency + 0.1 * (elapsed - self.latency)
+
+        if throttled or spike:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.adaptive.cooldown:
+                self._last_decrease = now
+                self.bucket.set_rate(max(self.adaptive.min_rate, self.rate * self.adaptive.decrease))
+        else:
+            # +increase req/sec per second of successes: each of the `rate` responses adds increase / rate
+            self.bucket.set_rate(min(self.adaptive.max_rate, self.rate + self.adaptive.increase / self.rate))
+
+    def metrics(self) -> Dict[str, float]:
+        return {'rate': round(self.rate, 2), 'in_flight': self.in_flight, 'error_rate': round(self.error_rate, 3),
+                'latency': round(self.latency or 0.0, 3)}
+
+
+@dataclass
+class FetchResult:
+    url: str
+    status: int
+    body: bytes
+    headers: Dict[str, str]
+    elapsed: float
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+
+@dataclass
+class CrawlStats:
+    requests: int = 0
+    pages: int = 0
+    bytes: int = 0
+    retries: int = 0
+    failures: int = 0
+    not_modified: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    def pages_per_sec(self) -> float:
+        return self.pages / max(time.monotonic() - self.started, 1e-9)
+
+
+class CrawlEngine:
+    def __init__(self, headers: Optional[Dict[str, str]] = None, per_host_concurrency: int = 4,
+                 per_host_rate: float = 2.0, burst: int = 2, retry: Optional[RetryPolicy] = None,
+                 timeout: float = 30.0, max_connections: int = 100,
+                 archive: Optional[ResponseArchive] = None, replay: bool = False,
+                 state: Optional[CrawlState] = None, adaptive: Optional[AimdPolicy] = None):
+        """
+        per_host_rate is the fixed request rate of every host, or the starting one when an `adaptive`
+        AimdPolicy lets the engine find the fastest rate the host tolerates.
+        """
+        if replay and archive is None:
+            raise ValueError("replay needs an archive")
+        self.headers = headers or {}
+        self.per_host_concurrency = per_host_concurrency
+        self.per_host_rate = per_host_rate
+        self.burst = burst
+        self.retry = retry or RetryPolicy()
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.archive = archive
+        self.replay = replay
+        self.state = state
+        self.adaptive = adaptive
+        self.stats = CrawlStats()
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._hosts: Dict[str, HostLimiter] = {}
+
+    async def __aenter__(self):
+        self.stats = CrawlStats()
+        if self.replay:
+            return self
+        connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.per_host_concurrency,
+                                         ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(connector=connector, headers=self.headers,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self.session is not None:
+            await self.session.close()
+        if self.archive is not None:
+            self.archive.flush()
+
+    def _limiter(self, url: str) -> HostLimiter:
+        host = urlparse(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = HostLimiter(self.per_host_concurrency, self.per_host_rate, self.burst, self.adaptive)
+        return self._hosts[host]
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        """Current rate, in-flight requests, error rate and latency of every host."""
+        return {host: limiter.metrics() for host, limiter in self._hosts.items()}
+
+    async def fetch(self, url: str, headers: Optional[Dict[str, str]] = None,
+                    revalidate: bool = False) -> Optional[FetchResult]:
+        """
+        GETs url within the host's limits. Retries network errors and `retry.retry_statuses` with backoff.
+        Returns the final response (also for non-retryable error statuses) or None if every attempt failed.
+        With revalidate=True the request is conditional and an unchanged page comes back as a 304.
+        """
+        if self.replay:
+            return self._replay(url)
+        if revalidate and self.state is not None:
+            headers = {**self.state.conditional_headers(url), **(headers or {})}
+
+        limiter = self._limiter(url)
+        for attempt in range(self.retry.max_retries + 1):
+            async with limiter.semaphore:
+                await limiter.acquire()
+                start = time.monotonic()
+                self.stats.requests += 1
+                result, retry_after = None, None
+                try:
+                    async with self.session.get(url, headers=headers) as response:
+                        body = await response.read()
+                        result = FetchResult(url, response.status, body, dict(response.headers),
+                                             time.monotonic() - start)
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logging.warning(f"Network error for {url} (attempt {attempt + 1}): {e!r}")
+                finally:
+                    limiter.release(result.status if result is not None else None, time.monotonic() - start,
+                                    retry_after)
+
+            if result is not None and result.status == 304:
+                self.stats.not_modified += 1
+                return result
+            if result is not None and result.status not in self.retry.retry_statuses:
+                self.stats.pages += 1
+                self.stats.bytes += len(result.body)
+                if self.archive is not None:
+                    self.archive.put(url, result.status, result.headers, result.body)
+                if self.state is not None and result.ok:
+                    self.state.update_validators(url, result.headers)
+                return result
+
+            if attempt < self.retry.max_retries:
+                # The host pauses itself for Retry-After, the backoff only spreads out the retries
+                delay = self.retry.backoff(attempt)
+                if result is not None:
+                    logging.warning(f"Status {result.status} for {url}, retrying in {delay:.1f}s")
+                self.stats.retries += 1
+                await asyncio.sleep(delay)
+
+        self.stats.failures += 1
+        logging.error(f"Giving up on {url} after {self.retry.max_retries + 1} attempts")
+        return result
+
+    def _replay(self, url: str) -> Optional[FetchResult]:
+        self.stats.requests += 1
+        record = self.archive.get(url)
+        if record is None:
+            self.stats.failures += 1
+            logging.warning(f"Not in the archive: {url}")
+            return None
+        self.stats.pages += 1
+        self.stats.bytes += len(record['body'])
+        return FetchResult(url, record['status'], record['body'], record['headers'], 0.0)
+
+
+class Site:
+    """Site-specific part of a crawl: where the articles are and how to read them."""
+    name = 'site'
+    headers: Dict[str, str] = {}
+
+    async def prepare(self, engine: CrawlEngine) -> None:
+        """Hook for warm-up requests (cookies etc.) before discovery starts."""
+
+    def request_headers(self, url: str, meta: Dict) -> Optional[Dict[str, str]]:
+        """Extra headers for an article request, e.g. a Referer."""
+        return None
+
+    def discover(self, engine: CrawlEngine, writer: Optional[JsonlArticleWriter]) -> AsyncIterator[Tuple[str, Dict]]:
+        """Yields (article url, meta) pairs that still have to be fetched."""
+        raise NotImplementedError
+
+    def extract(self, url: str, html: bytes, meta: Dict) -> Optional[Dict]:
+        """Turns an article page into a record with article_id/title/category/tags/text."""
+        raise NotImplementedError
+
+
+_extract_site: Optional[Site] = None
+
+
+def _init_extractor(site: Site) -> None:
+    global _extract_site
+    _extract_site = site
+
+
+def _extract_in_worker(url: str, html: bytes, meta: Dict) -> Optional[Dict]:
+    return _extract_site.extract(url, html, meta)
+
+
+async def _report_metrics(engine: CrawlEngine, every: float) -> None:
+    while True:
+        await asyncio.sleep(every)
+        logging.info(f"{engine.stats.pages_per_sec():.2f} pages/sec, hosts: {engine.metrics()}")
+
+
+async def crawl(site: Site, engine: CrawlEngine, writer: Optional[JsonlArticleWriter] = None,
+                workers: int = 10, extract_workers: int = 0, report_every: float = 60.0) -> int:
+    """
+    Fetches and extracts every discovered article. Returns the number saved.
+
+    `workers` tasks download pages. With extract_workers > 0 they only put the raw HTML on a bounded
+    queue and a pool of extract_workers processes parses it, so parsing does not compete with the event loop
+    for the GIL. A full queue blocks the fetchers until the extractors catch up.
+    """
+    url_queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+    html_queue: asyncio.Queue = asyncio.Queue(maxsize=max(extract_workers, 1) * 2)
+    pool = ProcessPoolExecutor(extract_workers, initializer=_init_extractor,
+                               initargs=(site,)) if extract_workers else None
+    loop = asyncio.get_running_loop()
+    saved = 0
+
+    def save(record: Optional[Dict]) -> None:
+        nonlocal saved
+        if record and (writer is None or writer.write(record)):
+            saved += 1
+            logging.info(f"[{site.name}] {record.get('category')}: {str(record.get('title'))[:50]}...")
+
+    async def fetcher():
+        while True:
+            item = await url_queue.get()
+            try:
+                if item is None:
+                    return
+                url, meta = item
+                result = await engine.fetch(url, headers=site.request_headers(url, meta))
+                if result is None or not result.ok:
+                    continue
+                if pool is not None:
+                    await html_queue.put((url, result.body, meta))
+                else:
+                    save(site.extract(url, result.body, meta))
+            except Exception as e:
+                logging.error(f"[{site.name}] Error while processing {item[0]}: {e}", exc_info=True)
+            finally:
+                url_queue.task_done()
+
+    async def extractor():
+        while True:
+            item = await html_queue.get()
+            try:
+                if item is None:
+                    return
+                save(await loop.run_in_executor(pool, _extract_in_worker, *item))
+            except Exception as e:
+                logging.error(f"[{site.name}] Error while extracting {item[0]}: {e}", exc_info=True)
+            finally:
+                html_queue.task_done()
+
+    fetchers = [asyncio.create_task(fetcher()) for _ in range(workers)]
+    extractors = [asyncio.create_task(extractor()) for _ in range(extract_workers)]
+    reporter = asyncio.create_task(_report_metrics(engine, report_every))
+    try:
+        await site.prepare(engine)
+        async for url, meta in site.discover(engine, writer):
+            await url_queue.put((url, meta))
+    finally:
+        for _ in fetchers:
+            await url_queue.put(None)
+        await asyncio.gather(*fetchers)
+        for _ in extractors:
+            await html_queue.put(None)
+        await asyncio.gather(*extractors)
+        if pool is not None:
+            pool.shutdown()
+        reporter.cancel()
+
+    logging.info(f"[{site.name}] saved {saved} articles, {engine.stats.requests} requests "
+                 f"({engine.stats.not_modified} not modified), {engine.stats.pages_per_sec():.2f} pages/sec")
+    if engine.metrics():
+        logging.info(f"[{site.name}] hosts: {engine.metrics()}")
+    return saved
+
+
+def crawl_site(site: Site, writer: Optional[JsonlArticleWriter] = None, workers: int = 10,
+               extract_workers: int = 0, **engine_kwargs) -> int:
+    """Synchronous entry point for the scrapers' main()."""
+    async def _run():
+        async with CrawlEngine(headers=site.headers, **engine_kwargs) as engine:
+            return await crawl(site, engine, writer, workers=workers, extract_workers=extract_workers)
+    return asyncio.run(_run())
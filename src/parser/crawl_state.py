@@ -0,0 +1,133 @@
+"""
+Persistent crawl state for incremental recrawls.
+
+Two things survive between runs in one SQLite file:
+  * HTTP validators (ETag / Last-Modified) of fetched pages, so listing pages can be
+    requested conditionally and answered with a cheap 304;
+  * the frontier of every listing (a hub, a category, an API section): the newest item seen
+    by the last complete pass over it.
+
+Listings are newest-first, so once a pass reaches the previous frontier the rest of the
+listing is already known and paging can stop.
+"""
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+
+class CrawlState:
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        os.makedirs(self.path.parent, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS validators '
+            '(url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, checked REAL NOT NULL)'
+        )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS frontiers '
+            '(site TEXT NOT NULL, listing TEXT NOT NULL, last_seen TEXT, complete INTEGER NOT NULL, '
+            'updated REAL NOT NULL, PRIMARY KEY (site, listing))'
+        )
+        self.conn.commit()
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        row = self.conn.execute('SELECT etag, last_modified FROM validators WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return {}
+        etag, last_modified = row
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def update_validators(self, url: str, headers: Dict[str, str]) -> None:
+        headers = {key.lower(): value for key, value in headers.items()}
+        etag, last_modified = headers.get('etag'), headers.get('last-modified')
+        if not etag and not last_modified:
+            return
+        self.conn.execute('INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?)',
+                          (url, etag, last_modified, time.time()))
+        self.conn.commit()
+
+    def frontier(self, site: str, listing: str) -> Tuple[Optional[str], bool]:
+        """(newest item id of the last pass, whether that pass went through the whole listing)."""
+        row = self.conn.execute('SELECT last_seen, complete FROM frontiers WHERE site = ? AND listing = ?',
+                                (site, listing)).fetchone()
+        return (row[0], bool(row[1])) if row else (None, False)
+
+    def set_frontier(self, site: str, listing: str, last_seen: Optional[str], complete: bool) -> None:
+        self.conn.execute('INSERT OR REPLACE INTO frontiers VALUES (?, ?, ?, ?, ?)',
+                          (site, listing, last_seen, int(complete), time.time()))
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ListingWalk:
+    """
+    One pass over a newest-first listing.
+
+    The first pass (or one after an interrupted pass) walks the listing in full. Once a pass has
+    finished, the next ones are incremental: they revalidate pages with conditional requests and
+    stop at the page holding the previous frontier, or at a page made only of known items.
+    Call finish() when paging ends normally; an interrupted pass leaves the old frontier in place.
+    A pass that stopped early (an article cap, a page limit, a failed page) is not complete either:
+    the items below the point it reached are still unknown.
+    """
+    def __init__(self, state: Optional[CrawlState], site: str, listing: str,
+                 known: Callable[[str], bool] = lambda item_id: False):
+        self.state = state
+        self.site = site
+        self.listing = listing
+        self.known = known
+        self.last_seen, complete = state.frontier(site, listing) if state is not None else (None, False)
+        self.incremental = complete
+        self.head: Optional[str] = None
+        self.done = False
+
+    def page(self, ids: List[str]) -> List[str]:
+        """Returns the ids of a listing page that are newer than the frontier; sets `done` once it is reached."""
+        if self.head is None and ids:
+            self.head = ids[0]
+        if not self.incremental:
+            return ids
+        if self.last_seen in ids:
+            self.done = True
+            return ids[:ids.index(self.last_seen)]
+        if ids and all(self.known(item_id) for item_id in ids):
+            self.done = True
+        return ids
+
+    def not_modified(self) -> None:
+        """The page answered 304: nothing new since the last pass."""
+        self.done = True
+
+    def finish(self, exhausted: bool, capped: bool = False) -> None:
+        """
+        Records the pass. exhausted: the listing ran out of pages; capped: the caller stopped taking items
+        before the end of the last page. Only an uncapped pass that ran out or reached the previous frontier
+        moves the frontier to its head; any other one makes the next pass a full one.
+        """
+        if self.state is None:
+            return
+        if capped or not (exhausted or self.done):
+            self.state.set_frontier(self.site, self.listing, self.last_seen, False)
+            logging.info(f"[{self.site}] {self.listing}: pass stopped before the end of the listing, "
+                         f"the next one walks it in full")
+            return
+        self.state.set_frontier(self.site, self.listing, self.head or self.last_seen, True)
+        if self.incremental:
+            logging.info(f"[{self.site}] {self.listing}: incremental pass, new frontier {self.head or self.last_seen}")
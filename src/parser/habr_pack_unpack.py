@@ -1,43 +1,196 @@
-import os
+"""
+Потоковое разбиение больших дампов статей на части и обратная склейка.
+
+split_json режет дамп на части не больше max_size_mb. Каждая часть - JSON-массив, по одной
+записи на строку. Рядом пишутся:
+  * <prefix>_manifest.json - по каждой части: файл, число записей, размер, sha256, категории;
+  * <prefix>_index.sqlite - article_id -> часть, смещение и длина записи в байтах,
+    так что get_record читает одну статью, не загружая части целиком.
+merge_json потоково склеивает части обратно, проверяя контрольные суммы.
+Память не зависит от размера дампа: в ней только текущая запись.
+
+Usage:
+    python -m src.parser.habr_pack_unpack split data/habr_articles.json data/habr_articles
+    python -m src.parser.habr_pack_unpack merge data/habr_articles data/habr_articles.json
+    python -m src.parser.habr_pack_unpack get data/habr_articles https://habr.com/ru/articles/123456/
+"""
+import argparse
+import hashlib
 import json
-import glob
-import pandas as pd
-import numpy as np
+import logging
+import os
+import re
+import sqlite3
+import textwrap
+from collections import Counter
+from contextlib import closing
+from glob import glob
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from src.json_stream import iter_json_records
+from src.logger import setup_logger
+
+_INDEX_BATCH = 1000
+
+
+def _manifest_path(prefix) -> Path:
+    return Path(f"{prefix}_manifest.json")
+
+
+def _index_path(prefix) -> Path:
+    return Path(f"{prefix}_index.sqlite")
+
 
+def _file_sha256(path, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
 
-def split_json(input_file, output_prefix, max_size_mb=30):
+
+class _ShardWriter:
+    """Одна часть: JSON-массив с записью на строку, считает смещения и sha256 по ходу записи."""
+    def __init__(self, path: Path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.records = 0
+        self.categories = Counter()
+        self._write(b'[\n')
+
+    def _write(self, data: bytes) -> None:
+        self.file.write(data)
+        self.digest.update(data)
+        self.size += len(data)
+
+    def add(self, line: bytes, category) -> int:
+        """Дописывает запись и возвращает ее смещение в файле."""
+        if self.records:
+            self._write(b',\n')
+        offset = self.size
+        self._write(line)
+        self.records += 1
+        self.categories[str(category)] += 1
+        return offset
+
+    def close(self) -> Dict:
+        self._write(b'\n]\n')
+        self.file.close()
+        return {'file': self.path.name, 'records': self.records, 'bytes': self.size,
+                'sha256': self.digest.hexdigest(), 'categories': dict(self.categories)}
+
+
+def split_json(input_file, output_prefix, max_size_mb=30, id_field='article_id'):
     max_size = max_size_mb * 1024 * 1024
-    df = pd.read_json(input_file)
-    
-    part = 1
-    current_size = 0
-    current_data = []
-    
-    for index, row in df.iterrows():
-        item = row.to_dict()
-        item_size = len(json.dumps(item, ensure_ascii=False).encode('utf-8'))
-        
-        if current_size + item_size > max_size:
-            pd.DataFrame(current_data).to_json(f"{output_prefix}_part{part}.json", orient='records', force_ascii=False, indent=2)
-            part += 1
-            current_data = []
-            current_size = 0
-        
-        current_data.append(item)
-        current_size += item_size
-    
-    if current_data:
-        pd.DataFrame(current_data).to_json(f"{output_prefix}_part{part}.json", orient='records', force_ascii=False, indent=2)
-    
-    print(f"Разделение завершено, создано {part} файлов.")
-
-
-def merge_json(output_file, input_pattern):
-    input_files = sorted(glob.glob(input_pattern))
-    merged_df = pd.concat([pd.read_json(file) for file in input_files], ignore_index=True)
-    merged_df.to_json(output_file, orient='records', force_ascii=False, indent=2)
-    
-    print(f"Объединение завершено, записан файл {output_file}.")
+    output_prefix = Path(output_prefix)
+    index_path = _index_path(output_prefix)
+    old_manifest = read_manifest(output_prefix) if _manifest_path(output_prefix).exists() else None
+
+    index_tmp = index_path.with_name(index_path.name + '.tmp')
+    if index_tmp.exists():
+        index_tmp.unlink()
+    index = sqlite3.connect(index_tmp)
+    index.execute('CREATE TABLE records (article_id TEXT PRIMARY KEY, shard INTEGER NOT NULL, '
+                  '"offset" INTEGER NOT NULL, length INTEGER NOT NULL, category TEXT)')
+
+    shards: List[Dict] = []
+    shard, rows = None, []
+    for record in iter_json_records(input_file):
+        line = json.dumps(record, ensure_ascii=False).encode('utf-8')
+        # Часть закрывается, если запись в нее уже не влезает (но пустой часть не бывает)
+        if shard is not None and shard.records and shard.size + len(line) + 4 > max_size:
+            shards.append(shard.close())
+            shard = None
+        if shard is None:
+            shard = _ShardWriter(output_prefix.with_name(f"{output_prefix.name}_part{len(shards) + 1}.json"))
+
+        offset = shard.add(line, record.get('category'))
+        rows.append((str(record.get(id_field)), len(shards), offset, len(line), record.get('category')))
+        if len(rows) >= _INDEX_BATCH:
+            index.executemany('INSERT OR IGNORE INTO records VALUES (?, ?, ?, ?, ?)', rows)
+            rows = []
+    if shard is not None:
+        shards.append(shard.close())
+    index.executemany('INSERT OR IGNORE INTO records VALUES (?, ?, ?, ?, ?)', rows)
+    index.commit()
+    index.close()
+    os.replace(index_tmp, index_path)
+
+    manifest = {'source': Path(input_file).name, 'id_field': id_field, 'max_size_mb': max_size_mb,
+                'records': sum(s['records'] for s in shards), 'shards': shards}
+    manifest_tmp = _manifest_path(output_prefix).with_name(_manifest_path(output_prefix).name + '.tmp')
+    with open(manifest_tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(manifest_tmp, _manifest_path(output_prefix))
+
+    # Части прошлого разбиения, которых больше нет в манифесте
+    if old_manifest is not None:
+        current = {s['file'] for s in shards}
+        for old in old_manifest['shards']:
+            if old['file'] not in current:
+                output_prefix.with_name(old['file']).unlink(missing_ok=True)
+
+    logging.info(f"Разделение завершено, создано {len(shards)} файлов, {manifest['records']} записей.")
+    return manifest
+
+
+def read_manifest(prefix) -> Dict:
+    with open(_manifest_path(prefix), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def iter_shard_files(prefix, verify: bool = True) -> Iterator[Path]:
+    """Части по порядку. Без манифеста (старые разбиения) - все <prefix>_partN.json по номеру N."""
+    prefix = Path(prefix)
+    if not _manifest_path(prefix).exists():
+        files = glob(f"{prefix}_part*.json")
+        yield from (Path(file) for file in sorted(files, key=lambda f: int(re.search(r'_part(\d+)\.json$', f)[1])))
+        return
+
+    for shard in read_manifest(prefix)['shards']:
+        path = prefix.with_name(shard['file'])
+        if verify and _file_sha256(path) != shard['sha256']:
+            raise ValueError(f"{path}: контрольная сумма не совпадает с манифестом")
+        yield path
+
+
+def merge_json(output_file, input_prefix, verify: bool = True):
+    output_file = Path(output_file)
+    tmp_file = output_file.with_name(output_file.name + '.tmp')
+    total = 0
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write('[')
+            for path in iter_shard_files(input_prefix, verify=verify):
+                for record in iter_json_records(path):
+                    f.write(',\n' if total else '\n')
+                    f.write(textwrap.indent(json.dumps(record, ensure_ascii=False, indent=2), ' ' * 2))
+                    total += 1
+            f.write('\n]\n')
+    except BaseException:
+        tmp_file.unlink(missing_ok=True)
+        raise
+    os.replace(tmp_file, output_file)
+
+    logging.info(f"Объединение завершено, записан файл {output_file} ({total} записей).")
+    return total
+
+
+def get_record(prefix, article_id: str) -> Optional[Dict]:
+    """Читает одну статью по article_id: поиск в индексе и одно чтение из нужной части."""
+    prefix = Path(prefix)
+    with closing(sqlite3.connect(_index_path(prefix))) as index:
+        row = index.execute('SELECT shard, "offset", length FROM records WHERE article_id = ?',
+                            (article_id,)).fetchone()
+    if row is None:
+        return None
+    shard, offset, length = row
+    with open(prefix.with_name(read_manifest(prefix)['shards'][shard]['file']), 'rb') as f:
+        f.seek(offset)
+        return json.loads(f.read(length))
 
 
 def habr_split():
@@ -47,4 +200,37 @@ def habr_split():
 
 def habr_merge():
     merge_json(os.path.join("data", "habr_articles.json"),
-               os.path.join("data", "habr_articles_part*.json"))
\ No newline at end of file
+               os.path.join("data", "habr_articles"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    split_parser = subparsers.add_parser('split')
+    split_parser.add_argument('input_file')
+    split_parser.add_argument('prefix')
+    split_parser.add_argument('--max-size-mb', type=int, default=30)
+
+    merge_parser = subparsers.add_parser('merge')
+    merge_parser.add_argument('prefix')
+    merge_parser.add_argument('output_file')
+    merge_parser.add_argument('--no-verify', action='store_true', help='не проверять sha256 частей')
+
+    get_parser = subparsers.add_parser('get')
+    get_parser.add_argument('prefix')
+    get_parser.add_argument('article_id')
+
+    args = parser.parse_args()
+    if args.command == 'split':
+        split_json(args.input_file, args.prefix, args.max_size_mb)
+    elif args.command == 'merge':
+        merge_json(args.output_file, args.prefix, verify=not args.no_verify)
+    else:
+        record = get_record(args.prefix, args.article_id)
+        print(json.dumps(record, ensure_ascii=False, indent=2) if record is not None else 'not found')
+
+
+if __name__ == '__main__':
+    setup_logger(logging.INFO, stdout_log=True, file_log=False)
+    main()
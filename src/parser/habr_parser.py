@@ -1,13 +1,14 @@
+import argparse
 import os
-import requests
-import random
 import logging
-import time
-import json
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from src.parser.crawl_engine import AimdPolicy, Site, crawl_site
+from src.parser.crawl_state import CrawlState, ListingWalk
+from src.parser.jsonl_writer import JsonlArticleWriter, compact
+from src.parser.response_archive import ResponseArchive, replay_path, reset_replay_log
 
 logging.basicConfig(
     level=logging.INFO,
@@ -34,32 +35,13 @@ CATEGORY_MAP = {
     "Разное": ["asterisk", "health", "interviews", "read"]
 }
 
-REQUEST_DELAY = 0.77
+REQUEST_DELAY = 0.77  # стартовая пауза, дальше темп подбирается по ответам сайта
+MAX_RATE = 10.0  # запросов в секунду, не больше
+EXTRACT_WORKERS = 4  # процессы для разбора HTML
 ARTICLES_PER_HUB = 300
 MAX_PAGES_PER_HUB = 1000
 TARGET_ARTICLES_PER_CATEGORY = 1000
-
-
-def safe_request(session, url, retries=3, backoff_factor=1.5):
-    """
-    Безопасный запрос с повторными попытками.
-    """
-    for attempt in range(retries):
-        try:
-            response = session.get(url, timeout=15)
-            if response.status_code in [403, 429]:
-                logging.warning(f"Блокировка: {response.status_code} для {url}")
-                time.sleep(10 * (attempt + 1))
-                continue
-            response.raise_for_status()
-            return response
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Ошибка (попытка {attempt + 1}) для {url}: {e}")
-            if attempt == retries - 1:
-                return None
-            sleep_time = backoff_factor * (2 ** attempt) + random.uniform(0, 1)
-            time.sleep(sleep_time)
-    return None
+BASE_URL = "https://habr.com/ru/"
 
 
 def categorize_hub(hub_url):
@@ -71,26 +53,24 @@ def categorize_hub(hub_url):
     return "Разное"
 
 
-def get_hub_urls(session):
-    base_url = "https://habr.com/ru/"
-    response = safe_request(session, base_url)
-    if not response:
-        return {}
-
+def extract_hub_urls(html):
+    """
+    Извлекает ссылки на хабы с главной страницы и группирует их по категориям.
+    """
     # Используем lxml для более быстрого парсинга
-    soup = BeautifulSoup(response.content, 'lxml')
+    soup = BeautifulSoup(html, 'lxml')
     hubs = set()
 
     # Сбор основных хабов
     for link in soup.select('a[href*="/hubs/"]:not([href*="/all/"])'):
         href = link.get('href', '')
-        full_url = urljoin(base_url, href.split('/posts')[0])
+        full_url = urljoin(BASE_URL, href.split('/posts')[0])
         hubs.add(full_url.lower().rstrip('/') + '/')
 
     # Сбор популярных хабов
     for link in soup.select('a.tm-hubs-list__hub-link[href*="/hubs/"]'):
         href = link.get('href', '')
-        full_url = urljoin(base_url, href.split('/posts')[0])
+        full_url = urljoin(BASE_URL, href.split('/posts')[0])
         hubs.add(full_url.lower().rstrip('/') + '/')
 
     categorized = defaultdict(list)
@@ -102,52 +82,24 @@ def get_hub_urls(session):
     return dict(categorized)
 
 
-def get_articles_from_hub(hub_url, max_articles, session):
+def extract_article_links(html):
     """
-    Получает URL статей из конкретного хаба.
+    Извлекает URL статей со страницы списка статей хаба.
     """
-    articles = []
-    page = 1
-
-    while len(articles) < max_articles and page <= MAX_PAGES_PER_HUB:
-        if page == 1:
-            page_url = urljoin(hub_url, 'articles/')
-        else:
-            page_url = urljoin(hub_url, f'articles/page{page}/')
-
-        response = safe_request(session, page_url)
-        if not response or response.status_code != 200:
-            break
-
-        soup = BeautifulSoup(response.content, 'lxml')
-        new_links = []
-
-        for article in soup.select('article.tm-articles-list__item:not(.tm-articles-list__item_sponsored)'):
-            link_tag = article.select_one('a.tm-title__link')
-            if link_tag:
-                full_url = urljoin('https://habr.com', link_tag.get('href', '').split('?')[0])
-                new_links.append(full_url)
+    soup = BeautifulSoup(html, 'lxml')
+    links = []
+    for article in soup.select('article.tm-articles-list__item:not(.tm-articles-list__item_sponsored)'):
+        link_tag = article.select_one('a.tm-title__link')
+        if link_tag:
+            links.append(urljoin('https://habr.com', link_tag.get('href', '').split('?')[0]))
+    return links
 
-        if not new_links:
-            break
 
-        articles.extend(new_links)
-        logging.info(f"Хаб: {hub_url.split('/')[-2]} | Страница {page}: +{len(new_links)} статей")
-        page += 1
-        time.sleep(REQUEST_DELAY + random.uniform(0, 0.3))
-
-    return articles[:max_articles]
-
-
-def parse_article(url, category, session):
+def extract_article(html, url, category):
     """
-    Получает содержимое статьи и возвращает словарь с данными.
+    Разбирает HTML статьи и возвращает словарь с данными.
     """
-    response = safe_request(session, url)
-    if not response:
-        return None
-
-    soup = BeautifulSoup(response.content, 'lxml')
+    soup = BeautifulSoup(html, 'lxml')
     title_tag = soup.find('h1', class_='tm-title')
     title = title_tag.get_text(strip=True) if title_tag else 'Без названия'
     tags = [tag.get_text(strip=True) for tag in soup.select('a.tm-tags-list__link')]
@@ -163,95 +115,136 @@ def parse_article(url, category, session):
     }
 
 
-def main():
-    output_file = os.path.join('data', 'habr_articles.json')
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
-
-    # Загрузка существующих данных
-    try:
-        with open(output_file, 'r', encoding='utf-8') as f:
-            existing_data = json.load(f)
-            processed_urls = {item['article_id'] for item in existing_data}
-            category_counts = defaultdict(int)
-            for item in existing_data:
-                category_counts[item['category']] += 1
-        logging.info(f"Загружено существующих статей: {len(existing_data)}")
-    except (FileNotFoundError, json.JSONDecodeError):
-        existing_data = []
-        processed_urls = set()
-        category_counts = defaultdict(int)
-
-    with requests.Session() as session:
-        session.headers.update(HEADERS)
-
-        # Получение хабов
-        categorized_hubs = get_hub_urls(session)
+class HabrSite(Site):
+    name = 'habr'
+    headers = HEADERS
+
+    async def get_hub_urls(self, engine):
+        response = await engine.fetch(BASE_URL)
+        if not response or not response.ok:
+            return {}
+        return extract_hub_urls(response.body)
+
+    async def get_articles_from_hub(self, engine, hub_url, max_articles, known=lambda url: False):
+        """
+        Получает URL статей из конкретного хаба: max_articles еще не сохраненных и известные, встреченные по пути.
+        При повторном обходе листается только до статей, найденных в прошлый раз.
+        """
+        walk = ListingWalk(engine.state, self.name, hub_url, known)
+        articles = []
+        fresh = 0
+        page = 1
+        exhausted = False
+
+        # Сохраненные статьи не в счет: иначе недобранный хаб каждый раз отдавал бы одни и те же
+        while fresh < max_articles and page <= MAX_PAGES_PER_HUB and not walk.done:
+            if page == 1:
+                page_url = urljoin(hub_url, 'articles/')
+            else:
+                page_url = urljoin(hub_url, f'articles/page{page}/')
+
+            response = await engine.fetch(page_url, revalidate=walk.incremental)
+            if response and response.status == 304:
+                walk.not_modified()
+                break
+            if not response or response.status != 200:
+                return articles
+
+            new_links = walk.page(extract_article_links(response.body))
+            if not new_links and not walk.done:
+                exhausted = True
+                break
+
+            for url in new_links:
+                if fresh >= max_articles:
+                    break
+                articles.append(url)
+                fresh += not known(url)
+            logging.info(f"Хаб: {hub_url.split('/')[-2]} | Страница {page}: +{len(new_links)} статей")
+            page += 1
+
+        # Хаб, обрезанный по max_articles или MAX_PAGES_PER_HUB, в следующий раз обходится целиком
+        walk.finish(exhausted, capped=fresh >= max_articles)
+        return articles
+
+    async def discover(self, engine, writer):
+        categorized_hubs = await self.get_hub_urls(engine)
         if not categorized_hubs:
             logging.error("Не удалось получить список хабов")
             return
 
-        # Используем пул потоков для параллельного парсинга статей
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            # Сбор статей по категориям
-            for category, hubs in categorized_hubs.items():
-                needed = TARGET_ARTICLES_PER_CATEGORY - category_counts[category]
-                if needed <= 0:
-                    logging.info(f"Категория {category} уже заполнена")
-                    continue
-
-                logging.info(f"\n{'='*40}\nСбор категории: {category} (осталось: {needed})\n{'='*40}")
-                collected = 0
+        scheduled = set()
+        for category, hubs in categorized_hubs.items():
+            needed = TARGET_ARTICLES_PER_CATEGORY - (writer.key_counts[category] if writer is not None else 0)
+            if needed <= 0:
+                logging.info(f"Категория {category} уже заполнена")
+                continue
 
-                for hub_url in hubs:
+            logging.info(f"\n{'='*40}\nСбор категории: {category} (осталось: {needed})\n{'='*40}")
+            collected = 0
+            for hub_url in hubs:
+                if collected >= needed:
+                    break
+                # Ограничиваем количество статей, получаемых из одного хаба
+                articles = await self.get_articles_from_hub(engine, hub_url, min(needed - collected, ARTICLES_PER_HUB),
+                                                            known=lambda url: writer is not None and url in writer)
+                for url in articles:
+                    # Пропускаем уже сохранённые статьи и статьи из пересекающихся хабов
+                    if url in scheduled or (writer is not None and url in writer):
+                        continue
+                    scheduled.add(url)
+                    collected += 1
+                    yield url, {"category": category}
                     if collected >= needed:
                         break
 
-                    try:
-                        # Ограничиваем количество статей, получаемых из одного хаба
-                        articles = get_articles_from_hub(hub_url, min(needed - collected, ARTICLES_PER_HUB), session)
-                        new_articles = [url for url in articles if url not in processed_urls]
-                        if not new_articles:
-                            continue
-
-                        # Параллельный парсинг статей
-                        futures = {
-                            executor.submit(parse_article, url, category, session): url
-                            for url in new_articles
-                        }
-                        for future in as_completed(futures):
-                            article_data = future.result()
-                            if article_data:
-                                existing_data.append(article_data)
-                                processed_urls.add(article_data["article_id"])
-                                collected += 1
-                                category_counts[category] += 1
-                                logging.info(f"[{category}] Собрано: {collected}/{needed} | {article_data['title'][:50]}...")
-                                # Сохраняем каждые 10 статей
-                                if collected % 10 == 0:
-                                    with open(output_file, 'w', encoding='utf-8') as f:
-                                        json.dump(existing_data, f, ensure_ascii=False, indent=2)
-
-                            # Добавляем небольшую задержку между задачами
-                            time.sleep(REQUEST_DELAY * 0.1)
-                            if collected >= needed:
-                                break
-
-                    except Exception as e:
-                        logging.error(f"Ошибка в хабе {hub_url}: {e}")
-
-        # Финальное сохранение
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(existing_data, f, ensure_ascii=False, indent=2)
+    def extract(self, url, html, meta):
+        return extract_article(html, url, meta["category"])
+
+
+def main(replay=False):
+    output_file = os.path.join('data', 'habr_articles.json')
+    log_file = os.path.join('data', 'habr_articles.jsonl')
+    archive = ResponseArchive(os.path.join('data', 'habr_responses.warc.gz'))
+    # ETag/Last-Modified страниц хабов и граница прошлого обхода; при повторе из архива не нужны
+    state = CrawlState(os.path.join('data', 'habr_state.sqlite')) if not replay else None
+
+    if replay:
+        # Повторное извлечение из архива ответов: без сети, результат рядом с исходным датасетом
+        log_file, output_file = reset_replay_log(log_file), replay_path(output_file)
+        writer = JsonlArticleWriter(log_file, fsync_every=10)
+    else:
+        # Для продолжения сбора читаем только индекс уже сохранённых статей
+        writer = JsonlArticleWriter(log_file, fsync_every=10)
+        if not len(writer) and os.path.exists(output_file):
+            writer.import_records(output_file)
+    category_counts = writer.key_counts
+
+    # Сетью управляет общий движок: пул соединений, лимит на хост, паузы и повторы.
+    # HTML разбирается в отдельных процессах, чтобы парсинг не тормозил загрузку.
+    # Все ответы сохраняются в архив
+    with writer, archive:
+        crawl_site(HabrSite(), writer, workers=10, extract_workers=EXTRACT_WORKERS,
+                   per_host_concurrency=10, per_host_rate=1 / REQUEST_DELAY, adaptive=AimdPolicy(max_rate=MAX_RATE),
+                   archive=archive, replay=replay, state=state)
+    if state is not None:
+        state.close()
+
+    # Финальный датасет без дубликатов
+    total = compact(log_file, output_file)
 
     logging.info(f"\n{'='*40}\nИтоговый отчет:")
     for cat, count in category_counts.items():
         logging.info(f"{cat}: {count} статей")
-    logging.info(f"Всего собрано: {len(existing_data)} статей")
+    logging.info(f"Всего собрано: {total} статей")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--replay', action='store_true', help='извлечь статьи заново из архива ответов, без сети')
+    args = parser.parse_args()
     try:
-        main()
+        main(replay=args.replay)
     except KeyboardInterrupt:
-        logging.info("Прерывание пользователем. Сохранение данных...")
+        logging.info("Прерывание пользователем. Данные уже сохранены в лог.")
         exit(0)
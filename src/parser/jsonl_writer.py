@@ -0,0 +1,168 @@
+"""
+Append-only, crash-tolerant storage for scraped articles.
+
+Records are appended to a JSONL file one per line, and their ids go to a small sidecar
+index `<file>.ids` (id and category, tab-separated). A restarted crawl reads only the index
+to know what is already done. compact() turns the log into the final deduplicated JSON dataset.
+"""
+import json
+import logging
+import os
+import textwrap
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Set, Union
+
+from src.json_stream import iter_json_records
+
+
+def _truncate_torn_tail(path: Path, block_size: int = 1 << 16) -> None:
+    """Drops a partially written last line left by an interrupted run."""
+    if not path.exists() or path.stat().st_size == 0:
+        return
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        f.seek(end - 1)
+        if f.read(1) == b'\n':
+            return
+        # Walk back block by block to the last complete line
+        pos = end
+        while pos > 0:
+            start = max(0, pos - block_size)
+            f.seek(start)
+            newline = f.read(pos - start).rfind(b'\n')
+            if newline != -1:
+                pos = start + newline + 1
+                break
+            pos = start
+        f.truncate(pos)
+    logging.warning(f"{path}: отброшена недописанная последняя строка")
+
+
+class JsonlArticleWriter:
+    def __init__(self, path: Union[str, Path], id_field: str = 'article_id',
+                 key_field: Optional[str] = 'category', fsync_every: int = 50):
+        self.path = Path(path)
+        self.index_path = self.path.with_name(self.path.name + '.ids')
+        self.id_field = id_field
+        self.key_field = key_field
+        self.fsync_every = fsync_every
+
+        self.seen: Set[str] = set()
+        self.key_counts: Counter = Counter()
+        self._pending = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        _truncate_torn_tail(self.path)
+        _truncate_torn_tail(self.index_path)
+        self._load_index()
+
+        self._data_file = open(self.path, 'a', encoding='utf-8')
+        self._index_file = open(self.index_path, 'a', encoding='utf-8')
+
+    def _load_index(self) -> None:
+        if not self.index_path.exists() and self.path.exists():
+            self._rebuild_index()
+        if not self.index_path.exists():
+            return
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                record_id, _, key = line.rstrip('\n').partition('\t')
+                if record_id not in self.seen:
+                    self.seen.add(record_id)
+                    self.key_counts[key] += 1
+        logging.info(f"{self.path}: в индексе {len(self.seen)} записей")
+
+    def _rebuild_index(self) -> None:
+        logging.warning(f"{self.index_path} не найден, восстанавливаем индекс по {self.path}")
+        with open(self.index_path, 'w', encoding='utf-8') as f:
+            for record in iter_json_records(self.path):
+                if record.get(self.id_field) is not None:
+                    f.write(self._index_line(record))
+
+    # Ids and keys are compared as the strings the index stores, so int ids are still known after a restart
+    def _key(self, record: Dict) -> str:
+        key = record.get(self.key_field) if self.key_field else None
+        return '' if key is None else str(key)
+
+    def _index_line(self, record: Dict) -> str:
+        return f"{record[self.id_field]}\t{self._key(record)}\n"
+
+    def __contains__(self, record_id) -> bool:
+        return record_id is not None and str(record_id) in self.seen
+
+    def __len__(self) -> int:
+        return len(self.seen)
+
+    def write(self, record: Dict) -> bool:
+        """Appends the record unless its id was already written or is missing. Returns True if it was written."""
+        if record.get(self.id_field) is None:
+            logging.warning(f"{self.path}: запись без {self.id_field} пропущена")
+            return False
+        record_id = str(record[self.id_field])
+        if record_id in self.seen:
+            return False
+
+        # Data line goes out before its id, so the index never points at a record that was not written
+        self._data_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._data_file.flush()
+        self._index_file.write(self._index_line(record))
+
+        self.seen.add(record_id)
+        self.key_counts[self._key(record)] += 1
+        self._pending += 1
+        if self._pending >= self.fsync_every:
+            self.flush()
+        return True
+
+    def import_records(self, path: Union[str, Path]) -> int:
+        """Seeds the log from a dataset written by the old full-rewrite savers."""
+        imported = sum(self.write(record) for record in iter_json_records(path))
+        self.flush()
+        logging.info(f"Импортировано {imported} записей из {path} в {self.path}")
+        return imported
+
+    def flush(self) -> None:
+        for f in (self._data_file, self._index_file):
+            f.flush()
+            os.fsync(f.fileno())
+        self._pending = 0
+
+    def close(self) -> None:
+        if self._data_file.closed:
+            return
+        self.flush()
+        self._data_file.close()
+        self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def iter_unique_records(path: Union[str, Path], id_field: str = 'article_id') -> Iterator[Dict]:
+    """Streams the log, keeping the first record for every id."""
+    seen = set()
+    for record in iter_json_records(path):
+        if record[id_field] not in seen:
+            seen.add(record[id_field])
+            yield record
+
+
+def compact(path: Union[str, Path], output_file: Union[str, Path], id_field: str = 'article_id') -> int:
+    """Writes the deduplicated log as the JSON array the rest of the project reads."""
+    output_file = Path(output_file)
+    tmp_file = output_file.with_name(output_file.name + '.tmp')
+    total = 0
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for record in iter_unique_records(path, id_field):
+            f.write(',\n' if total else '\n')
+            f.write(textwrap.indent(json.dumps(record, ensure_ascii=False, indent=4), ' ' * 4))
+            total += 1
+        f.write('\n]\n')
+    os.replace(tmp_file, output_file)
+    logging.info(f"Компактизация {path} -> {output_file}: {total} статей")
+    return total
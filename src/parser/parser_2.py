@@ -1,265 +1,270 @@
-import requests
-import json
-import time
-import random
-import logging
-from src.logger import setup_logger
-from urllib.parse import quote
-from bs4 import BeautifulSoup
-import regex as re
-
-# Updated settings
-categories = ['world', 'business', 'technology', 'markets']
-# categories = ['technology']
-articles_per_category = 1000
-articles_per_request = 20
-connection_batch_size = 50
-output_links_file = 'data/reuters_links.jsonl'
-output_articles_file = 'data/reuters_articles.json'
-
-# Modern browser headers template
-HEADERS_TEMPLATE = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36',
-    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-    'Accept-Language': 'en-US,en;q=0.9',
-    'Accept-Encoding': 'gzip, deflate',
-    'Sec-Fetch-Dest': 'document',
-    'Sec-Fetch-Mode': 'navigate',
-    'Sec-Fetch-Site': 'same-origin',
-    'Sec-Fetch-User': '?1',
-    'Upgrade-Insecure-Requests': '1',
-    'Connection': 'keep-alive',
-    'Cache-Control': 'max-age=0',
-    'DNT': '1'
-}
-
-class ReutersScraper:
-    def __init__(self):
-        self.session = requests.Session()
-        self._init_session()
-
-    def _init_session(self):
-        """Initialize session with proper cookies and headers"""
-        self.session.close()
-
-        # First request to establish basic cookies
-        self.session.get('https://www.reuters.com/', headers=HEADERS_TEMPLATE)
-        time.sleep(random.uniform(3, 5))
-        
-        # Second request to simulate browser warmup
-        self.session.get('https://www.reuters.com/world/', headers=HEADERS_TEMPLATE)
-        time.sleep(random.uniform(3, 5))
-
-    def _make_request(self, url, category=None):
-        """Make a request with proper headers and delays"""
-        headers = HEADERS_TEMPLATE.copy()
-        if category:
-            headers['Referer'] = f'https://www.reuters.com/{category}/'
-        
-        time.sleep(random.uniform(0.3, 1))
-        
-        try:
-            response = self.session.get(url, headers=headers)
-            response.raise_for_status()
-            return response
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 403:
-                logging.warning("Blocking detected - regenerating session...")
-                self._init_session()
-                return self._make_request(url, category)
-            raise
-
-    def fetch_links(self):
-        """Collect article links using the API"""
-        base_api_url = 'https://www.reuters.com/pf/api/v3/content/fetch/articles-by-section-alias-or-id-v1?query='
-        
-        for category in categories:
-            offset = 0
-            collected = 0
-            
-            while collected < articles_per_category:
-                query = {
-                    "section_id": f"/{category}",
-                    "size": articles_per_request,
-                    "offset": offset,
-                    "website": "reuters"
-                }
-                encoded_query = quote(json.dumps(query))
-                url = base_api_url + encoded_query
-                
-                try:
-                    response = self._make_request(url, category)
-                    data = response.json()
-                    articles = data.get('result', {}).get('articles', [])
-                    
-                    if not articles:
-                        break
-                    
-                    for article in articles:
-                        article_url = 'https://www.reuters.com' + article['canonical_url']
-                        article_data = {
-                            'url': article_url,
-                            'category': category,
-                            'title': article.get('title', ''),
-                            'tags': [tag['slug'] for tag in article.get('taxonomy', {}).get('tags', [])]
-                        }
-                        
-                        with open(output_links_file, 'a', encoding='utf-8') as f:
-                            f.write(json.dumps(article_data, ensure_ascii=False) + '\n')
-                        
-                        collected += 1
-                        logging.info(f"Collected {collected}/{articles_per_category} in {category}")
-                        if collected >= articles_per_category:
-                            break
-                    
-                    offset += articles_per_request
-                    
-                except Exception as e:
-                    logging.error(f"Error fetching {category}: {e}")
-                    break
-
-    def _extract_article_content(self, soup):
-        """Direct text extraction from paragraph containers"""
-        paragraphs = soup.find_all('div', {
-            'data-testid': lambda x: x and x.startswith('paragraph-')
-        })
-        
-        clean_text = []
-        for p in paragraphs[:2]:
-            # Skip non-content containers
-            if p.find(['aside', 'figure', 'div[data-testid="signup-prompt"]']):
-                continue
-                
-            # Directly extract text from the div itself
-            text = p.get_text(separator=' ', strip=True)
-            if text:
-                clean_text.append(text)
-        
-        return ' '.join(clean_text)
-
-    # def _extract_tags_from_meta(self, soup):
-    #     """Improved tag extraction from multiple sources"""
-    #     # From keywords meta
-    #     meta_keywords = soup.find('meta', {'name': 'keywords'})
-    #     if meta_keywords:
-    #         return [tag.strip() for tag in meta_keywords.get('content', '').split(',')]
-        
-    #     # From JSON-LD data
-    #     script = soup.find('script', type='application/ld+json')
-    #     if script:
-    #         try:
-    #             data = json.loads(script.string)
-    #             return data.get('keywords', '').split(',')
-    #         except json.JSONDecodeError:
-    #             pass
-        
-    #     return []
-
-    def parse_articles(self):
-        """Updated parsing with proper text/tag handling"""
-        articles_data = []
-        
-        with open(output_links_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        for idx, line in enumerate(lines):
-            article_info = json.loads(line)
-            url = article_info['url']
-            category = article_info['category']
-            tags = article_info['tags']  # Preserve API-provided tags
-            
-            try:
-                response = self._make_request(url, category)
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                # Extract title using direct text access
-                title_element = soup.find('h1')
-                title = title_element.text.strip() if title_element else article_info['title']
-                
-                # Extract article text
-                text = self._extract_article_content(soup)
-                
-                # Clean up Reuters-specific trailing content
-                text = re.sub(r'\s*Sign up here\..*$', '', text, flags=re.DOTALL)
-                text = re.sub(r'\s*Our Standards:.*$', '', text, flags=re.DOTALL)
-                # Fallback tag extraction
-                if not tags:
-                    meta_keywords = soup.find('meta', {'name': 'keywords'})
-                    if meta_keywords:
-                        tags = [tag.strip() for tag in meta_keywords.get('content', '').split(',') if (not "DEST" in tag)]
-                
-                article_entry = {
-                    "article_id": url,
-                    "title": title,
-                    "category": category.replace('-', '_'),
-                    "tags": tags,
-                    "text": text.strip()
-                }
-                
-                articles_data.append(article_entry)
-                logging.info(f"Successfully parsed: {title[:50]} ({idx+1}/{articles_per_category})...")
-                
-            except Exception as e:
-                logging.error(f"Error parsing {url}: {e}")
-                continue
-
-            if idx % connection_batch_size == 0:
-                logging.info("Safe reconnecting...")
-                self._init_session()
-
-                with open(output_articles_file, 'w', encoding='utf-8') as f:
-                    json.dump(articles_data, f, ensure_ascii=False, indent=4)
-                    logging.info(f"Saved {idx+1} articles from {articles_per_category*len(categories)}")
-        
-        with open(output_articles_file, 'w', encoding='utf-8') as f:
-            json.dump(articles_data, f, ensure_ascii=False, indent=4)
-            logging.info(f"All {articles_per_category * len(categories)} articles saved!")
-        
-    def _remove_trailing_junk(self, text):
-        """Remove common trailing elements like sign-up prompts"""
-        patterns = [
-            r'\s*Sign up here\..*$',
-            r'\s*Our Standards:.*$',
-            r'\s*Reporting by.*$',
-            r'\s*Editing by.*$',
-            r'\s*Thomson Reuters.*$'
-        ]
-        for pattern in patterns:
-            text = re.sub(pattern, '', text, flags=re.DOTALL|re.IGNORECASE)
-        return text.strip()
-
-    def _extract_meta_description(self, soup):
-        """Extract description from meta tags"""
-        meta = soup.find('meta', {'name': 'description'}) or \
-            soup.find('meta', {'property': 'og:description'})
-        return meta.get('content', '').strip() if meta else ''
-
-    def _extract_tags_from_meta(self, soup):
-        """Improved tag extraction from multiple sources"""
-        # From keywords meta
-        meta_keywords = soup.find('meta', {'name': 'keywords'})
-        if meta_keywords:
-            return [tag.strip() for tag in meta_keywords.get('content', '').split(',')]
-        
-        # From JSON-LD data
-        script = soup.find('script', type='application/ld+json')
-        if script:
-            try:
-                data = json.loads(script.string)
-                return data.get('keywords', '').split(',')
-            except json.JSONDecodeError:
-                pass
-        
-        return []
-
-if __name__ == '__main__':
-    with open(output_articles_file, 'w', encoding='utf-8') as f:
-        f.write("")
-    
-    with open(output_links_file, 'w', encoding='utf-8') as f:
-        f.write("")
-    
-    setup_logger(logging.INFO, stdout_log=True, file_log=False)
-    scraper = ReutersScraper()
-    scraper.fetch_links()
-    scraper.parse_articles()
\ No newline at end of file
+import argparse
+import json
+import logging
+from src.logger import setup_logger
+from src.parser.crawl_engine import AimdPolicy, Site, crawl_site
+from src.parser.crawl_state import CrawlState, ListingWalk
+from src.parser.jsonl_writer import JsonlArticleWriter, compact
+from src.parser.response_archive import ResponseArchive, replay_path, reset_replay_log
+from urllib.parse import quote
+from bs4 import BeautifulSoup
+import regex as re
+
+# Updated settings
+categories = ['world', 'business', 'technology', 'markets']
+# categories = ['technology']
+articles_per_category = 1000
+articles_per_request = 20
+connection_batch_size = 50
+extract_workers = 2
+output_links_file = 'data/reuters_links.jsonl'
+output_articles_file = 'data/reuters_articles.json'
+articles_log_file = 'data/reuters_articles.jsonl'
+responses_archive_file = 'data/reuters_responses.warc.gz'
+state_file = 'data/reuters_state.sqlite'
+
+BASE_URL = 'https://www.reuters.com'
+BASE_API_URL = BASE_URL + '/pf/api/v3/content/fetch/articles-by-section-alias-or-id-v1?query='
+
+# Modern browser headers template
+HEADERS_TEMPLATE = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'same-origin',
+    'Sec-Fetch-User': '?1',
+    'Upgrade-Insecure-Requests': '1',
+    'Connection': 'keep-alive',
+    'Cache-Control': 'max-age=0',
+    'DNT': '1'
+}
+
+
+def extract_article_content(soup):
+    """Direct text extraction from paragraph containers"""
+    paragraphs = soup.find_all('div', {
+        'data-testid': lambda x: x and x.startswith('paragraph-')
+    })
+    
+    clean_text = []
+    for p in paragraphs[:2]:
+        # Skip non-content containers
+        if p.find(['aside', 'figure', 'div[data-testid="signup-prompt"]']):
+            continue
+            
+        # Directly extract text from the div itself
+        text = p.get_text(separator=' ', strip=True)
+        if text:
+            clean_text.append(text)
+    
+    return ' '.join(clean_text)
+
+
+def extract_article(html, article_info):
+    """Builds the article record from the page and the link collected from the API"""
+    url = article_info['url']
+    category = article_info['category']
+    tags = article_info['tags']  # Preserve API-provided tags
+
+    soup = BeautifulSoup(html, 'lxml')
+    
+    # Extract title using direct text access
+    title_element = soup.find('h1')
+    title = title_element.text.strip() if title_element else article_info['title']
+    
+    # Extract article text
+    text = extract_article_content(soup)
+    
+    # Clean up Reuters-specific trailing content
+    text = re.sub(r'\s*Sign up here\..*$', '', text, flags=re.DOTALL)
+    text = re.sub(r'\s*Our Standards:.*$', '', text, flags=re.DOTALL)
+    # Fallback tag extraction
+    if not tags:
+        meta_keywords = soup.find('meta', {'name': 'keywords'})
+        if meta_keywords:
+            tags = [tag.strip() for tag in meta_keywords.get('content', '').split(',') if (not "DEST" in tag)]
+    
+    return {
+        "article_id": url,
+        "title": title,
+        "category": category.replace('-', '_'),
+        "tags": tags,
+        "text": text.strip()
+    }
+
+
+def remove_trailing_junk(text):
+    """Remove common trailing elements like sign-up prompts"""
+    patterns = [
+        r'\s*Sign up here\..*$',
+        r'\s*Our Standards:.*$',
+        r'\s*Reporting by.*$',
+        r'\s*Editing by.*$',
+        r'\s*Thomson Reuters.*$'
+    ]
+    for pattern in patterns:
+        text = re.sub(pattern, '', text, flags=re.DOTALL|re.IGNORECASE)
+    return text.strip()
+
+
+def extract_meta_description(soup):
+    """Extract description from meta tags"""
+    meta = soup.find('meta', {'name': 'description'}) or \
+        soup.find('meta', {'property': 'og:description'})
+    return meta.get('content', '').strip() if meta else ''
+
+
+def extract_tags_from_meta(soup):
+    """Improved tag extraction from multiple sources"""
+    # From keywords meta
+    meta_keywords = soup.find('meta', {'name': 'keywords'})
+    if meta_keywords:
+        return [tag.strip() for tag in meta_keywords.get('content', '').split(',')]
+    
+    # From JSON-LD data
+    script = soup.find('script', type='application/ld+json')
+    if script:
+        try:
+            data = json.loads(script.string)
+            return data.get('keywords', '').split(',')
+        except json.JSONDecodeError:
+            pass
+    
+    return []
+
+
+class ReutersSite(Site):
+    name = 'reuters'
+    headers = HEADERS_TEMPLATE
+
+    def __init__(self, categories=categories, links_file=output_links_file,
+                 per_category=articles_per_category):
+        self.categories = categories
+        self.links_file = links_file
+        self.per_category = per_category
+
+    async def prepare(self, engine):
+        """Warm up the session so the cookie jar looks like a browser's"""
+        # First request to establish basic cookies, second one to simulate browser warmup
+        await engine.fetch(BASE_URL + '/')
+        await engine.fetch(BASE_URL + '/world/')
+
+    def request_headers(self, url, meta):
+        return {'Referer': f"{BASE_URL}/{meta['category']}/"}
+
+    async def fetch_links(self, engine, category, known=lambda url: False):
+        """
+        Collect article links of a category using the API, page by page.
+        A recrawl stops at the articles already seen by the previous pass.
+        """
+        walk = ListingWalk(engine.state, self.name, category, known)
+        offset = 0
+        collected = 0
+        exhausted = False
+        
+        while collected < self.per_category and not walk.done:
+            query = {
+                "section_id": f"/{category}",
+                "size": articles_per_request,
+                "offset": offset,
+                "website": "reuters"
+            }
+            url = BASE_API_URL + quote(json.dumps(query))
+            
+            response = await engine.fetch(url, headers=self.request_headers(url, {'category': category}),
+                                          revalidate=walk.incremental)
+            if response is not None and response.status == 304:
+                walk.not_modified()
+                break
+            if response is None or not response.ok:
+                logging.error(f"Error fetching {category}: status {response.status if response else None}")
+                return
+            try:
+                articles = json.loads(response.body).get('result', {}).get('articles', [])
+            except json.JSONDecodeError as e:
+                logging.error(f"Error fetching {category}: {e}")
+                return
+            
+            if not articles:
+                exhausted = True
+                break
+            
+            urls = [BASE_URL + article['canonical_url'] for article in articles]
+            new_urls = set(walk.page(urls))
+            for article, article_url in zip(articles, urls):
+                if article_url not in new_urls:
+                    continue
+                yield {
+                    'url': article_url,
+                    'category': category,
+                    'title': article.get('title', ''),
+                    'tags': [tag['slug'] for tag in article.get('taxonomy', {}).get('tags', [])]
+                }
+                # Parsed articles do not count, so an under-filled category catches up on the next run
+                if known(article_url):
+                    continue
+                collected += 1
+                logging.info(f"Collected {collected}/{self.per_category} in {category}")
+                if collected >= self.per_category:
+                    break
+            
+            offset += articles_per_request
+
+        # A category cut by per_category is walked in full next time
+        walk.finish(exhausted, capped=collected >= self.per_category)
+
+    async def discover(self, engine, writer):
+        # Articles are fetched while the next API pages are still being collected
+        with open(self.links_file, 'a', encoding='utf-8') as f:
+            for category in self.categories:
+                async for article_info in self.fetch_links(engine, category,
+                                                           known=lambda url: writer is not None and url in writer):
+                    f.write(json.dumps(article_info, ensure_ascii=False) + '\n')
+                    # Already parsed in a previous (interrupted) run
+                    if writer is not None and article_info['url'] in writer:
+                        continue
+                    yield article_info['url'], article_info
+
+    def extract(self, url, html, meta):
+        return extract_article(html, meta)
+
+
+def run(site, log_file, articles_file, archive_file, state_file, replay=False, **engine_kwargs):
+    """
+    Crawls the site into the append-only log, then compacts it into the final JSON.
+    Every response is kept in archive_file; with replay=True the articles are re-extracted
+    from it without network into *.replay.* files. state_file makes recrawls incremental.
+    """
+    if replay:
+        site.links_file = replay_path(site.links_file)
+        log_file, articles_file = reset_replay_log(log_file), replay_path(articles_file)
+
+    # Links are re-collected on every run, parsed articles are kept in the append-only log
+    with open(site.links_file, 'w', encoding='utf-8') as f:
+        f.write("")
+
+    with JsonlArticleWriter(log_file, fsync_every=connection_batch_size) as writer, \
+            ResponseArchive(archive_file) as archive:
+        state = CrawlState(state_file) if not replay else None
+        crawl_site(site, writer, archive=archive, replay=replay, state=state, **engine_kwargs)
+        if state is not None:
+            state.close()
+        logging.info(f"Saved {len(writer)} articles from {site.per_category*len(site.categories)}")
+
+    total = compact(log_file, articles_file)
+    logging.info(f"All {total} articles saved!")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--replay', action='store_true', help='re-extract articles from the response archive')
+    args = parser.parse_args()
+
+    setup_logger(logging.INFO, stdout_log=True, file_log=False)
+    # Starts at ~1.5 requests/sec like the old 0.3-1s sleeps and speeds up while Reuters answers quickly
+    run(ReutersSite(), articles_log_file, output_articles_file, responses_archive_file, state_file, replay=args.replay,
+        workers=8, extract_workers=extract_workers, per_host_concurrency=4, per_host_rate=1.5,
+        adaptive=AimdPolicy(max_rate=6.0))
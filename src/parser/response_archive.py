@@ -0,0 +1,180 @@
+"""
+Append-only archive of raw HTTP responses, in the spirit of WARC.
+
+Every response is stored as its own gzip member: a JSON header line (url, status, headers,
+fetch time) followed by the body. The sidecar index `<file>.idx` keeps one JSON line per
+response with its offset and size, so any page can be read back without scanning the archive.
+
+CrawlEngine writes every fetched page here. In replay mode it answers all requests from the
+archive, so extractors can be re-run on the saved pages without touching the network.
+
+Usage:
+    python -m src.parser.response_archive stats data/habr_responses.warc.gz
+    python -m src.parser.response_archive export data/habr_responses.warc.gz --out data/fixtures/habr --limit 200
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Union
+
+from src.logger import setup_logger
+from src.parser.jsonl_writer import _truncate_torn_tail
+
+
+class ResponseArchive:
+    def __init__(self, path: Union[str, Path], fsync_every: int = 50, compresslevel: int = 6):
+        self.path = Path(path)
+        self.index_path = self.path.with_name(self.path.name + '.idx')
+        self.fsync_every = fsync_every
+        self.compresslevel = compresslevel
+
+        # url -> index entry of its latest response
+        self.entries: Dict[str, Dict] = {}
+        self._pending = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        _truncate_torn_tail(self.index_path)
+        self._load_index()
+
+        self._data_file = open(self.path, 'ab+')
+        self._index_file = open(self.index_path, 'a', encoding='utf-8')
+
+    def _load_index(self) -> None:
+        end = 0
+        if self.index_path.exists():
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.entries[entry['url']] = entry
+                    end = max(end, entry['offset'] + entry['size'])
+        # A record whose index line was never written is unreachable: drop it
+        if self.path.exists() and self.path.stat().st_size > end:
+            logging.warning(f"{self.path}: отброшен недописанный хвост архива")
+            os.truncate(self.path, end)
+        logging.info(f"{self.path}: в архиве {len(self.entries)} страниц")
+
+    def __contains__(self, url: str) -> bool:
+        return url in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def put(self, url: str, status: int, headers: Dict[str, str], body: bytes,
+            fetched_at: Optional[float] = None) -> None:
+        fetched_at = fetched_at if fetched_at is not None else time.time()
+        header = {'url': url, 'status': status, 'headers': headers, 'fetched_at': fetched_at}
+        record = gzip.compress(json.dumps(header, ensure_ascii=False).encode('utf-8') + b'\n' + body,
+                               compresslevel=self.compresslevel)
+
+        # Body goes out before its index line, so the index never points at a record that was not written
+        offset = self._data_file.seek(0, os.SEEK_END)
+        self._data_file.write(record)
+        self._data_file.flush()
+        entry = {'url': url, 'offset': offset, 'size': len(record), 'status': status, 'fetched_at': fetched_at}
+        self._index_file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+        self.entries[url] = entry
+        self._pending += 1
+        if self._pending >= self.fsync_every:
+            self.flush()
+
+    def _read(self, entry: Dict) -> Dict:
+        self._data_file.seek(entry['offset'])
+        header, _, body = gzip.decompress(self._data_file.read(entry['size'])).partition(b'\n')
+        record = json.loads(header)
+        record['body'] = body
+        return record
+
+    def get(self, url: str) -> Optional[Dict]:
+        """Latest stored response for url as a dict with url/status/headers/fetched_at/body, or None."""
+        entry = self.entries.get(url)
+        return self._read(entry) if entry is not None else None
+
+    def __iter__(self) -> Iterator[Dict]:
+        """Latest response of every url, in archive order."""
+        for entry in sorted(self.entries.values(), key=lambda e: e['offset']):
+            yield self._read(entry)
+
+    def size_bytes(self) -> int:
+        return self.path.stat().st_size if self.path.exists() else 0
+
+    def flush(self) -> None:
+        for f in (self._data_file, self._index_file):
+            f.flush()
+            os.fsync(f.fileno())
+        self._pending = 0
+
+    def close(self) -> None:
+        if self._data_file.closed:
+            return
+        self.flush()
+        self._data_file.close()
+        self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def replay_path(path: Union[str, Path]) -> Path:
+    """data/x.jsonl -> data/x.replay.jsonl: replay runs write next to, not over, the crawled data."""
+    path = Path(path)
+    return path.with_name(path.stem + '.replay' + path.suffix)
+
+
+def reset_replay_log(log_file: Union[str, Path]) -> Path:
+    """Starts an empty article log for a replay run: every archived page has to be extracted again."""
+    log_file = replay_path(log_file)
+    for path in (log_file, log_file.with_name(log_file.name + '.ids')):
+        if path.exists():
+            path.unlink()
+    return log_file
+
+
+def export_fixtures(archive: ResponseArchive, out_dir: Union[str, Path], limit: Optional[int] = None) -> int:
+    """Writes successful HTML responses as <sha1 of url>.html files, e.g. for the extraction benchmark."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    exported = 0
+    for record in archive:
+        if limit is not None and exported >= limit:
+            break
+        content_type = {k.lower(): v for k, v in record['headers'].items()}.get('content-type', '')
+        if record['status'] != 200 or 'html' not in content_type:
+            continue
+        name = hashlib.sha1(record['url'].encode('utf-8')).hexdigest()
+        (out_dir / f'{name}.html').write_bytes(record['body'])
+        exported += 1
+    return exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['stats', 'export'])
+    parser.add_argument('archive')
+    parser.add_argument('--out', help='fixtures directory for export')
+    parser.add_argument('--limit', type=int)
+    args = parser.parse_args()
+
+    with ResponseArchive(args.archive) as archive:
+        if args.command == 'stats':
+            statuses = {}
+            for entry in archive.entries.values():
+                statuses[entry['status']] = statuses.get(entry['status'], 0) + 1
+            logging.info(f"{len(archive)} url, {archive.size_bytes() / 1024 ** 2:.1f} МБ, статусы: {statuses}")
+        else:
+            if not args.out:
+                parser.error('export needs --out')
+            logging.info(f"Выгружено {export_fixtures(archive, args.out, args.limit)} страниц в {args.out}")
+
+
+if __name__ == '__main__':
+    setup_logger(logging.INFO, stdout_log=True, file_log=False)
+    main()
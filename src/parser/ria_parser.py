@@ -1,21 +1,30 @@
+import argparse
+import asyncio
 import json
 import time
 import logging
 import os
-import requests
+from urllib.parse import urljoin
+
 from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-import concurrent.futures
+
+from src.parser.crawl_engine import AimdPolicy, RetryPolicy, Site, crawl_site
+from src.parser.crawl_state import CrawlState, ListingWalk
+from src.parser.jsonl_writer import JsonlArticleWriter, compact
+from src.parser.response_archive import ResponseArchive, replay_path, reset_replay_log
 
 # ========== Конфигурационные переменные ==========
 TARGET_LINKS = 1000
 CHUNK_SIZE_LINKS = 50
 CHUNK_SIZE_ARTICLES = 50
+EXTRACT_WORKERS = 4  # процессы для разбора HTML
+MAX_RATE = 20.0  # запросов в секунду, не больше
 LINKS_OUTPUT_FILE = "ria_links.json"
 ARTICLES_OUTPUT_FILE = "ria_articles.json"
+ARTICLES_LOG_FILE = "ria_articles.jsonl"
+RESPONSES_ARCHIVE_FILE = "ria_responses.warc.gz"
+STATE_FILE = "ria_state.sqlite"
+BASE_URL = "https://ria.ru/"
 # ===================================================
 
 # Полный список категорий
@@ -35,18 +44,35 @@ CATEGORIES = [
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-chrome_options = Options()
-chrome_options.add_argument("--no-sandbox")
-chrome_options.add_argument("--disable-dev-shm-usage")
-chrome_options.add_argument("--remote-debugging-port=9222")
-chrome_options.add_argument("--headless=new")
+# ========== Сбор ссылок через браузер (запасной вариант) ==========
+# Chrome запускается только при первом обращении: основной сбор ссылок идет по HTTP
+_driver = None
+
+def get_driver():
+    global _driver
+    if _driver is None:
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
 
-driver = webdriver.Chrome(options=chrome_options)
-wait = WebDriverWait(driver, 20)
+        chrome_options = Options()
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--disable-dev-shm-usage")
+        chrome_options.add_argument("--remote-debugging-port=9222")
+        chrome_options.add_argument("--headless=new")
+        logger.info("Запуск Chrome")
+        _driver = webdriver.Chrome(options=chrome_options)
+    return _driver
+
+def close_driver():
+    global _driver
+    if _driver is not None:
+        logger.info("Закрытие драйвера")
+        _driver.quit()
+        _driver = None
 
 def scroll_page():
     logger.debug("Прокрутка страницы вниз.")
-    driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+    get_driver().execute_script("window.scrollTo(0, document.body.scrollHeight);")
     time.sleep(1)
 
 def save_links(links):
@@ -54,13 +80,11 @@ def save_links(links):
         json.dump(links, f, ensure_ascii=False, indent=4)
     logger.info("Обновлено ссылок: %d в %s", len(links), LINKS_OUTPUT_FILE)
 
-def save_articles(articles):
-    with open(ARTICLES_OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(articles, f, ensure_ascii=False, indent=4)
-    logger.info("Обновлено статей: %d в %s", len(articles), ARTICLES_OUTPUT_FILE)
-
 def collect_links_for_category(category_url, category_name, min_links=1000):
+    from selenium.webdriver.common.by import By
+
     logger.debug("Начало сбора ссылок для категории '%s' по URL: %s", category_name, category_url)
+    driver = get_driver()
     links_data = set()
     driver.get(category_url)
     time.sleep(1)
@@ -75,8 +99,6 @@ def collect_links_for_category(category_url, category_name, min_links=1000):
             logger.debug("Для категории '%s' собрано ссылок: %d", category_name, len(links_data))
         except Exception as e:
             logger.error("Ошибка при извлечении ссылок для категории '%s': %s", category_name, e)
-        current_links = [{"url": url, "category": category_name} for url in links_data]
-        save_links(current_links)
         if len(links_data) >= min_links:
             logger.info("Достигнут лимит ссылок для категории '%s': %d", category_name, len(links_data))
             break
@@ -90,22 +112,73 @@ def collect_links_for_category(category_url, category_name, min_links=1000):
             break
     return [{"url": url, "category": category_name} for url in links_data]
 
-def get_with_backoff(url, headers, max_retries=5, backoff_factor=1):
-    """Выполняет запрос с экспоненциальным бэкоффом при получении кода 429."""
-    retries = 0
-    while retries < max_retries:
-        try:
-            response = requests.get(url, headers=headers)
-            if response.status_code != 429:
-                return response
-            wait_time = backoff_factor * (4 ** retries)
-            logger.warning("Ошибка 429 для %s. Повтор через %d секунд...", url, wait_time)
-            time.sleep(wait_time)
-            retries += 1
-        except Exception as e:
-            logger.error("Исключение при запросе %s: %s", url, e)
-            return None
-    return response
+# ========== Сбор ссылок по HTTP ==========
+# Кнопка «Еще 20 материалов» подгружает HTML-фрагмент с адреса из ее data-url,
+# в конце каждого фрагмента лежит адрес следующего (data-next-url). Их и запрашиваем напрямую.
+
+def extract_list_links(html):
+    """
+    Разбирает страницу раздела или подгруженный фрагмент ленты.
+    Возвращает (ссылки на статьи по порядку, адрес следующей порции или None).
+    """
+    soup = BeautifulSoup(html, "lxml")
+    links = []
+    for elem in soup.select("a.list-item__title"):
+        url = urljoin(BASE_URL, elem.get("href", ""))
+        if elem.get("href") and url not in links:
+            links.append(url)
+
+    next_url = None
+    loaded = soup.select("[data-next-url]")
+    if loaded:
+        next_url = loaded[-1]["data-next-url"]
+    else:
+        more_button = soup.select_one("div.list-more[data-url]")
+        if more_button:
+            next_url = more_button["data-url"]
+    return links, urljoin(BASE_URL, next_url) if next_url else None
+
+async def iter_category_links(engine, category_url, category_name, min_links=1000, known=lambda url: False):
+    """
+    Листает ленту раздела через HTTP, пока не наберется min_links еще не сохраненных ссылок или лента не кончится.
+    При повторном обходе останавливается на ссылках, найденных в прошлый раз.
+    """
+    walk = ListingWalk(engine.state, "ria", category_name, known)
+    page_url, collected, seen = category_url, 0, set()
+    exhausted = False
+    while page_url and collected < min_links and not walk.done:
+        response = await engine.fetch(page_url, revalidate=walk.incremental)
+        if response is not None and response.status == 304:
+            walk.not_modified()
+            break
+        if response is None or not response.ok:
+            logger.error("Не удалось получить ленту '%s': %s", category_name, page_url)
+            return
+
+        links, page_url = extract_list_links(response.body)
+        if not links:
+            if not seen:
+                logger.warning("В ленте '%s' не найдено ссылок, попробуйте --browser", category_name)
+            exhausted = True
+            break
+        for url in walk.page(links):
+            if url in seen:
+                continue
+            seen.add(url)
+            yield {"url": url, "category": category_name}
+            # Уже сохраненные статьи не в счет, чтобы недобранный раздел добирался при следующем запуске
+            if known(url):
+                continue
+            collected += 1
+            if collected >= min_links:
+                break
+        logger.debug("Для категории '%s' собрано ссылок: %d", category_name, collected)
+        if page_url is None:
+            exhausted = True
+
+    # Лента, обрезанная по min_links, в следующий раз листается целиком
+    walk.finish(exhausted, capped=collected >= min_links)
+    logger.info("Для категории '%s' собрано %d ссылок", category_name, collected)
 
 def extract_full_text(soup):
     # Попытка найти контейнер с основным текстом
@@ -133,25 +206,18 @@ def extract_full_text(soup):
             text_parts.append(tag.get_text(" ", strip=True))
     return "\n".join(text_parts)
 
-def parse_article(article_url, category):
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1'
+}
+
+def extract_article(html, article_url, category):
     logger.debug("Парсинг статьи: %s", article_url)
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.9',
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Connection': 'keep-alive',
-        'Upgrade-Insecure-Requests': '1'
-    }
-    try:
-        response = get_with_backoff(article_url, headers=headers, max_retries=7, backoff_factor=2)
-        if not response or response.status_code != 200:
-            logger.error("Ошибка запроса %s: код %s", article_url, response.status_code if response else "None")
-            return None
-        soup = BeautifulSoup(response.content, "html.parser")
-    except Exception as e:
-        logger.error("Ошибка запроса %s: %s", article_url, e)
-        return None
+    soup = BeautifulSoup(html, "lxml")
 
     try:
         title_element = soup.select_one("h1.article__title")
@@ -187,64 +253,147 @@ def parse_article(article_url, category):
     return article_data
 
 
-def main():
-    collected_links = []
-    collected_articles = []
+class RiaSite(Site):
+    name = 'ria'
+    headers = HEADERS
 
-    # 1) Работа с файлом ria_links.json
+    def __init__(self, links=None, categories=CATEGORIES, min_links=TARGET_LINKS, pending=None):
+        """
+        links: готовый список ссылок (из файла или браузера); без него ссылки собираются по HTTP,
+        все разделы параллельно, и найденные добавляются в self.found_links.
+        pending: ссылки, собранные прошлыми запусками; еще не спаршенные из них скачиваются первыми,
+        потому что инкрементальный обход лент до них уже не дойдет.
+        """
+        self.links = links
+        self.categories = categories
+        self.min_links = min_links
+        self.pending = pending or []
+        self.found_links = []
+
+    async def discover_links(self, engine, writer):
+        known = lambda url: writer is not None and url in writer
+        queue = asyncio.Queue()
+
+        async def produce(cat):
+            try:
+                async for link in iter_category_links(engine, cat["url"], cat["category"], self.min_links, known):
+                    await queue.put(link)
+            except Exception as e:
+                logger.error("Ошибка при сборе ссылок для категории '%s': %s", cat["category"], e)
+            finally:
+                await queue.put(None)
+
+        tasks = [asyncio.create_task(produce(cat)) for cat in self.categories]
+        try:
+            remaining = len(tasks)
+            while remaining:
+                link = await queue.get()
+                if link is None:
+                    remaining -= 1
+                    continue
+                self.found_links.append(link)
+                yield link
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def discover(self, engine, writer):
+        if self.links is None:
+            scheduled = set()
+            pending = [link for link in self.pending if writer is None or link["url"] not in writer]
+            if pending:
+                logger.info("Из сохраненного списка осталось спарсить %d ссылок", len(pending))
+            for link_item in pending:
+                if link_item["url"] not in scheduled:
+                    scheduled.add(link_item["url"])
+                    yield link_item["url"], {"category": link_item["category"]}
+            # Статьи начинают скачиваться, пока ленты разделов еще листаются
+            async for link_item in self.discover_links(engine, writer):
+                if link_item["url"] not in scheduled and (writer is None or link_item["url"] not in writer):
+                    scheduled.add(link_item["url"])
+                    yield link_item["url"], {"category": link_item["category"]}
+            return
+
+        # Определяем, какие ссылки ещё не спарсены (по article_id == url)
+        missing_links = [link for link in self.links if writer is None or link["url"] not in writer]
+        logger.info("Будет спаршено %d новых статей из %d ссылок", len(missing_links), len(self.links))
+        for link_item in missing_links:
+            yield link_item["url"], {"category": link_item["category"]}
+
+    def extract(self, url, html, meta):
+        return extract_article(html, url, meta["category"])
+
+
+def load_links():
     if os.path.exists(LINKS_OUTPUT_FILE) and os.path.getsize(LINKS_OUTPUT_FILE) > 0:
         with open(LINKS_OUTPUT_FILE, "r", encoding="utf-8") as f:
-            collected_links = json.load(f)
-        logger.info("Считано %d ссылок из %s", len(collected_links), LINKS_OUTPUT_FILE)
-    else:
+            links = json.load(f)
+        logger.info("Считано %d ссылок из %s", len(links), LINKS_OUTPUT_FILE)
+        return links
+    return []
+
+def collect_links_with_browser():
+    collected_links = load_links()
+    if collected_links:
+        return collected_links
+    try:
         for cat in CATEGORIES:
             logger.info("Начало сбора ссылок для категории: %s", cat["category"])
             cat_links = collect_links_for_category(cat["url"], cat["category"], min_links=TARGET_LINKS)
             logger.info("Для категории '%s' собрано %d ссылок", cat["category"], len(cat_links))
             collected_links.extend(cat_links)
             save_links(collected_links)
+    finally:
+        close_driver()
+    return collected_links
+
+def main(replay=False, browser=False):
+    articles_log_file, articles_output_file = ARTICLES_LOG_FILE, ARTICLES_OUTPUT_FILE
 
-    # 2) Работа с файлом ria_articles.json
-    if os.path.exists(ARTICLES_OUTPUT_FILE) and os.path.getsize(ARTICLES_OUTPUT_FILE) > 0:
-        with open(ARTICLES_OUTPUT_FILE, "r", encoding="utf-8") as f:
-            collected_articles = json.load(f)
-        logger.info("Считано %d статей из %s", len(collected_articles), ARTICLES_OUTPUT_FILE)
+    # 1) Ссылки: по умолчанию ленты разделов листаются по HTTP прямо во время сбора статей.
+    # Браузер нужен только с --browser; при повторе из архива берется сохраненный список ссылок, если он есть
+    saved_links = load_links()
+    if browser:
+        site = RiaSite(collect_links_with_browser())
+    elif replay and saved_links:
+        site = RiaSite(saved_links)
     else:
-        collected_articles = []
-
-    # Определяем, какие ссылки ещё не спарсены (по article_id == url)
-    existing_article_ids = {article["article_id"] for article in collected_articles}
-    missing_links = [link for link in collected_links if link["url"] not in existing_article_ids]
-    logger.info("Будет спаршено %d новых статей из %d ссылок", len(missing_links), len(collected_links))
-
-    # Параллельный сбор статей для ускорения
-    def worker(link_item):
-        url = link_item.get("url")
-        category = link_item.get("category")
-        logging.info(f"Начинаем парсинг статьи {missing_links.index(link_item)+1}/{len(missing_links)}")
-        return parse_article(url, category)
-
-    results = []
-    hard_chunk_count = len(missing_links) // CHUNK_SIZE_ARTICLES
-    for idx in range(hard_chunk_count):
-        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-            results += list(executor.map(worker, missing_links[idx*CHUNK_SIZE_ARTICLES:(idx+1)*CHUNK_SIZE_ARTICLES]))
-            save_articles(collected_articles + [article for article in results if article])
-            logging.info(f"Сохраняем {len(results)}/{len(missing_links)} статей.")
-    if hard_chunk_count != len(missing_links) / CHUNK_SIZE_ARTICLES:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-            results += list(executor.map(worker, missing_links[hard_chunk_count*CHUNK_SIZE_ARTICLES:-1]))
-            save_articles(collected_articles + [article for article in results if article])
-            logging.info(f"Сохраняем {len(results)}/{len(missing_links)} статей.")
-
-    new_articles = [article for article in results if article is not None]
-    logger.info("Спаршено %d новых статей", len(new_articles))
-    collected_articles.extend(new_articles)
-    save_articles(collected_articles)
+        # Ссылки прошлых запусков, которые так и не спарсили, идут в работу вместе с новыми
+        site = RiaSite(pending=saved_links)
+
+    # При повторном извлечении из архива ответов статьи пишутся в отдельный лог и датасет
+    if replay:
+        articles_log_file, articles_output_file = reset_replay_log(articles_log_file), replay_path(articles_output_file)
+
+    # 2) Лог статей: при перезапуске читается только индекс уже спарсенных ссылок
+    state = CrawlState(STATE_FILE) if not replay else None
+    with JsonlArticleWriter(articles_log_file, fsync_every=CHUNK_SIZE_ARTICLES) as writer, \
+            ResponseArchive(RESPONSES_ARCHIVE_FILE) as archive:
+        if not replay and not len(writer) and os.path.exists(ARTICLES_OUTPUT_FILE) \
+                and os.path.getsize(ARTICLES_OUTPUT_FILE) > 0:
+            writer.import_records(ARTICLES_OUTPUT_FILE)
+
+        # Параллельный сбор статей: темп подстраивается под ответы сайта (снижается при 429 и учитывает
+        # Retry-After), повторы с экспоненциальной паузой делает общий движок, все ответы сохраняются в архив
+        new_count = crawl_site(site, writer, workers=10, extract_workers=EXTRACT_WORKERS,
+                               per_host_concurrency=10, per_host_rate=5.0, adaptive=AimdPolicy(max_rate=MAX_RATE),
+                               retry=RetryPolicy(max_retries=7, backoff_factor=2, retry_statuses=(429,)),
+                               archive=archive, replay=replay, state=state)
+    if state is not None:
+        state.close()
+
+    # Новые ссылки дописываются к сохраненному списку один раз, в конце
+    if site.found_links and not replay:
+        saved_links = load_links()
+        known_urls = {link["url"] for link in saved_links}
+        save_links(saved_links + [link for link in site.found_links if link["url"] not in known_urls])
+
+    logger.info("Спаршено %d новых статей", new_count)
+    compact(articles_log_file, articles_output_file)
 
 if __name__ == "__main__":
-    try:
-        main()
-    finally:
-        logger.info("Закрытие драйвера")
-        driver.quit()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--replay', action='store_true', help='извлечь статьи заново из архива ответов, без сети')
+    parser.add_argument('--browser', action='store_true', help='собирать ссылки через Chrome, а не по HTTP')
+    args = parser.parse_args()
+    main(replay=args.replay, browser=args.browser)
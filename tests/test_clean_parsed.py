@@ -0,0 +1,29 @@
+import pytest
+
+from src.parser.clean_parsed import canonicalize_url, url_hash
+
+
+@pytest.mark.parametrize('url', [
+    'https://ria.ru/search?fromDate=20250101',
+    'https://example.com/doc?reference=42',
+    'https://example.com/page?refresh=1',
+    'https://example.com/feed?rss_id=7',
+    'https://example.com/list?fromage=brie',
+])
+def test_params_that_only_start_like_tracking_ones_are_kept(url):
+    assert canonicalize_url(url) == url
+
+
+@pytest.mark.parametrize('url', [
+    'https://www.example.com/news/1/?utm_source=tg&utm_medium=post',
+    'http://example.com/news/1?from=main',
+    'https://example.com/news/1?rss=1&ref=feed#comments',
+    'https://example.com/news/1?fbclid=abc&ysclid=xyz',
+])
+def test_tracking_params_are_dropped(url):
+    assert canonicalize_url(url) == 'https://example.com/news/1'
+
+
+def test_distinct_articles_keep_distinct_hashes():
+    assert url_hash('https://example.com/list?reference=1') != url_hash('https://example.com/list?reference=2')
+    assert url_hash('https://example.com/a?b=2&a=1') == url_hash('https://example.com/a?a=1&b=2&utm_campaign=x')
@@ -0,0 +1,62 @@
+from src.parser.crawl_state import CrawlState, ListingWalk
+
+LISTING = ['a9', 'a8', 'a7', 'a6', 'a5', 'a4', 'a3', 'a2', 'a1']
+
+
+def walk_pages(walk, pages, take=None):
+    """Feeds the pages to the walk like a parser does; take caps the number of items taken."""
+    taken = []
+    for ids in pages:
+        if walk.done or (take is not None and len(taken) >= take):
+            break
+        taken.extend(walk.page(ids)[:None if take is None else take - len(taken)])
+    return taken
+
+
+def test_full_pass_sets_the_frontier(tmp_path):
+    with CrawlState(tmp_path / 'state.sqlite') as state:
+        walk = ListingWalk(state, 'site', 'news')
+        walk_pages(walk, [LISTING[:3], LISTING[3:6], LISTING[6:]])
+        walk.finish(exhausted=True)
+        assert state.frontier('site', 'news') == ('a9', True)
+
+
+def test_capped_first_pass_stays_full(tmp_path):
+    with CrawlState(tmp_path / 'state.sqlite') as state:
+        walk = ListingWalk(state, 'site', 'news')
+        assert walk_pages(walk, [LISTING[:3], LISTING[3:6], LISTING[6:]], take=4) == ['a9', 'a8', 'a7', 'a6']
+        walk.finish(exhausted=False, capped=True)
+        assert state.frontier('site', 'news') == (None, False)
+
+        # The next pass walks the whole listing again and reaches the older items
+        walk = ListingWalk(state, 'site', 'news')
+        assert not walk.incremental
+        assert walk_pages(walk, [LISTING[:3], LISTING[3:6], LISTING[6:]]) == LISTING
+
+
+def test_capped_incremental_pass_keeps_the_old_frontier(tmp_path):
+    with CrawlState(tmp_path / 'state.sqlite') as state:
+        state.set_frontier('site', 'news', 'a3', True)
+        walk = ListingWalk(state, 'site', 'news')
+        assert walk.incremental
+        walk_pages(walk, [LISTING[:3], LISTING[3:6], LISTING[6:]], take=2)
+        walk.finish(exhausted=False, capped=True)
+        # a7..a4 were not taken: the next pass must not stop at a9
+        assert state.frontier('site', 'news') == ('a3', False)
+
+
+def test_incremental_pass_stops_at_the_frontier(tmp_path):
+    with CrawlState(tmp_path / 'state.sqlite') as state:
+        state.set_frontier('site', 'news', 'a6', True)
+        walk = ListingWalk(state, 'site', 'news')
+        assert walk_pages(walk, [LISTING[:3], LISTING[3:6], LISTING[6:]]) == ['a9', 'a8', 'a7']
+        walk.finish(exhausted=False)
+        assert state.frontier('site', 'news') == ('a9', True)
+
+
+def test_page_limit_is_not_the_end_of_the_listing(tmp_path):
+    with CrawlState(tmp_path / 'state.sqlite') as state:
+        walk = ListingWalk(state, 'site', 'news')
+        walk_pages(walk, [LISTING[:3]])
+        walk.finish(exhausted=False)
+        assert state.frontier('site', 'news') == (None, False)
@@ -0,0 +1,43 @@
+from src.parser.jsonl_writer import JsonlArticleWriter, compact
+from src.json_stream import iter_json_records
+
+
+def test_int_ids_are_known_after_a_restart(tmp_path):
+    log = tmp_path / 'articles.jsonl'
+    with JsonlArticleWriter(log) as writer:
+        assert writer.write({'article_id': 1, 'category': 'world'})
+        assert writer.write({'article_id': 2, 'category': 'world'})
+        assert not writer.write({'article_id': 1, 'category': 'world'})
+
+    with JsonlArticleWriter(log) as writer:
+        assert 1 in writer and '1' in writer
+        assert not writer.write({'article_id': 1, 'category': 'world'})
+        assert writer.write({'article_id': 3, 'category': 'tech'})
+        assert writer.key_counts == {'world': 2, 'tech': 1}
+
+    assert [record['article_id'] for record in iter_json_records(log)] == [1, 2, 3]
+
+
+def test_missing_ids_and_keys(tmp_path):
+    log = tmp_path / 'articles.jsonl'
+    with JsonlArticleWriter(log) as writer:
+        assert not writer.write({'article_id': None, 'category': 'world'})
+        assert None not in writer
+        assert writer.write({'article_id': 'a', 'category': None})
+        assert writer.key_counts == {'': 1}
+
+    assert 'None' not in (tmp_path / 'articles.jsonl.ids').read_text(encoding='utf-8')
+    with JsonlArticleWriter(log) as writer:
+        assert len(writer) == 1 and writer.key_counts == {'': 1}
+
+
+def test_index_is_rebuilt_with_string_ids(tmp_path):
+    log = tmp_path / 'articles.jsonl'
+    with JsonlArticleWriter(log) as writer:
+        writer.write({'article_id': 7, 'category': 'world'})
+    (tmp_path / 'articles.jsonl.ids').unlink()
+
+    with JsonlArticleWriter(log) as writer:
+        assert 7 in writer
+        assert not writer.write({'article_id': 7, 'category': 'world'})
+    assert compact(log, tmp_path / 'articles.json') == 1
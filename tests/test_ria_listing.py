@@ -0,0 +1,79 @@
+import asyncio
+from pathlib import Path
+
+from src.parser.crawl_engine import FetchResult
+from src.parser.crawl_state import CrawlState
+from src.parser.ria_parser import RiaSite, iter_category_links
+
+FIXTURES = Path(__file__).parent / 'fixtures' / 'ria'
+CATEGORY_URL = 'https://ria.ru/politics'
+PAGES = {
+    CATEGORY_URL: 'politics.html',
+    'https://ria.ru/services/politics/more.html?id=1999&date=20250228T120000': 'politics_more_1.html',
+    'https://ria.ru/services/politics/more.html?id=1997&date=20250227T090000': 'politics_more_2.html',
+}
+LISTING = [
+    'https://ria.ru/20250301/sammit-2001.html',
+    'https://ria.ru/20250301/vybory-2000.html',
+    'https://ria.ru/20250228/zakon-1999.html',
+    'https://ria.ru/20250228/vizit-1998.html',
+    'https://ria.ru/20250227/peregovory-1997.html',
+    'https://ria.ru/20250227/soveshchanie-1996.html',
+    'https://ria.ru/20250226/zayavlenie-1995.html',
+]
+
+
+class FixtureEngine:
+    """Serves the listing pages from tests/fixtures/ria instead of the network."""
+    def __init__(self, state=None):
+        self.state = state
+        self.requested = []
+
+    async def fetch(self, url, headers=None, revalidate=False):
+        self.requested.append(url)
+        if url not in PAGES:
+            return FetchResult(url, 404, b'', {}, 0.0)
+        return FetchResult(url, 200, (FIXTURES / PAGES[url]).read_bytes(), {}, 0.0)
+
+
+def collect(engine, min_links=1000, known=lambda url: False):
+    async def run():
+        return [link async for link in iter_category_links(engine, CATEGORY_URL, 'politics', min_links, known)]
+    return asyncio.run(run())
+
+
+def test_follows_data_url_and_data_next_url():
+    engine = FixtureEngine()
+    links = collect(engine)
+    assert [link['url'] for link in links] == LISTING
+    assert {link['category'] for link in links} == {'politics'}
+    # The page, the fragment from the button's data-url, the one from data-next-url; the last has no next
+    assert engine.requested == list(PAGES)
+
+
+def test_stops_at_min_links():
+    engine = FixtureEngine()
+    assert [link['url'] for link in collect(engine, min_links=2)] == LISTING[:2]
+    assert engine.requested == [CATEGORY_URL]
+
+
+def test_recrawl_stops_at_the_previous_frontier(tmp_path):
+    with CrawlState(tmp_path / 'state.sqlite') as state:
+        collect(FixtureEngine(state))
+        assert state.frontier('ria', 'politics') == (LISTING[0], True)
+        # Nothing new on the first page: the second pass does not page further
+        engine = FixtureEngine(state)
+        assert collect(engine) == []
+        assert engine.requested == [CATEGORY_URL]
+
+
+def test_saved_links_are_parsed_before_new_ones():
+    saved = [{'url': LISTING[6], 'category': 'politics'}, {'url': LISTING[5], 'category': 'politics'}]
+    writer = {LISTING[5], LISTING[0]}  # already parsed
+    site = RiaSite(categories=[{'url': CATEGORY_URL, 'category': 'politics'}], pending=saved)
+
+    async def run():
+        return [url async for url, _ in site.discover(FixtureEngine(), writer)]
+    urls = asyncio.run(run())
+    assert urls[0] == LISTING[6]
+    assert sorted(urls) == sorted(set(LISTING) - writer)